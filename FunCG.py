@@ -1,6 +1,87 @@
+import numpy as np
 import streamlit as st
-from functions import tokenize, Parser, evaluate
-from graphing_utilities import plot_function
+import functions
+import result_cache
+from expression_cache import get_expression
+from functions import EvaluationMaxSteps, EvaluationTimeout
+from service import evaluate_expression
+from graphing_utilities import sample_plots, flame_chart
+from rendering import plot_figure, chart_data
+from profiler import profile_expression
+from cost import check_cost
+from budget import BudgetExceeded
+from jobs import submit
+from tiles import Viewport, ZOOM_FACTOR, PAN_FRACTION
+
+# Points of the graph range the profiler evaluates in graph mode
+PROFILE_POINTS = 200
+
+# Seconds between updates of a running calculation's progress
+JOB_POLL_INTERVAL = 0.5
+# Units of the steps the evaluation loops tick, by construct (see budget.py)
+PROGRESS_UNITS = {"points": "points sampled", "plot": "points evaluated", "sum": "terms", "product": "terms",
+                  "integral": "integrand evaluations", "lim": "evaluations", "factorial": "factors"}
+
+# The app keeps results across sessions and restarts (see result_cache.py)
+functions.ResultCachePath = result_cache.DEFAULT_PATH
+
+# The graph window lives in session state, so zooming and panning survive reruns
+VIEWPORT_KEYS = ("x_min", "x_max", "y_min", "y_max")
+
+def current_viewport():
+    return Viewport(*(st.session_state[key] for key in VIEWPORT_KEYS))
+
+def set_viewport(viewport):
+    for key, value in zip(VIEWPORT_KEYS, viewport.bounds()):
+        st.session_state[key] = value
+
+def move_viewport(transform):
+    """Button callback: replace the viewport with transform(viewport), unless the bounds are invalid"""
+    try:
+        set_viewport(transform(current_viewport()))
+    except ValueError:
+        pass
+
+def calculate(cached, profile_every=None):
+    """Background job of simple mode: the result, and its profile if profile_every is set"""
+    # Results computed before, by any session, come from the result cache
+    outcome = evaluate_expression(cached)
+    profiles = [profile_expression(cached.ast, sample_every=profile_every)] if profile_every else []
+    return outcome, profiles
+
+def draw(curves, viewport, num_points, profile_every=None):
+    """Background job of graph mode: the curves sampled on one grid, and their profiles if profile_every is set"""
+    # All curves share one adaptive grid and their common subexpressions
+    samples = sample_plots([curve.ast for curve in curves], *viewport.bounds(), max_points=num_points,
+                           cache_key=tuple((curve.text, curve.backend.name) for curve in curves))
+    profiles = []
+    if profile_every:
+        x_values = [viewport.x_min + viewport.width * i / (PROFILE_POINTS - 1) for i in range(PROFILE_POINTS)]
+        profiles = [profile_expression(curve.ast, [{"x": x} for x in x_values], sample_every=profile_every)
+                    for curve in curves]
+    return samples, profiles
+
+def describe_progress(progress) -> str:
+    """The steps a job ticked so far, busiest construct first"""
+    parts = []
+    for label, steps in sorted(progress.items(), key=lambda item: -item[1]):
+        unit = PROGRESS_UNITS.get(label.split("(")[0], "steps")
+        parts.append(f"{steps:,} {unit} in {label}" if "(" in label else f"{steps:,} {unit}")
+    return " · ".join(parts) or "Starting…"
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def job_progress(job):
+    """Live progress of a running job with a button cancelling it; reruns the app once it is done"""
+    if job.done():
+        st.rerun()
+    # How much work is left is unknown, so this shows the work done rather than a fraction
+    with st.status(f"Calculating… {job.elapsed():.1f} s (stopped after {EvaluationTimeout:g} s)",
+                   state="running", expanded=True):
+        st.caption(describe_progress(job.progress()))
+    st.button("Cancel", on_click=job.cancel, key=f"cancel_{job.id}")
+
+for key, value in zip(VIEWPORT_KEYS, Viewport().bounds()):
+    st.session_state.setdefault(key, value)
 
 st.set_page_config(page_title="GraphMaker Calculator", layout="wide")
 
@@ -15,11 +96,11 @@ tab1, tab2 = st.tabs(["Instructions", "Graph / Calculator"])
 # Instructions tab
 # ---------------------------
 with tab1:
-    st.markdown("""
+    st.markdown(f"""
 ### Calculator Usage Guide
 
 **Basic arithmetic:** `+`, `-`, `*`, `/`, `^`  
-**Constants:** `pi`, `e`, `inf` (represents 10^8)  
+**Constants:** `pi`, `e`, `inf` (represents 10^8; `integral`, `sum` and `product` treat it as a true infinite bound)  
 **Variables:** any single letter (use `x` for graphing)
 
 ### Functions
@@ -43,9 +124,11 @@ with tab1:
 **Functions Mode**
 - Enter a function of `x`
 - Example: `x^2`, `sin(x)`
-- Fixed bounds: (in the future custom bounds will be implemented)
-  - x ∈ [-10, 10]
-  - y ∈ [-8, 8]
+- Several curves are drawn on one graph when separated by semicolons, e.g. `sin(x); cos(x); sin(x) - cos(x)`
+- Bounds default to x ∈ [-10, 10] and y ∈ [-8, 8]; set them directly or zoom and pan with the buttons
+- Panning and zooming back reuse the parts of the graph already computed
+- The interactive chart is drawn by the browser from a reduced set of points, at most a few per pixel column
+- Points are placed adaptively, densest where the curve bends or jumps; the number of points is an upper limit
 
 ### Writing Rules
 - Use parentheses for grouping
@@ -55,6 +138,8 @@ with tab1:
                 
 ### WARNINGS
 - Although the calculations are fairly accurate (every result has a minimum of 1-2 correct decimals), errors 'might' still happen
+- Expressions estimated to take too long are rejected before running, and running calculations are stopped after {EvaluationTimeout:g} seconds
+- Calculations run in the background and show their progress; **Cancel** stops one right away
 """)
 
 # ---------------------------
@@ -70,11 +155,20 @@ with tab2:
         horizontal=True
     )
 
+    profile_enabled = st.checkbox("Profile evaluation")
+    if profile_enabled:
+        sample_every = st.number_input(
+            "Time every Nth call of each node (higher means less overhead)",
+            min_value=1,
+            max_value=1000,
+            value=1
+        )
+
     if mode.startswith("Functions"):
         col1, col2 = st.columns([4, 1])  # 4:1 width ratio
         with col2:
             num_points = st.number_input(
-            "Number of points for graph",
+            "Max points for graph (sampled adaptively)",
             min_value=1000,
             max_value=100000,
             value=10000,
@@ -82,23 +176,87 @@ with tab2:
             )
     
         with col1:
-            expr = st.text_input("Enter expression", placeholder="x^2 or sin(x)")
+            expr = st.text_input("Enter expression", placeholder="x^2 or sin(x); separate several curves with ;")
+
+        for column, key in zip(st.columns(4), VIEWPORT_KEYS):
+            with column:
+                st.number_input(key.replace("_", " "), key=key, format="%.6g")
+
+        zoom_in, zoom_out, left, right, up, down, reset = st.columns(7)
+        zoom_in.button("Zoom in", on_click=move_viewport, args=(lambda v: v.zoom(ZOOM_FACTOR),))
+        zoom_out.button("Zoom out", on_click=move_viewport, args=(lambda v: v.zoom(1 / ZOOM_FACTOR),))
+        left.button("← Left", on_click=move_viewport, args=(lambda v: v.pan(dx=-PAN_FRACTION),))
+        right.button("Right →", on_click=move_viewport, args=(lambda v: v.pan(dx=PAN_FRACTION),))
+        up.button("↑ Up", on_click=move_viewport, args=(lambda v: v.pan(dy=PAN_FRACTION),))
+        down.button("↓ Down", on_click=move_viewport, args=(lambda v: v.pan(dy=-PAN_FRACTION),))
+        reset.button("Reset", on_click=set_viewport, args=(Viewport(),))
+
+        interactive_chart = st.checkbox("Interactive chart (draws the reduced curve in the browser)")
     else:
         expr = st.text_input("Enter expression", placeholder="x^2 or sin(x)")
 
-    if st.button("Calculate / Plot"):
+    plot_requested = st.button("Calculate / Plot")
+    if plot_requested:
+        st.session_state.calc_expr = (mode, expr)
+    # Any rerun, e.g. from zooming or panning or while a calculation runs, shows the last requested one
+    redraw = expr.strip() and st.session_state.get("calc_expr") == (mode, expr)
+
+    if plot_requested or redraw:
 
         if not expr.strip():
             st.error("Please enter an expression.")
             st.stop()
 
         try:
-            tokens = tokenize(expr)
-            ast = Parser(tokens).parse()
+            # Reject expressions that would hold the server too long before running anything
+            if mode.startswith("Simple"):
+                cached = get_expression(expr)
+                check_cost(cached.ast)
+                curves = [cached]
+            else:
+                viewport = current_viewport()
+                # Curves are separated by semicolons; one that fails to parse or
+                # is too expensive is left out without blanking the others
+                curves = []
+                for text in dict.fromkeys(part.strip() for part in expr.split(";") if part.strip()):
+                    try:
+                        curve = get_expression(text)
+                        check_cost(curve.ast, points=num_points, x_range=(viewport.x_min, viewport.x_max))
+                        curves.append(curve)
+                    except Exception as e:
+                        st.warning(f"{text}: {e}")
+                if not curves:
+                    raise ValueError("No expression left to plot")
+
+            # The calculation runs as a background job kept in session state; a rerun
+            # with the same inputs picks it up instead of starting it again
+            profile_every = sample_every if profile_enabled else None
+            if mode.startswith("Simple"):
+                request = (mode, expr, profile_every)
+            else:
+                request = (mode, expr, viewport.bounds(), num_points, profile_every)
+            job = st.session_state.get("job")
+            if job is None or st.session_state.get("job_request") != request or (plot_requested and job.done()):
+                if job is not None:
+                    job.cancel()
+                if mode.startswith("Simple"):
+                    job = submit(calculate, cached, profile_every, max_steps=EvaluationMaxSteps,
+                                 timeout=EvaluationTimeout, description=expr)
+                else:
+                    job = submit(draw, curves, viewport, num_points, profile_every, max_steps=EvaluationMaxSteps,
+                                 timeout=EvaluationTimeout, description=expr)
+                st.session_state.job = job
+                st.session_state.job_request = request
+
+            if not job.done():
+                job_progress(job)
+                st.stop()
+            result, profiles = job.result()
 
             # ---------------- SIMPLE MODE
             if mode.startswith("Simple"):
-                result = evaluate(ast)
+                outcome = result
+                result = outcome["result"]
 
                 if isinstance(result, float):
                     if result.is_integer():
@@ -107,12 +265,50 @@ with tab2:
                         result = round(result, 6)
 
                 st.success(f"Result: {result}")
+                if "evaluations" in outcome:
+                    st.caption(f"Integral error estimate: {outcome['error_estimate']:.2e} "
+                               f"({outcome['evaluations']} evaluations)")
+                    if not outcome["converged"]:
+                        st.warning("The integral did not reach the requested tolerance within its evaluation budget.")
+                if "terms" in outcome:
+                    st.caption(f"Series error estimate: {outcome['error_estimate']:.2e} "
+                               f"({outcome['terms']} terms)")
+                    if not outcome["converged"]:
+                        st.warning("The series did not reach the requested tolerance within its term budget.")
 
             # ---------------- GRAPH MODE
             else:
-                fig = plot_function(ast)
-                st.pyplot(fig)
+                x_values, y_values = result
+                labels = [curve.text for curve in curves] if len(curves) > 1 else None
+                for curve, row in zip(curves, y_values):
+                    if np.isnan(row).all():
+                        st.warning(f"{curve.text}: no valid values in the visible range")
+                if interactive_chart:
+                    data = chart_data(x_values, y_values, viewport.x_min, viewport.x_max, labels=[f"y = {curve.text}" for curve in curves])
+                    st.line_chart(data, x="x", y=list(data)[1:])
+                else:
+                    st.pyplot(plot_figure(x_values, y_values, *viewport.bounds(), labels))
+
+            nodes_before = sum(curve.stats.nodes_before for curve in curves)
+            nodes_after = sum(curve.stats.nodes_after for curve in curves)
+            st.caption(f"AST nodes: {nodes_before} → {nodes_after} after optimization · "
+                       f"calculated in {job.elapsed():.2f} s")
+
+            # ---------------- PROFILE
+            if profiles:
+                with st.expander("Performance", expanded=True):
+                    for curve, profile in zip(curves, profiles):
+                        if len(curves) > 1:
+                            st.markdown(f"**{curve.text}**")
+                        if not mode.startswith("Simple"):
+                            st.caption(f"Scalar evaluation at {PROFILE_POINTS} points of the graph")
+                        st.pyplot(flame_chart(profile))
+                        st.caption(f"{profile.evaluations} evaluations ({profile.errors} failed) in "
+                                   f"{profile.wall_time * 1000:.1f} ms, including profiling overhead")
+                        st.dataframe(profile.rows())
 
+        except BudgetExceeded as e:
+            st.error(f"Evaluation stopped: {e}")
         except Exception as e:
             st.error(f"Error: {e}")
 
@@ -0,0 +1,374 @@
+import math
+from fractions import Fraction
+import numpy as np
+from functions import NumberNode, VariableNode, BinaryOpNode, NegateNode, SigmaSumNode, IntegralNode, LimitNode
+import kernels
+import parallel
+import cost
+from budget import current_budget, BudgetExceeded
+from ast_tools import walk, count_nodes, free_variables, may_be_int, node_label
+from vectorized import evaluate_array
+
+# Fast paths for large finite sum() and product().
+#
+# - Summands that are polynomials in the index, such as k^3 - 2*k, are summed
+#   in closed form with Faulhaber's formula, exactly, in Fractions. The result
+#   is an int (or Fraction) when the loop would have produced one and the
+#   correctly rounded float otherwise.
+# - Geometric summands c * q^k are summed with the geometric series formula.
+# - Other float-valued summands are evaluated by the vectorized engine over
+#   CHUNK_SIZE indices at a time and added with math.fsum. Products of floats
+#   are reduced in the log domain, raising OverflowError when the result does
+#   not fit in a float.
+#
+# Every fast path returns NotImplemented when it does not apply at run time,
+# e.g. when a term is not finite, and the caller then runs its plain loop,
+# which reproduces the scalar engine's errors exactly. Chunk boundaries only
+# depend on the index range, so splitting the chunks across workers gives the
+# same result; large loops do that through parallel.py. Each chunk ticks the
+# evaluation budget by its number of terms.
+
+CHUNK_SIZE = 1 << 16
+MAX_POLYNOMIAL_DEGREE = 64
+
+def sum_fast_path(node, compile, backend):
+    """A callable fast(variables, start, stop) for the SigmaSumNode, or None.
+
+    compile turns index-free subtrees into callables, as compiler.compile(),
+    and backend is the kernel backend they are compiled for.
+    """
+    var = _index(node)
+    if var is None:
+        return None
+    polynomial = _polynomial(node.expr, var, compile, {})
+    if polynomial is not None:
+        return _closed_form_sum(polynomial[1])
+    geometric = _geometric(node.expr, var, compile, backend, {})
+    if geometric is not None:
+        return _geometric_sum(geometric)
+    if _vectorizable(node.expr, var):
+        return _chunked(node, var, backend, _sum_part, _sum_combine)
+    return None
+
+def product_fast_path(node, backend):
+    """A callable fast(variables, start, stop) for the ProductNode, or None"""
+    var = _index(node)
+    if var is None or not _vectorizable(node.expr, var):
+        return None
+    return _chunked(node, var, backend, _product_part, _product_combine)
+
+def fast_path_kind(node, backend=None):
+    """'closed form', 'chunked' or None: the fast path a large sum or product would try"""
+    var = _index(node)
+    if var is None:
+        return None
+    if isinstance(node, SigmaSumNode):
+        backend = kernels.get_backend(backend)
+        no_compile = lambda subtree: None
+        if (_polynomial(node.expr, var, no_compile, {}) is not None
+                or _geometric(node.expr, var, no_compile, backend, {}) is not None):
+            return 'closed form'
+    return 'chunked' if _vectorizable(node.expr, var) else None
+
+def _index(node):
+    var = node.var
+    if isinstance(var, str) and var == var.lower():
+        return var
+    return None
+
+# ---------------------------------------------------------------- closed forms
+
+def _polynomial(node, var, compile, cache):
+    """(degree, coefficients) when node is a polynomial in var, else None.
+
+    coefficients(variables) returns the exact coefficients, lowest degree
+    first, and whether the loop would have produced float terms.
+    """
+    if var not in free_variables(node, cache):
+        f = compile(node)
+        def constant(variables):
+            value = f(variables)
+            return [_exact(value)], isinstance(value, float)
+        return 0, constant
+    if isinstance(node, VariableNode):
+        return 1, lambda variables: ([0, 1], False)
+    if isinstance(node, NegateNode):
+        operand = _polynomial(node.operand, var, compile, cache)
+        if operand is None:
+            return None
+        degree, coefficients = operand
+        def negated(variables):
+            cs, is_float = coefficients(variables)
+            return [-c for c in cs], is_float
+        return degree, negated
+    if not isinstance(node, BinaryOpNode):
+        return None
+
+    if node.op == '^':
+        exponent = node.right
+        if not isinstance(exponent, NumberNode) or not isinstance(exponent.value, (int, float)):
+            return None
+        p = exponent.value
+        if p != int(p) or not 0 <= p <= MAX_POLYNOMIAL_DEGREE:
+            return None
+        base = _polynomial(node.left, var, compile, cache)
+        if base is None or base[0] * int(p) > MAX_POLYNOMIAL_DEGREE:
+            return None
+        p = int(p)
+        degree, coefficients = base
+        def raised(variables):
+            b, _ = coefficients(variables)
+            result = [1]
+            for _ in range(p):
+                result = _multiply(result, b)
+            # power() always returns a float
+            return result, True
+        return degree * p, raised
+
+    left = _polynomial(node.left, var, compile, cache)
+    right = _polynomial(node.right, var, compile, cache)
+    if left is None or right is None:
+        return None
+    (left_degree, left_coefficients), (right_degree, right_coefficients) = left, right
+    if node.op in ('+', '-'):
+        sign = 1 if node.op == '+' else -1
+        def added(variables):
+            a, a_float = left_coefficients(variables)
+            b, b_float = right_coefficients(variables)
+            return _add(a, b, sign), a_float or b_float
+        return max(left_degree, right_degree), added
+    elif node.op == '*':
+        if left_degree + right_degree > MAX_POLYNOMIAL_DEGREE:
+            return None
+        def multiplied(variables):
+            a, a_float = left_coefficients(variables)
+            b, b_float = right_coefficients(variables)
+            return _multiply(a, b), a_float or b_float
+        return left_degree + right_degree, multiplied
+    elif node.op == '/' and right_degree == 0:
+        def divided(variables):
+            a, _ = left_coefficients(variables)
+            divisor = right_coefficients(variables)[0][0]
+            if divisor == 0:
+                raise ZeroDivisionError('division by zero')
+            return [Fraction(c) / divisor for c in a], True
+        return left_degree, divided
+    return None
+
+def _add(a, b, sign):
+    if len(a) < len(b):
+        a = a + [0] * (len(b) - len(a))
+    return [x + sign * (b[i] if i < len(b) else 0) for i, x in enumerate(a)]
+
+def _multiply(a, b):
+    result = [0] * (len(a) + len(b) - 1)
+    for i, x in enumerate(a):
+        for j, y in enumerate(b):
+            result[i + j] += x * y
+    return result
+
+def _exact(value):
+    if isinstance(value, (int, Fraction)):
+        return value
+    return Fraction(value)
+
+_bernoulli = [Fraction(1)]
+
+def bernoulli(n : int) -> Fraction:
+    """Bernoulli number B_n, with B_1 = +1/2"""
+    while len(_bernoulli) <= n:
+        m = len(_bernoulli)
+        _bernoulli.append(1 - sum(math.comb(m, k) * _bernoulli[k] / (m - k + 1) for k in range(m)))
+    return _bernoulli[n]
+
+def power_sum(p : int, n : int):
+    """0^p + 1^p + ... + n^p, exactly, for n >= 0 (with 0^0 = 1)"""
+    total = sum(math.comb(p + 1, k) * bernoulli(k) * n ** (p + 1 - k) for k in range(p + 1))
+    total = Fraction(total, p + 1)
+    if p == 0:
+        total += 1
+    return total
+
+def _closed_form_sum(coefficients):
+    def fast(variables, start, stop):
+        try:
+            cs, is_float = coefficients(variables)
+        except (OverflowError, ValueError):
+            # inf or nan coefficients
+            return NotImplemented
+        # Shift the index to j = k - start, so the sum runs over j = 0 .. stop - start
+        shifted = [0] * len(cs)
+        for i, c in enumerate(cs):
+            if c:
+                for j in range(i + 1):
+                    shifted[j] += c * math.comb(i, j) * start ** (i - j)
+        total = Fraction(sum(c * power_sum(j, stop - start) for j, c in enumerate(shifted) if c))
+        if is_float:
+            try:
+                return float(total)
+            except OverflowError:
+                return NotImplemented
+        return int(total) if total.denominator == 1 else total
+    return fast
+
+def _geometric(node, var, compile, backend, cache):
+    """coefficients(variables) -> (c, q) when node is c * q^k, else None"""
+    if isinstance(node, NegateNode):
+        operand = _geometric(node.operand, var, compile, backend, cache)
+        if operand is None:
+            return None
+        return lambda variables: _scaled(operand(variables), -1)
+    if not isinstance(node, BinaryOpNode):
+        return None
+    if node.op == '^' and var not in free_variables(node.left, cache):
+        exponent = _polynomial(node.right, var, compile, cache)
+        if exponent is None or exponent[0] != 1:
+            return None
+        base = compile(node.left)
+        coefficients = exponent[1]
+        power = backend.power
+        def geometric(variables):
+            b = base(variables)
+            (offset, slope), _ = coefficients(variables)
+            return power(b, float(offset)), power(b, float(slope))
+        return geometric
+    if node.op not in ('*', '/'):
+        return None
+    if var not in free_variables(node.right, cache):
+        term, scale = _geometric(node.left, var, compile, backend, cache), compile(node.right)
+        divide = node.op == '/'
+    elif var not in free_variables(node.left, cache):
+        term, scale = _geometric(node.right, var, compile, backend, cache), compile(node.left)
+        divide = False
+        if node.op == '/' and term is not None:
+            # s / (c * q^k) = (s / c) * (1 / q)^k
+            def reciprocal(variables, term=term):
+                c, q = term(variables)
+                return 1 / c, 1 / q
+            term = reciprocal
+    else:
+        return None
+    if term is None:
+        return None
+    def scaled(variables):
+        s = scale(variables)
+        return _scaled(term(variables), 1 / s if divide else s)
+    return scaled
+
+def _scaled(cq, s):
+    c, q = cq
+    return c * s, q
+
+def _geometric_sum(coefficients):
+    def fast(variables, start, stop):
+        try:
+            c, q = coefficients(variables)
+            c, q = float(c), float(q)
+            count = stop - start + 1
+            if q == 1:
+                return c * count
+            if q > 0 and abs(count * math.log1p(q - 1)) < 1:
+                # expm1/log1p keep full precision for q close to 1
+                series = math.expm1(count * math.log1p(q - 1)) / (q - 1)
+            else:
+                series = (math.pow(q, count) - 1) / (q - 1)
+            value = c * math.pow(q, start) * series
+        except (OverflowError, ZeroDivisionError, ValueError):
+            return NotImplemented
+        return value if math.isfinite(value) else NotImplemented
+    return fast
+
+# ------------------------------------------------------------- chunked arrays
+
+def _vectorizable(body, var) -> bool:
+    """Whether the vectorized engine evaluates body to the loop's float values"""
+    if may_be_int(body, {var}):
+        # Int terms must stay exact Python ints
+        return False
+    # Integrals and limits use different algorithms in the vectorized engine
+    return not any(isinstance(n, (IntegralNode, LimitNode)) for n in walk(body))
+
+def index_chunks(start, stop):
+    """The fixed (first, last) index ranges a chunked loop is split into"""
+    return [(first, min(first + CHUNK_SIZE - 1, stop)) for first in range(start, stop + 1, CHUNK_SIZE)]
+
+def chunk_terms(body, var, variables, first, last, backend=None):
+    """The float terms for indices first..last, or None if any is not finite"""
+    scope = dict(variables)
+    scope[var] = np.arange(first, last + 1)
+    try:
+        terms = evaluate_array(body, scope, backend)
+    except BudgetExceeded:
+        raise
+    except Exception:
+        return None
+    if not np.isfinite(terms).all():
+        return None
+    return terms
+
+def _chunked(node, var, backend, part, combine):
+    body = node.expr
+    where = node_label(node)
+    # Estimated evaluations per term, for the parallel threshold
+    term_cost = count_nodes(body) * cost.ARRAY_ELEMENT_COST
+    def fast(variables, start, stop):
+        if any(isinstance(value, np.ndarray) for value in variables.values()):
+            return NotImplemented
+        budget = current_budget()
+        chunks = index_chunks(start, stop)
+        if len(chunks) > 1 and parallel.worthwhile(term_cost * (stop - start + 1)):
+            if budget is not None:
+                budget.tick(where, stop - start + 1)
+            scope = parallel.scalar_variables(variables)
+            name = kernels.get_backend(backend).name
+            return combine(parallel.run(chunk_part, [(body, var, scope, first, last, name, part)
+                                                     for first, last in chunks]))
+        def parts():
+            for first, last in chunks:
+                if budget is not None:
+                    budget.tick(where, last - first + 1)
+                yield chunk_part(body, var, variables, first, last, backend, part)
+        return combine(parts())
+    return fast
+
+def chunk_part(body, var, variables, first, last, backend, part):
+    """part() of the terms for indices first..last: the work of one chunk, run in a worker or not"""
+    return part(chunk_terms(body, var, variables, first, last, backend))
+
+def _sum_part(terms):
+    return None if terms is None else math.fsum(terms)
+
+def _sum_combine(parts):
+    partials = []
+    for partial in parts:
+        if partial is None:
+            return NotImplemented
+        partials.append(partial)
+    return math.fsum(partials)
+
+def _product_part(terms):
+    """(negative terms, any zero term, sum of log magnitudes unless zero), or None"""
+    if terms is None:
+        return None
+    zero = bool((terms == 0).any())
+    logs = None if zero else math.fsum(np.log(np.abs(terms)))
+    return int(np.signbit(terms).sum()), zero, logs
+
+def _product_combine(parts):
+    logs = []
+    negatives = 0
+    zero = False
+    for part in parts:
+        if part is None:
+            return NotImplemented
+        negatives += part[0]
+        zero = zero or part[1]
+        if not zero:
+            logs.append(part[2])
+    sign = -1.0 if negatives % 2 else 1.0
+    if zero:
+        return sign * 0.0
+    try:
+        return sign * math.exp(math.fsum(logs))
+    except OverflowError:
+        raise OverflowError('Product is too large for a float') from None
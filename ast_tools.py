@@ -0,0 +1,216 @@
+import hashlib
+from functions import (
+    NumberNode, VariableNode, BinaryOpNode, NegateNode, FunctionCallNode,
+    SigmaSumNode, ProductNode, IntegralNode, LimitNode
+)
+
+# Generic helpers for walking Parser ASTs.
+
+AGGREGATE_NODES = (SigmaSumNode, ProductNode, IntegralNode)
+
+def children(node) -> list:
+    """The evaluated sub-expressions of node, in evaluation order"""
+    if isinstance(node, BinaryOpNode):
+        return [node.left, node.right]
+    elif isinstance(node, NegateNode):
+        return [node.operand]
+    elif isinstance(node, FunctionCallNode):
+        return list(node.args)
+    elif isinstance(node, AGGREGATE_NODES):
+        return [node.lower, node.upper, node.expr]
+    elif isinstance(node, LimitNode):
+        return [node.to, node.expr]
+    return []
+
+def walk(node):
+    """Yield node and all of its descendants, parents before children"""
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        yield current
+        stack.extend(reversed(children(current)))
+
+def node_label(node) -> str:
+    """Short description of a single node, without its children"""
+    if isinstance(node, NumberNode):
+        return f'{node.value:g}' if isinstance(node.value, float) else str(node.value)
+    elif isinstance(node, VariableNode):
+        return node.name
+    elif isinstance(node, BinaryOpNode):
+        return node.op
+    elif isinstance(node, NegateNode):
+        return 'negate'
+    elif isinstance(node, FunctionCallNode):
+        return f'{node.func_name}()'
+    elif isinstance(node, SigmaSumNode):
+        return f'sum({node.var})'
+    elif isinstance(node, ProductNode):
+        return f'product({node.var})'
+    elif isinstance(node, IntegralNode):
+        return f'integral({node.var})'
+    elif isinstance(node, LimitNode):
+        return f'lim({node.var})'
+    return type(node).__name__
+
+def structural_key(node, table, cache=None) -> int:
+    """Integer naming node's structure: structurally equal trees get the same
+    key from the same table dict. Variable and function names are compared
+    in lower case, as they are looked up.
+
+    Keys are interned bottom-up, so a whole tree is keyed in linear time.
+    """
+    if cache is None:
+        cache = {}
+    key = cache.get(id(node))
+    if key is not None:
+        return key
+    if isinstance(node, NumberNode):
+        shape = ('number', repr(node.value))
+    elif isinstance(node, VariableNode):
+        shape = ('variable', node.name.lower())
+    elif isinstance(node, BinaryOpNode):
+        shape = ('binary', node.op)
+    elif isinstance(node, FunctionCallNode):
+        shape = ('call', node.func_name.lower())
+    elif isinstance(node, AGGREGATE_NODES + (LimitNode,)):
+        shape = (type(node).__name__, node.var)
+    else:
+        shape = (type(node).__name__,)
+    shape += tuple(structural_key(child, table, cache) for child in children(node))
+    key = cache[id(node)] = table.setdefault(shape, len(table))
+    return key
+
+def canonical_form(node) -> str:
+    """node as text naming its structure, one token per node in prefix order.
+
+    Trees parsed from texts differing only in whitespace, redundant
+    parentheses or the case of names have the same form, and trees with the
+    same form evaluate alike. Built without recursion, for trees of any depth.
+    """
+    tokens = []
+    for current in walk(node):
+        if isinstance(current, NumberNode):
+            tokens.append(repr(current.value))
+        elif isinstance(current, VariableNode):
+            tokens.append(f'${current.name.lower()}')
+        elif isinstance(current, BinaryOpNode):
+            tokens.append(current.op)
+        elif isinstance(current, FunctionCallNode):
+            # Calls carry their argument count, which keeps the prefix form unambiguous
+            tokens.append(f'{current.func_name.lower()}/{len(current.args)}')
+        else:
+            tokens.append(node_label(current))
+    return ' '.join(tokens)
+
+def canonical_hash(node) -> str:
+    """Hex SHA-256 digest of canonical_form(node)"""
+    return hashlib.sha256(canonical_form(node).encode('utf-8')).hexdigest()
+
+def count_nodes(node) -> int:
+    return sum(1 for _ in walk(node))
+
+def depth(node) -> int:
+    """Number of nodes on the longest path from node down to a leaf"""
+    deepest = 0
+    stack = [(node, 1)]
+    while stack:
+        current, level = stack.pop()
+        deepest = max(deepest, level)
+        stack.extend((child, level + 1) for child in children(current))
+    return deepest
+
+def integral_depth(node) -> int:
+    """Number of integrals on the path through node nesting the most of them"""
+    deepest = 0
+    stack = [(node, 0)]
+    while stack:
+        current, level = stack.pop()
+        if isinstance(current, IntegralNode):
+            level += 1
+        deepest = max(deepest, level)
+        stack.extend((child, level) for child in children(current))
+    return deepest
+
+def is_expensive(node, cache=None) -> bool:
+    """Whether node calls a kernel or loops, i.e. is worth computing only once"""
+    if cache is None:
+        cache = {}
+    key = id(node)
+    if key not in cache:
+        cache[key] = (
+            isinstance(node, (FunctionCallNode, LimitNode) + AGGREGATE_NODES)
+            or (isinstance(node, BinaryOpNode) and node.op == '^')
+            or any(is_expensive(child, cache) for child in children(node)))
+    return cache[key]
+
+def binding_variable(node):
+    """The name a sum/product/integral/limit binds in its body, if any.
+
+    Loop variables are stored under their own spelling but looked up in
+    lower case, so only lower-case names actually shadow anything.
+    """
+    if isinstance(node, AGGREGATE_NODES + (LimitNode,)):
+        var = node.var
+        if isinstance(var, str) and var == var.lower():
+            return var
+    return None
+
+def free_variables(node, cache=None) -> frozenset:
+    """Lower-cased names node reads from the variables dict (constants included).
+
+    Pass the same cache dict across calls to analyze every subtree of a large
+    tree in linear time.
+    """
+    if cache is None:
+        cache = {}
+    key = id(node)
+    if key in cache:
+        return cache[key]
+    if isinstance(node, VariableNode):
+        names = frozenset([node.name.lower()])
+    else:
+        names = frozenset()
+        var = binding_variable(node)
+        for child in children(node):
+            child_names = free_variables(child, cache)
+            if var is not None and child is node.expr:
+                child_names = child_names - {var}
+            names |= child_names
+    cache[key] = names
+    return names
+
+def bound_variables(node, cache=None) -> frozenset:
+    """Names bound by any sum, product, integral or limit inside node"""
+    if cache is None:
+        cache = {}
+    key = id(node)
+    if key in cache:
+        return cache[key]
+    names = frozenset()
+    var = binding_variable(node)
+    if var is not None:
+        names = frozenset([var])
+    for child in children(node):
+        names |= bound_variables(child, cache)
+    cache[key] = names
+    return names
+
+def may_be_int(node, int_vars) -> bool:
+    """False only when node is guaranteed to evaluate to a float.
+
+    int_vars are the lower-cased names that may hold Python ints, such as
+    sum and product indices. Other variables are taken to be floats.
+    """
+    if isinstance(node, NumberNode):
+        return not isinstance(node.value, float)
+    elif isinstance(node, VariableNode):
+        return node.name.lower() in int_vars
+    elif isinstance(node, BinaryOpNode):
+        if node.op in ('/', '^'):
+            return False
+        return may_be_int(node.left, int_vars) and may_be_int(node.right, int_vars)
+    elif isinstance(node, NegateNode):
+        return may_be_int(node.operand, int_vars)
+    elif isinstance(node, FunctionCallNode):
+        return node.func_name.lower() in ('absolute', 'factorial', 'floor', 'ceiling')
+    return not isinstance(node, (IntegralNode, LimitNode))
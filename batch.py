@@ -0,0 +1,191 @@
+import csv
+import itertools
+import numbers
+import numpy as np
+import compiler
+import kernels
+from budget import BudgetExceeded
+from functions import CONSTANTS
+from ast_tools import free_variables
+from vectorized import evaluate_array
+
+# Batch evaluation of one expression over many variable bindings.
+#
+# evaluate_columns() takes a table of columns, one NumPy array per variable,
+# and evaluates every row in one pass of the vectorized engine. Rows it
+# cannot vouch for, those whose value comes out NaN or infinite, are
+# evaluated again one by one with the compiled scalar evaluator, which gives
+# their exact value or the exception that row raises. A failing row never
+# stops the others: results hold NaN there and the exception is kept.
+#
+# evaluate_rows() does the same for an iterable of bindings dicts and yields
+# one result per row, and evaluate_csv() streams a CSV file into another,
+# adding result and error columns. Both work through their input CHUNK_ROWS
+# rows at a time, so memory stays bounded however large it is.
+#
+# Variable names are matched in lower case, as evaluate() looks them up.
+# Rows binding a constant such as e or pi override it, as in evaluate().
+
+CHUNK_ROWS = 1 << 13
+# Integers beyond this lose precision as floats; rows holding them are evaluated exactly
+MAX_EXACT_INT = 2 ** 53
+
+class BatchResult:
+    def __init__(self, values, errors):
+        # One float per row, NaN where the row failed
+        self.values = values
+        # The exception of every failed row, by row index
+        self.errors = errors
+
+    def __len__(self):
+        return len(self.values)
+
+    def __repr__(self):
+        return f'BatchResult(rows={len(self.values)}, errors={len(self.errors)})'
+
+class CsvSummary:
+    def __init__(self, rows, errors):
+        self.rows = rows
+        self.errors = errors
+
+    def __repr__(self):
+        return f'CsvSummary(rows={self.rows}, errors={self.errors})'
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def evaluate_columns(ast, columns, backend=None, rows=None) -> BatchResult:
+    """ast for every row of columns, a mapping of variable names to equally
+    long sequences. rows gives the number of rows, needed when there are no
+    columns, as for an expression reading no variables.
+    """
+    backend = kernels.get_backend(backend)
+    names = free_variables(ast)
+    columns = {name.lower(): np.asarray(values, dtype=float) for name, values in columns.items()}
+    lengths = {len(values) for values in columns.values()}
+    if rows is not None:
+        lengths.add(rows)
+    if len(lengths) > 1:
+        raise ValueError("All columns must have the same number of rows")
+    rows = lengths.pop() if lengths else 0
+    variables = {name: values for name, values in columns.items() if name in names}
+    try:
+        values = np.broadcast_to(evaluate_array(ast, variables, backend), (rows,)).copy()
+        retry = np.flatnonzero(~np.isfinite(values))
+    except BudgetExceeded:
+        raise
+    except Exception:
+        # Not vectorizable, or failing as a whole: every row gets its own verdict
+        values = np.full(rows, np.nan)
+        retry = range(rows)
+    f = compiler.compile_cached(ast, backend)
+    errors = {}
+    for i in retry:
+        try:
+            values[i] = f({name: float(column[i]) for name, column in variables.items()})
+        except BudgetExceeded:
+            raise
+        except Exception as e:
+            values[i] = np.nan
+            errors[int(i)] = e
+    return BatchResult(values, errors)
+
+def evaluate_chunks(ast, chunks, backend=None):
+    """evaluate_columns() of each table of columns in chunks, yielded as they are done"""
+    for columns in chunks:
+        yield evaluate_columns(ast, columns, backend)
+
+def evaluate_rows(ast, rows, backend=None, chunk_rows=CHUNK_ROWS):
+    """Yield, for each bindings dict of rows, the float value of ast or the
+    exception that row raised"""
+    backend = kernels.get_backend(backend)
+    names = free_variables(ast)
+    f = compiler.compile_cached(ast, backend)
+    for chunk in _chunks(rows, chunk_rows):
+        # Constants are columns only if the first row overrides them
+        used = [name for name in names if name not in CONSTANTS or name in chunk[0]]
+        unused = [name for name in names if name not in used]
+        columns = {name: np.empty(len(chunk)) for name in used}
+        regular = []
+        irregular = []
+        for i, row in enumerate(chunk):
+            try:
+                for name in used:
+                    value = row[name]
+                    if not isinstance(value, numbers.Real) or (isinstance(value, int) and abs(value) > MAX_EXACT_INT):
+                        raise TypeError
+                    columns[name][len(regular)] = value
+            except (KeyError, TypeError, OverflowError):
+                irregular.append(i)
+                continue
+            if any(name in row for name in unused):
+                irregular.append(i)
+            else:
+                regular.append(i)
+        result = evaluate_columns(ast, {name: column[:len(regular)] for name, column in columns.items()},
+                                  backend, len(regular))
+        results = [None] * len(chunk)
+        for j, i in enumerate(regular):
+            results[i] = result.errors.get(j, result.values[j])
+        for i in irregular:
+            try:
+                results[i] = float(f(dict(chunk[i])))
+            except BudgetExceeded:
+                raise
+            except Exception as e:
+                results[i] = e
+        for value in results:
+            yield float(value) if isinstance(value, np.floating) else value
+
+def evaluate_csv(ast, source, destination, backend=None, chunk_rows=CHUNK_ROWS,
+                 result_column='result', error_column='error') -> CsvSummary:
+    """Evaluate ast for every row of the CSV file source, whose header names
+    the variables, and write the rows to destination with result and error
+    columns appended. source and destination are open text files.
+    """
+    reader = csv.reader(source)
+    writer = csv.writer(destination)
+    header = next(reader, None)
+    if header is None:
+        raise ValueError("The CSV input is empty")
+    positions = {name.strip().lower(): i for i, name in enumerate(header)}
+    names = free_variables(ast)
+    missing = sorted(name for name in names if name not in positions and name not in CONSTANTS)
+    if missing:
+        raise ValueError(f"No column for variable{'s' if len(missing) > 1 else ''} {', '.join(missing)}")
+    used = {name: positions[name] for name in names if name in positions}
+    writer.writerow(header + [result_column, error_column])
+    total = failed = 0
+    for chunk in _chunks(reader, chunk_rows):
+        columns = {}
+        bad = {}
+        for name, position in used.items():
+            cells = [row[position] if position < len(row) else '' for row in chunk]
+            try:
+                columns[name] = np.asarray(cells, dtype=float)
+            except ValueError:
+                columns[name] = np.array([_parse_cell(cell, i, bad) for i, cell in enumerate(cells)])
+        result = evaluate_columns(ast, columns, backend, len(chunk))
+        errors = {**result.errors, **bad}
+        for i, row in enumerate(chunk):
+            error = errors.get(i)
+            if error is None:
+                writer.writerow(row + [repr(float(result.values[i])), ''])
+            else:
+                writer.writerow(row + ['', str(error)])
+        total += len(chunk)
+        failed += len(errors)
+    return CsvSummary(total, failed)
+
+def _parse_cell(cell, row, bad):
+    """float(cell), recording the error of an unreadable cell under its row"""
+    try:
+        return float(cell)
+    except ValueError as e:
+        bad.setdefault(row, e)
+        return np.nan
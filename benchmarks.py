@@ -0,0 +1,452 @@
+import argparse
+import io
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+import functions
+import graphing_utilities
+import intervals
+import rendering
+import postfix
+import batch
+from sampling import adaptive_sample
+from functions import tokenize, Parser, parse_many, evaluate, ASTNode
+from compiler import compile
+from ast_tools import walk
+from kernels import cross_check
+
+# Headless benchmarks for the FunCG engine, no Streamlit needed.
+#
+#   python benchmarks.py                        run the suite and print it
+#   python benchmarks.py --json run.json        also store the results
+#   python benchmarks.py --baseline run.json    compare against a stored run,
+#                                               exit 1 on a regression
+#   python benchmarks.py --comparisons          side-by-side engine comparisons
+
+def parse(expr : str):
+    return Parser(tokenize(expr)).parse()
+
+def best_time(fn, repeat=3) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+# Compiler vs tree-walking evaluate() in each hot loop
+
+def _plot_loop(f):
+    return lambda: [f({'x': -10 + 20 * i / 2000}) for i in range(2000)]
+
+def _sum_loop(f):
+    def run():
+        variables = {}
+        total = 0
+        for i in range(1, 5001):
+            variables['i'] = i
+            total += f(variables)
+        return total
+    return run
+
+def _product_loop(f):
+    def run():
+        variables = {}
+        prod = 1
+        for i in range(1, 5001):
+            variables['i'] = i
+            prod *= f(variables)
+        return prod
+    return run
+
+def _simpson_loop(f):
+    # The fixed composite Simpson's rule integral() ran before adaptive quadrature
+    def run():
+        n = functions.ISPTCPrecision + functions.ISPTCPrecision % 2
+        h = 2.0 / n
+        variables = {}
+        total = 0.0
+        for i in range(n + 1):
+            variables['t'] = i * h
+            y = f(variables)
+            if i == 0 or i == n:
+                total += y
+            elif i % 2 == 1:
+                total += 4 * y
+            else:
+                total += 2 * y
+        return total * h / 3
+    return run
+
+COMPILER_CASES = [
+    ('plot_function loop', 'sin(x)^2 + x/3', _plot_loop),
+    ('sum loop', 'i^2 + sin(i)', _sum_loop),
+    ('product loop', '1 + 1/i^2', _product_loop),
+    ('integral Simpson loop', 't^2 * cos(t)', _simpson_loop),
+]
+
+def bench_compiler():
+    rows = []
+    for name, expr, loop in COMPILER_CASES:
+        ast = parse(expr)
+        interpreted = best_time(loop(lambda variables: evaluate(ast, variables)))
+        compiled = best_time(loop(compile(ast)))
+        rows.append((name, expr, interpreted, compiled))
+    return rows
+
+# Closed-form and vectorized fast paths vs the plain loop for large aggregates
+
+AGGREGATE_CASES = [
+    ('polynomial sum', 'sum(k, 1, 100000, k^3 - 2*k)'),
+    ('geometric sum', 'sum(k, 0, 2000, 3 * 0.999^(2*k + 1))'),
+    ('vectorized sum', 'sum(k, 1, 100000, sin(k) / k)'),
+    ('log-domain product', 'product(k, 1, 100000, 1 + 1/k^2)'),
+]
+
+def bench_aggregates():
+    rows = []
+    for name, expr in AGGREGATE_CASES:
+        f = compile(parse(expr))
+        threshold = functions.AggregateFastPathTerms
+        functions.AggregateFastPathTerms = float('inf')
+        try:
+            loop = best_time(f, repeat=1)
+        finally:
+            functions.AggregateFastPathTerms = threshold
+        fast = best_time(f)
+        rows.append((name, expr, loop, fast))
+    return rows
+
+# Kernel backends: accuracy of 'fast' against 'reference' and time per kernel
+
+def bench_kernels():
+    return [(c.kernel, c.samples, f'{c.max_abs_error:.2e}', f'{c.max_rel_error:.2e}',
+             c.mismatched_errors, c.reference_time, c.fast_time) for c in cross_check()]
+
+# Slotted AST nodes vs nodes with an instance __dict__, as they were before,
+# and the postfix stack machine vs the recursive evaluators
+
+AST_CASES = [
+    ('long expression', 'sin(x*3)^2 - cos(3/(x^2 + 1))*logarithm(2, x^2 + 3) + x^3/7 - 2*x + absolute(x - 1)'),
+    ('power chain', '^'.join(['1.0001'] * 30) + '^x'),
+    ('polynomial', ' + '.join(f'{i}*x^{i}' for i in range(1, 21))),
+]
+
+def _rebuild(node, classes):
+    """Copy of the tree with every node rebuilt as an instance of classes[type(node)]"""
+    built = {}
+    # Children before their parents
+    for current in reversed(list(walk(node))):
+        cls = type(current)
+        copy = object.__new__(classes[cls])
+        for name in cls.__slots__:
+            value = getattr(current, name)
+            if isinstance(value, ASTNode):
+                value = built[id(value)]
+            elif isinstance(value, list):
+                value = [built[id(arg)] for arg in value]
+            setattr(copy, name, value)
+        built[id(current)] = copy
+    return built[id(node)]
+
+def _node_classes():
+    return {type(node) for name, expr in AST_CASES for node in walk(parse(expr))}
+
+def _dict_classes():
+    """Stand-alone classes with an instance __dict__, shaped like the former nodes"""
+    return {cls: type(cls.__name__, (), {}) for cls in _node_classes()}
+
+def _dict_subclasses():
+    """Subclasses of the node classes keeping their fields in an instance __dict__,
+    which evaluate() accepts; the class attributes hide the slots"""
+    return {cls: type(cls.__name__, (cls,), dict.fromkeys(cls.__slots__)) for cls in _node_classes()}
+
+def retained_bytes(fn) -> int:
+    """Bytes still allocated by Python when fn returns, its result included"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = fn()
+        return tracemalloc.get_traced_memory()[0] - before
+    finally:
+        del result
+        tracemalloc.stop()
+
+def bench_ast():
+    rows = []
+    dict_classes, dict_subclasses = _dict_classes(), _dict_subclasses()
+    same_classes = {cls: cls for cls in dict_classes}
+    for name, expr in AST_CASES:
+        ast = parse(expr)
+        nodes = sum(1 for _ in walk(ast))
+        # Warm up the per-class attribute caches
+        _rebuild(ast, dict_classes)
+        dict_bytes = retained_bytes(lambda: _rebuild(ast, dict_classes)) / nodes
+        slotted_bytes = retained_bytes(lambda: _rebuild(ast, same_classes)) / nodes
+        dict_ast = _rebuild(ast, dict_subclasses)
+        walked_dict = best_time(_plot_loop(lambda variables: evaluate(dict_ast, variables)))
+        walked = best_time(_plot_loop(lambda variables: evaluate(ast, variables)))
+        compiled = best_time(_plot_loop(compile(ast)))
+        program = postfix.flatten(ast)
+        machine = best_time(_plot_loop(lambda variables: postfix.run(program, variables)))
+        rows.append((name, nodes, f'{dict_bytes:.0f} B', f'{slotted_bytes:.0f} B',
+                     walked_dict, walked, compiled, machine))
+    return rows
+
+def print_rows(title, header, rows):
+    print(title)
+    print('  ' + ' | '.join(header))
+    for row in rows:
+        print('  ' + ' | '.join(
+            f'{value * 1000:.2f} ms' if isinstance(value, float) else str(value) for value in row))
+
+# Benchmark suite: per-stage throughput and peak memory over a fixed corpus
+
+FORMAT_VERSION = 1
+DEFAULT_THRESHOLD = 0.25
+# Memory differences below this are noise, whatever the threshold
+MEMORY_SLACK_BYTES = 64 * 1024
+
+LONG_EXPRESSION = ' + '.join(f'sin(x*{i})^2 - cos({i}/x)*logarithm(2, x + {i})' for i in range(1, 201))
+NESTED_EXPRESSION = '(' * 60 + 'x' + ''.join(f' + {i})' for i in range(60))
+# Many short expressions, as when a worksheet is imported; every tenth has a syntax error
+WORKSHEET = [f'sin({i}*x)^2 + {i}/(x + 1) - logarithm(2, x^2 + {i})' if i % 10 else f'({i}*x + ' for i in range(1000)]
+
+EVALUATE_CORPUS = [
+    ('nested sum', 'sum(i, 1, 30, sum(j, 1, i, i*j + x))'),
+    ('integral', 'integral(t, 0, x, t^2 * cos(t))'),
+    ('lim', 'lim(t, 0, sin(t*x)/t)'),
+    ('power chain', '^'.join(['1.0001'] * 30) + '^x'),
+    ('trig', 'sin(x)*cos(x) + tg(x/3) - arctg(x) + arcsin(x/10) + arcctg(x)'),
+    ('infinite series', 'sum(n, 1, inf, 1/(n^2 + x))'),
+]
+EVALUATE_POINTS = [0.5 + 2.5 * i / 19 for i in range(20)]
+# A table of bindings evaluated as one batch; a y of 0 makes every ninth row fail
+BATCH_EXPRESSION = 'sin(x)*cos(y) + x^2/y'
+BATCH_CSV = 'x,y\n' + ''.join(f'{i / 1000},{i % 9}\n' for i in range(100000))
+
+PLOT_CORPUS = [
+    ('polynomial', 'x^3/20 - x'),
+    ('trig', 'tg(x) + sin(3*x)'),
+    ('oscillating', 'sin(20*x)*x'),
+]
+PLOT_POINT_COUNTS = [1000, 10000, 100000]
+# Samples drawn into a PNG, as the UI does
+RENDER_POINT_COUNTS = [10000, 100000, 1000000]
+
+class BenchCase:
+    def __init__(self, stage, name, setup, work, unit):
+        self.stage = stage
+        self.name = name
+        # setup() prepares the inputs and returns the callable to time
+        self.setup = setup
+        # Amount of work one call does, in units (tokens, nodes, points, ...)
+        self.work = work
+        self.unit = unit
+
+    @property
+    def key(self) -> str:
+        return f'{self.stage}/{self.name}'
+
+def _tokenize_case(name, expr):
+    return BenchCase('tokenize', name, lambda: lambda: tokenize(expr), len(tokenize(expr)), 'tokens')
+
+def _parse_case(name, expr):
+    tokens = tokenize(expr)
+    return BenchCase('parse', name, lambda: lambda: Parser(tokens).parse(), len(tokens), 'tokens')
+
+def _parse_many_case(name, expressions):
+    return BenchCase('parse', name, lambda: lambda: list(parse_many(expressions)), len(expressions), 'expressions')
+
+def _evaluate_case(name, expr, backend):
+    def setup():
+        ast = parse(expr)
+        return lambda: [evaluate(ast, {'x': x}, backend) for x in EVALUATE_POINTS]
+    return BenchCase('evaluate', f'{name} [{backend}]', setup, len(EVALUATE_POINTS), 'evaluations')
+
+def _batch_case(name, expr, text):
+    def setup():
+        ast = parse(expr)
+        return lambda: batch.evaluate_csv(ast, io.StringIO(text), io.StringIO())
+    return BenchCase('evaluate', name, setup, text.count('\n') - 1, 'rows')
+
+def _plot_case(name, expr, points):
+    ast = parse(expr)
+    # The point count is a budget; the work done is the evaluations adaptive sampling spends
+    samples = adaptive_sample(lambda x: graphing_utilities.sample_function(ast, x), -10, 10, points, -8, 8,
+                              bound=lambda lo, hi: intervals.bound(ast, lo, hi))
+    def setup():
+        return lambda: graphing_utilities.plot_function(ast, max_points=points)
+    return BenchCase('plot', f'{name} @{points}', setup, samples.evaluations, 'evaluations')
+
+def _render_case(points):
+    def setup():
+        x = np.linspace(-10, 10, points)
+        y = np.sin(20 * x) * x
+        y[np.abs(y) > 8] = np.nan
+        def run():
+            fig = rendering.plot_figure(x, y, -10, 10, -8, 8)
+            fig.savefig(io.BytesIO(), format='png')
+        return run
+    return BenchCase('render', f'oscillating @{points}', setup, points, 'points')
+
+def benchmark_corpus() -> list:
+    cases = [
+        _tokenize_case('long expression', LONG_EXPRESSION),
+        _tokenize_case('nested parentheses', NESTED_EXPRESSION),
+        _parse_case('long expression', LONG_EXPRESSION),
+        _parse_case('nested parentheses', NESTED_EXPRESSION),
+        _parse_many_case('worksheet', WORKSHEET),
+    ]
+    for backend in ('fast', 'reference'):
+        cases += [_evaluate_case(name, expr, backend) for name, expr in EVALUATE_CORPUS]
+    cases.append(_batch_case('csv batch', BATCH_EXPRESSION, BATCH_CSV))
+    for name, expr in PLOT_CORPUS:
+        cases += [_plot_case(name, expr, points) for points in PLOT_POINT_COUNTS]
+    cases += [_render_case(points) for points in RENDER_POINT_COUNTS]
+    return cases
+
+def time_per_call(fn, repeat=5, min_time=0.05) -> float:
+    """Best time of one call, calling fn often enough to measure short calls"""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1 << 16:
+            break
+        number *= 2
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+def peak_memory(fn) -> int:
+    """Peak bytes allocated by Python during one call of fn"""
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def run_suite(stages=None, repeat=5, progress=None) -> dict:
+    """Run the corpus and return the results as a JSON-ready dict"""
+    results = {}
+    for case in benchmark_corpus():
+        if stages and case.stage not in stages:
+            continue
+        fn = case.setup()
+        fn()  # warm up caches, as a long-running server would have
+        seconds = time_per_call(fn, repeat)
+        results[case.key] = {
+            'stage': case.stage,
+            'seconds': seconds,
+            'throughput': case.work / seconds,
+            'unit': f'{case.unit}/s',
+            'peak_bytes': peak_memory(fn),
+        }
+        if progress is not None:
+            progress(case.key, results[case.key])
+    return {
+        'format': FORMAT_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'results': results,
+    }
+
+class Regression:
+    def __init__(self, key, metric, baseline, current):
+        self.key = key
+        self.metric = metric
+        self.baseline = baseline
+        self.current = current
+
+    @property
+    def ratio(self) -> float:
+        return self.current / self.baseline if self.baseline else float('inf')
+
+    def __repr__(self):
+        return f'Regression({self.key!r}, {self.metric}, {self.baseline!r} -> {self.current!r})'
+
+def compare(run, baseline, threshold=DEFAULT_THRESHOLD) -> list:
+    """Cases of run that got slower or use more memory than in baseline by more than threshold"""
+    if baseline.get('format') != FORMAT_VERSION:
+        raise ValueError(f"Unsupported benchmark format: {baseline.get('format')}")
+    regressions = []
+    for key, result in run['results'].items():
+        old = baseline['results'].get(key)
+        if old is None:
+            continue
+        if result['seconds'] > old['seconds'] * (1 + threshold):
+            regressions.append(Regression(key, 'seconds', old['seconds'], result['seconds']))
+        if result['peak_bytes'] > old['peak_bytes'] * (1 + threshold) + MEMORY_SLACK_BYTES:
+            regressions.append(Regression(key, 'peak_bytes', old['peak_bytes'], result['peak_bytes']))
+    return regressions
+
+def _print_result(key, result):
+    print(f"  {key:42s} {result['seconds'] * 1000:10.3f} ms  {result['throughput']:14,.0f} {result['unit']:14s}"
+          f" {result['peak_bytes'] / 1024:10.1f} KiB")
+
+def print_comparisons():
+    rows = bench_compiler()
+    print_rows('compile() vs evaluate()', ('loop', 'expression', 'evaluate', 'compiled', 'speedup'),
+               [row + (f'{row[2] / row[3]:.1f}x',) for row in rows])
+    rows = bench_kernels()
+    print_rows('kernel backends', ('kernel', 'samples', 'max abs diff', 'max rel diff', 'error mismatches',
+                                   'reference', 'fast', 'speedup'),
+               [row + (f'{row[5] / row[6]:.1f}x',) for row in rows])
+    rows = bench_aggregates()
+    print_rows('aggregate fast paths', ('case', 'expression', 'loop', 'fast path', 'speedup'),
+               [row + (f'{row[2] / row[3]:.1f}x',) for row in rows])
+    rows = bench_ast()
+    print_rows('AST nodes and evaluators, per node and per 2000 evaluations',
+               ('case', 'nodes', '__dict__ node', 'slotted node', 'evaluate() __dict__', 'evaluate() slotted',
+                'compiled', 'postfix'), rows)
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='FunCG benchmark suite')
+    parser.add_argument('--json', metavar='PATH', help='store the results as JSON')
+    parser.add_argument('--baseline', metavar='PATH', help='compare against a stored run')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='allowed slowdown or memory growth as a fraction (default %(default)s)')
+    parser.add_argument('--stage', action='append', choices=['tokenize', 'parse', 'evaluate', 'plot', 'render'],
+                        help='only run this stage (repeatable)')
+    parser.add_argument('--repeat', type=int, default=5, help='timing repetitions per case')
+    parser.add_argument('--comparisons', action='store_true',
+                        help='print the engine comparison tables instead of running the suite')
+    args = parser.parse_args(argv)
+
+    if args.comparisons:
+        print_comparisons()
+        return 0
+
+    print('benchmark suite')
+    run = run_suite(args.stage, args.repeat, progress=_print_result)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(run, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(run, baseline, args.threshold)
+        for r in regressions:
+            print(f'REGRESSION {r.key}: {r.metric} {r.baseline:.6g} -> {r.current:.6g} ({r.ratio:.2f}x)')
+        if regressions:
+            return 1
+        print(f'no regressions beyond {args.threshold:.0%} against {args.baseline}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
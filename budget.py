@@ -0,0 +1,128 @@
+import contextvars
+import threading
+import time
+from collections import Counter
+
+# Runtime limits for a single evaluation.
+#
+#     with EvaluationBudget(max_steps=10**7, timeout=5.0) as budget:
+#         result = evaluate(ast)
+#
+# Inside the block, every loop step ticks the budget: each term of a sum or
+# product, each integrand evaluation, each chunk of a vectorized fast path
+# (counting its terms), each scalar plot point and each batch of points a
+# plot samples (counting its points, under 'points'), and the inner loops of
+# kernels whose work grows with their argument: factors of a factorial and
+# the counting loops of the reference floor() and integer power(). Adaptive
+# integrals also check the budget between rounds. Once the steps or the
+# wall-clock time run out, or cancel() is called from another thread, the next
+# tick raises BudgetExceeded, which unwinds the evaluation like any other
+# error. The exception records how many steps each construct took, so the
+# caller can show where the time went. A single operation in C, such as the
+# last big-integer multiplications of a huge factorial, cannot be stopped.
+#
+# The budget in force is held in a context variable, so concurrent
+# evaluations in different threads or tasks each see their own.
+
+# Ticks between checks of the clock and the cancellation flag
+CHECK_INTERVAL = 1024
+
+class BudgetExceeded(RuntimeError):
+    def __init__(self, message, budget):
+        super().__init__(message)
+        self.message = message
+        self.steps = budget.steps
+        self.elapsed = budget.elapsed()
+        # (construct, steps) pairs, most steps first
+        self.where = budget.where.most_common()
+
+    def __reduce__(self):
+        # Rebuilt without its budget, e.g. when raised in a worker process
+        return _rebuild_exceeded, (type(self), self.message, self.steps, self.elapsed, self.where)
+
+    def __str__(self):
+        if not self.where:
+            return self.message
+        hotspots = ', '.join(f'{label}: {steps:,}' for label, steps in self.where[:3])
+        return f'{self.message} after {self.steps:,} steps in {self.elapsed:.1f} s (steps by construct: {hotspots})'
+
+class EvaluationCancelled(BudgetExceeded):
+    pass
+
+def _rebuild_exceeded(cls, message, steps, elapsed, where):
+    error = cls.__new__(cls)
+    RuntimeError.__init__(error, message)
+    error.message = message
+    error.steps = steps
+    error.elapsed = elapsed
+    error.where = where
+    return error
+
+class EvaluationBudget:
+    def __init__(self, max_steps=None, timeout=None):
+        self.max_steps = max_steps
+        self.timeout = timeout
+        self.steps = 0
+        # Steps per construct label, e.g. 'sum(i)'
+        self.where = Counter()
+        self.started = time.perf_counter()
+        self._next_check = CHECK_INTERVAL
+        self._cancelled = threading.Event()
+        self._tokens = []
+
+    def tick(self, where, steps=1):
+        """Record steps taken by the construct where, raising once a limit is hit"""
+        self.steps += steps
+        self.where[where] += steps
+        if self.steps >= self._next_check:
+            self.check()
+
+    def check(self):
+        """Raise BudgetExceeded if the budget is spent, timed out or cancelled.
+
+        Once exceeded, every later tick raises again, so code that swallows
+        the error cannot keep the evaluation going.
+        """
+        if self._cancelled.is_set():
+            raise EvaluationCancelled('Evaluation cancelled', self)
+        if self.max_steps is not None and self.steps > self.max_steps:
+            raise BudgetExceeded(f'Evaluation exceeded its budget of {self.max_steps:,} steps', self)
+        if self.timeout is not None and self.elapsed() > self.timeout:
+            raise BudgetExceeded(f'Evaluation timed out after {self.timeout:g} s', self)
+        self._next_check = self.steps + CHECK_INTERVAL
+
+    def cancel(self):
+        """Stop the evaluation at its next tick; safe to call from any thread"""
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self._tokens.append(_current_budget.set(self))
+        return self
+
+    def __exit__(self, *exc):
+        _current_budget.reset(self._tokens.pop())
+        return False
+
+    def __repr__(self):
+        return (f'EvaluationBudget(steps={self.steps}, max_steps={self.max_steps}, '
+                f'timeout={self.timeout}, cancelled={self.cancelled})')
+
+_current_budget = contextvars.ContextVar('evaluation_budget', default=None)
+
+def current_budget():
+    """The EvaluationBudget in force, or None"""
+    return _current_budget.get()
+
+def remaining(budget):
+    """(max_steps, timeout) left to budget, for a budget continuing its work elsewhere"""
+    max_steps = None if budget.max_steps is None else max(0, budget.max_steps - budget.steps)
+    timeout = None if budget.timeout is None else max(0.0, budget.timeout - budget.elapsed())
+    return max_steps, timeout
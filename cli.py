@@ -0,0 +1,85 @@
+import argparse
+import json
+import sys
+import functions
+import result_cache
+import service
+
+# Command-line evaluation, without Streamlit.
+#
+#   python cli.py [FILE ...]             evaluate every line of the files,
+#                                        or of stdin without files or for -
+#   echo "sin(pi/2)" | python cli.py     {"ok":true,"result":1.0,...}
+#   python cli.py --var x=2 exprs.txt    bind x in every expression
+#
+# A line holds an expression or a JSON request object (see service.py).
+# Blank lines and lines starting with # are skipped. One JSON response is
+# written per request, in input order, as soon as it is computed. Responses
+# carry the file and line the request came from. The exit status is 1 if
+# any request failed. Results are only kept across runs with --cache.
+
+def _binding(text):
+    name, sep, value = text.partition('=')
+    if not sep or not name.strip():
+        raise argparse.ArgumentTypeError(f"expected NAME=VALUE, got {text!r}")
+    try:
+        return name.strip(), json.loads(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a number: {value!r}") from None
+
+def _lines(paths):
+    """(source, line number, text) of every line of the files, - being stdin"""
+    for path in paths or ['-']:
+        if path == '-':
+            yield from (('<stdin>', i, line) for i, line in enumerate(sys.stdin, 1))
+        else:
+            with open(path, encoding='utf-8') as f:
+                yield from ((path, i, line) for i, line in enumerate(f, 1))
+
+def request_for(line, defaults) -> dict:
+    """The request a line of input stands for"""
+    if line.startswith('{'):
+        request = json.loads(line)
+        if isinstance(request, dict):
+            return {**defaults, **request}
+    return {**defaults, 'expr': line}
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Evaluate FunCG expressions as JSON lines')
+    parser.add_argument('files', nargs='*', metavar='FILE', help='input files (default: stdin)')
+    parser.add_argument('--var', action='append', type=_binding, default=[], metavar='NAME=VALUE',
+                        help='bind a variable in every request (repeatable)')
+    parser.add_argument('--mode', choices=service.MODES, help='mode of plain expression lines')
+    parser.add_argument('--backend', help='kernel backend (default: functions.DefaultKernelBackend)')
+    parser.add_argument('--timeout', type=float, help='seconds allowed per request')
+    parser.add_argument('--cache', metavar='PATH',
+                        help=f'keep results across runs in this SQLite file, e.g. {result_cache.DEFAULT_PATH}')
+    args = parser.parse_args(argv)
+    if args.cache is not None:
+        functions.ResultCachePath = args.cache
+
+    defaults = {}
+    if args.var:
+        defaults['variables'] = dict(args.var)
+    for key in ('mode', 'backend', 'timeout'):
+        if getattr(args, key) is not None:
+            defaults[key] = getattr(args, key)
+
+    failed = False
+    for source, number, line in _lines(args.files):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            request = request_for(line, defaults)
+        except ValueError as e:
+            response = {'ok': False, 'error': f'Invalid JSON: {e}', 'error_type': type(e).__name__}
+        else:
+            response = service.handle(request)
+        response = {'source': source, 'line': number, **response}
+        failed = failed or not response['ok']
+        print(service.dumps(response), flush=True)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
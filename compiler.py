@@ -0,0 +1,523 @@
+import math
+import warnings
+import weakref
+import functions
+import quadrature
+import series
+import aggregates
+import kernels
+import parallel
+import cost
+import postfix
+from budget import current_budget
+from ast_tools import (
+    is_expensive, free_variables, bound_variables, binding_variable, node_label, depth, integral_depth
+)
+
+# AST compiler.
+#
+# compile() turns a Parser result into a tree of closures once, resolving
+# names, operators and kernels ahead of time. Calling the result behaves
+# exactly like evaluate(node, variables), without re-dispatching on node
+# types or rebuilding lookup tables at every visit.
+#
+# Inside sums, products and integrals, expensive subtrees that do not depend
+# on any variable bound within a loop are memoized: they are computed at most
+# once per entry into the outermost such loop and then reused, so
+# sum(i, 1, 1000, i * integral(t, 0, 1, t^2)) runs the integral once. Memoized
+# values live in the per-call variables dict under private keys, so one
+# compiled callable can safely be shared between threads.
+#
+# A sum or product whose upper bound is inf (or lower bound -inf) is evaluated
+# as an infinite series by the series module instead of looping up to 1e8.
+# A series that runs out of terms short of the tolerance warns with
+# series.SeriesWarning rather than passing its partial estimate off as exact.
+# Large finite ones first try the closed-form and vectorized fast paths of the
+# aggregates module.
+#
+# Nested integrals share IntegralNestedMaxEvaluations: each level of n gets
+# an nth of it, in the exponent, so an integral of integrals costs about as
+# much as one. An integral that runs out of evaluations short of the
+# tolerance warns with quadrature.IntegralWarning; the integrals nested in it
+# do not warn on their own, as their errors show in its error estimate.
+#
+# Every loop step (term, factor or integrand evaluation) ticks the
+# EvaluationBudget in force, if any (see budget.py), so runaway loops can be
+# stopped.
+#
+# An instrument hook can wrap the callable of every node as it is compiled;
+# the profiler uses it to count calls, time and exceptions per node.
+#
+# Closures call their children, so a tree deeper than MAX_CLOSURE_DEPTH, such
+# as a long power tower, is compiled to a flat program for the stack machine
+# in postfix.py instead. Loop bodies are still compiled to closures.
+
+MAX_CLOSURE_DEPTH = 200
+
+def compile(node, backend=None, instrument=None):
+    """Compile node into a callable f(variables=None) equivalent to evaluate().
+
+    backend selects the kernel backend, see kernels.get_backend().
+    instrument(node, fn), if given, is called for every compiled node and
+    returns the callable to use in place of fn.
+    """
+    if instrument is None and not isinstance(node, postfix.LOOP_NODES) and depth(node) > MAX_CLOSURE_DEPTH:
+        # Nested closures would overflow the stack: run it as a flat postfix program
+        program = postfix.flatten(node, backend)
+        def run(variables=None):
+            if variables is None:
+                variables = {}
+            return postfix.run(program, variables)
+        return run
+    fn = _compile(node, _Context(backend, instrument))
+    def compiled(variables=None):
+        if variables is None:
+            variables = {}
+        return fn(variables)
+    return compiled
+
+_compiled_nodes = weakref.WeakKeyDictionary()
+
+def compile_cached(node, backend=None):
+    """Like compile(), but reuses the callable built for the same node object"""
+    backend = kernels.get_backend(backend)
+    try:
+        return _compiled_nodes[node][backend]
+    except KeyError:
+        fn = _compiled_nodes.setdefault(node, {})[backend] = compile(node, backend)
+        return fn
+
+class _Scope:
+    def __init__(self, shadowed):
+        # Every name bound anywhere in the loop body, including its own index
+        self.shadowed = shadowed
+        # Keys of the values memoized for this scope, dropped when it exits
+        self.keys = []
+
+class _Context:
+    def __init__(self, backend=None, instrument=None):
+        self.backend = kernels.get_backend(backend)
+        self.instrument = instrument
+        self.scopes = []
+        # Levels of nested integrals in the outermost integral being compiled
+        self.integral_levels = None
+        self.free = {}
+        self.bound = {}
+        self.expensive = {}
+
+class _MemoKey:
+    __slots__ = ()
+
+_UNSET = object()
+
+def _hoist_scope(node, ctx):
+    """The outermost enclosing loop over which node is invariant, if any"""
+    names = free_variables(node, ctx.free)
+    for scope in ctx.scopes:
+        if not names & scope.shadowed:
+            return scope
+    return None
+
+def _memoize(fn, scope):
+    key = _MemoKey()
+    scope.keys.append(key)
+    def memoized(variables):
+        value = variables.get(key, _UNSET)
+        if value is _UNSET:
+            value = variables[key] = fn(variables)
+        return value
+    return memoized
+
+def _compile(node, ctx):
+    fn = _compile_node(node, ctx)
+    if ctx.instrument is not None:
+        fn = ctx.instrument(node, fn)
+    if ctx.scopes and is_expensive(node, ctx.expensive):
+        scope = _hoist_scope(node, ctx)
+        if scope is not None:
+            return _memoize(fn, scope)
+    return fn
+
+def _compile_body(node, ctx):
+    """Compile the body of a loop node inside a new scope"""
+    shadowed = bound_variables(node.expr, ctx.bound)
+    var = binding_variable(node)
+    if var is not None:
+        shadowed = shadowed | {var}
+    scope = _Scope(shadowed)
+    ctx.scopes.append(scope)
+    try:
+        body = _compile(node.expr, ctx)
+    finally:
+        ctx.scopes.pop()
+    return body, scope.keys
+
+def _counted(fn, where):
+    """fn, ticking the budget in force once per call"""
+    def counted(variables):
+        budget = current_budget()
+        if budget is not None:
+            budget.tick(where)
+        return fn(variables)
+    return counted
+
+def _run_scope(fn, keys):
+    """Wrap a loop so its memoized values are discarded when it exits"""
+    if not keys:
+        return fn
+    def scoped(variables):
+        try:
+            return fn(variables)
+        finally:
+            for key in keys:
+                variables.pop(key, None)
+    return scoped
+
+def _compile_node(node, ctx):
+    if isinstance(node, functions.NumberNode):
+        return _compile_number(node, ctx)
+    elif isinstance(node, functions.VariableNode):
+        return _compile_variable(node, ctx)
+    elif isinstance(node, functions.BinaryOpNode):
+        return _compile_binary(node, ctx)
+    elif isinstance(node, functions.NegateNode):
+        return _compile_negate(node, ctx)
+    elif isinstance(node, functions.FunctionCallNode):
+        return _compile_call(node, ctx)
+    elif isinstance(node, functions.SigmaSumNode):
+        return _compile_sum(node, ctx)
+    elif isinstance(node, functions.ProductNode):
+        return _compile_product(node, ctx)
+    elif isinstance(node, functions.IntegralNode):
+        return _compile_integral(node, ctx)
+    elif isinstance(node, functions.LimitNode):
+        return _compile_limit(node, ctx)
+    else:
+        raise ValueError(f"Unknown AST node: {type(node)}")
+
+def _compile_number(node, ctx):
+    value = node.value
+    return lambda variables: value
+
+def _compile_variable(node, ctx):
+    lname = node.name.lower()
+    if lname in functions.CONSTANTS:
+        constant = functions.CONSTANTS[lname]
+        return lambda variables: variables.get(lname, constant)
+    message = f"Variable '{node.name}' not defined"
+    def load(variables):
+        try:
+            return variables[lname]
+        except KeyError:
+            raise ValueError(message) from None
+    return load
+
+def _compile_binary(node, ctx):
+    left = _compile(node.left, ctx)
+    right = _compile(node.right, ctx)
+    op = node.op
+    if op == '+':
+        return lambda variables: left(variables) + right(variables)
+    elif op == '-':
+        return lambda variables: left(variables) - right(variables)
+    elif op == '*':
+        return lambda variables: left(variables) * right(variables)
+    elif op == '/':
+        return lambda variables: left(variables) / right(variables)
+    elif op == '^':
+        power = ctx.backend.power
+        return lambda variables: power(left(variables), right(variables))
+    def unknown(variables):
+        left(variables)
+        right(variables)
+        raise ValueError(f"Unknown operator: {op}")
+    return unknown
+
+def _compile_negate(node, ctx):
+    operand = _compile(node.operand, ctx)
+    return lambda variables: -operand(variables)
+
+def _compile_call(node, ctx):
+    args = [_compile(arg, ctx) for arg in node.args]
+    kernel = resolve_kernel(node.func_name.lower(), len(args), ctx.backend)
+    if len(args) == 1:
+        arg = args[0]
+        return lambda variables: kernel(arg(variables))
+    elif len(args) == 2:
+        first, second = args
+        return lambda variables: kernel(first(variables), second(variables))
+    return lambda variables: kernel(*[arg(variables) for arg in args])
+
+def resolve_kernel(fname, arg_count, backend):
+    """The callable kernel(*values) for function fname (lower-cased) called with arg_count arguments"""
+    if fname in backend.trig_funcs:
+        kernel = backend.trig_funcs[fname]
+    elif fname == 'logarithm':
+        logarithm = backend.logarithm
+        if arg_count == 1:
+            def kernel(x):
+                return logarithm(math.e, x)
+        elif arg_count == 2:
+            kernel = logarithm
+        else:
+            def kernel(*values):
+                raise ValueError('logarithm expects 1 or 2 arguments')
+    elif fname == 'absolute':
+        absolute = backend.absolute
+        def kernel(*values):
+            return absolute(values[0])
+    elif fname == 'factorial':
+        factorial = backend.factorial
+        def kernel(*values):
+            return factorial(int(values[0]))
+    elif fname == 'floor':
+        floor = backend.floor
+        def kernel(*values):
+            return floor(values[0])
+    elif fname == 'ceiling':
+        ceiling = backend.ceiling
+        def kernel(*values):
+            return ceiling(values[0])
+    else:
+        def kernel(*values):
+            raise ValueError(f"Unknown function: {fname}")
+    return kernel
+
+def _compile_sum(node, ctx):
+    var = node.var
+    lower = _compile(node.lower, ctx)
+    upper = _compile(node.upper, ctx)
+    body, keys = _compile_body(node, ctx)
+    where = node_label(node)
+    fast = aggregates.sum_fast_path(node, lambda subtree: compile(subtree, ctx.backend, ctx.instrument),
+                                      ctx.backend)
+    def sigma_sum(variables):
+        a = lower(variables)
+        b = upper(variables)
+        if is_series(a, b):
+            return checked(sum_series(_counted(body, where), var, a, b, variables)).value
+        start = int(a)
+        stop = int(b)
+        if fast is not None and stop - start + 1 >= functions.AggregateFastPathTerms:
+            total = fast(variables, start, stop)
+            if total is not NotImplemented:
+                variables.pop(var, None)
+                return total
+        total = 0
+        budget = current_budget()
+        for i in range(start, stop + 1):
+            if budget is not None:
+                budget.tick(where)
+            variables[var] = i
+            total += body(variables)
+        variables.pop(var, None)
+        return total
+    return _run_scope(sigma_sum, keys)
+
+def _compile_product(node, ctx):
+    var = node.var
+    lower = _compile(node.lower, ctx)
+    upper = _compile(node.upper, ctx)
+    body, keys = _compile_body(node, ctx)
+    where = node_label(node)
+    fast = aggregates.product_fast_path(node, ctx.backend)
+    def product(variables):
+        a = lower(variables)
+        b = upper(variables)
+        if is_series(a, b):
+            return checked(product_series(_counted(body, where), var, a, b, variables)).value
+        start = int(a)
+        stop = int(b)
+        if fast is not None and stop - start + 1 >= functions.AggregateFastPathTerms:
+            prod = fast(variables, start, stop)
+            if prod is not NotImplemented:
+                variables.pop(var, None)
+                return prod
+        prod = 1
+        budget = current_budget()
+        for i in range(start, stop + 1):
+            if budget is not None:
+                budget.tick(where)
+            variables[var] = i
+            prod *= body(variables)
+        variables.pop(var, None)
+        return prod
+    return _run_scope(product, keys)
+
+def is_series(a, b) -> bool:
+    """Whether a sum or product from a to b runs to +/- infinity"""
+    return ((b >= quadrature.INFINITE_BOUND and a < quadrature.INFINITE_BOUND)
+            or (a <= -quadrature.INFINITE_BOUND and b > -quadrature.INFINITE_BOUND))
+
+def series_node(node, variables=None, tol=None, max_terms=None, backend=None):
+    """Evaluate a SigmaSumNode or ProductNode with an infinite bound, returning the full SeriesResult"""
+    if variables is None:
+        variables = {}
+    ctx = _Context(backend)
+    lower = _compile(node.lower, ctx)
+    upper = _compile(node.upper, ctx)
+    body, keys = _compile_body(node, ctx)
+    evaluate_series = product_series if isinstance(node, functions.ProductNode) else sum_series
+    try:
+        return evaluate_series(_counted(body, node_label(node)), node.var, lower(variables), upper(variables), variables, tol, max_terms)
+    finally:
+        for key in keys:
+            variables.pop(key, None)
+
+def _series_parts(body, var, a, b, variables):
+    """One-sided term functions whose series together cover a to b"""
+    def term(n):
+        variables[var] = n
+        return body(variables)
+    def mirrored(m):
+        variables[var] = -m
+        return body(variables)
+    if a <= -quadrature.INFINITE_BOUND and b >= quadrature.INFINITE_BOUND:
+        return [(term, 0), (mirrored, 1)]
+    elif b >= quadrature.INFINITE_BOUND:
+        return [(term, int(a))]
+    return [(mirrored, -int(b))]
+
+def sum_series(body, var, a, b, variables, tol=None, max_terms=None):
+    """Sum the compiled body over var from a to b, one of them infinite"""
+    tol = functions.SeriesTolerance if tol is None else tol
+    max_terms = functions.SeriesMaxTerms if max_terms is None else max_terms
+    try:
+        results = [series.sum_series(term, start, tol, max_terms)
+                   for term, start in _series_parts(body, var, a, b, variables)]
+    finally:
+        variables.pop(var, None)
+    if len(results) == 1:
+        return results[0]
+    first, second = results
+    return series.SeriesResult(first.value + second.value, first.error + second.error,
+                               first.terms + second.terms, first.converged and second.converged)
+
+def product_series(body, var, a, b, variables, tol=None, max_terms=None):
+    """Multiply the compiled body over var from a to b, one of them infinite"""
+    tol = functions.SeriesTolerance if tol is None else tol
+    max_terms = functions.SeriesMaxTerms if max_terms is None else max_terms
+    try:
+        results = [series.product_series(term, start, tol, max_terms)
+                   for term, start in _series_parts(body, var, a, b, variables)]
+    finally:
+        variables.pop(var, None)
+    if len(results) == 1:
+        return results[0]
+    first, second = results
+    return series.SeriesResult(first.value * second.value,
+                               abs(first.value) * second.error + abs(second.value) * first.error,
+                               first.terms + second.terms, first.converged and second.converged)
+
+def max_evaluations(levels) -> int:
+    """Evaluation budget per call of each of levels nested integrals"""
+    if levels <= 1:
+        return functions.IntegralMaxEvaluations
+    share = int(round(functions.IntegralNestedMaxEvaluations ** (1 / levels)))
+    return max(quadrature.POINTS_PER_PANEL, min(functions.IntegralMaxEvaluations, share))
+
+def checked(result):
+    """result, an integral or a series, warning if it ran out of evaluations or terms short of the tolerance"""
+    if not result.converged:
+        warning = series.SeriesWarning if isinstance(result, series.SeriesResult) else quadrature.IntegralWarning
+        warnings.warn(warning(result))
+    return result
+
+def _compile_integral(node, ctx):
+    var = node.var
+    outermost = ctx.integral_levels is None
+    if outermost:
+        ctx.integral_levels = integral_depth(node)
+    levels = ctx.integral_levels
+    try:
+        lower = _compile(node.lower, ctx)
+        upper = _compile(node.upper, ctx)
+        body, keys = _compile_body(node, ctx)
+    finally:
+        if outermost:
+            ctx.integral_levels = None
+    where = node_label(node)
+    body = _counted(body, where)
+    backend = ctx.backend.name
+    point_cost = []
+    def evaluate_points(variables):
+        """Batch evaluation of the integrand on the worker pool, when worth it"""
+        def points(xs):
+            if not point_cost:
+                point_cost.append(cost.estimate(node.expr, parallel.scalar_variables(variables),
+                                                backend=backend).evaluations)
+            if len(xs) < 2 * parallel.MIN_CHUNK or not parallel.worthwhile(len(xs) * point_cost[0]):
+                return None
+            budget = current_budget()
+            if budget is not None:
+                budget.tick(where, len(xs))
+            scope = parallel.scalar_variables(variables)
+            chunks = parallel.run(integrand_points, [(node.expr, var, scope, chunk, backend, levels)
+                                                     for chunk in parallel.split(xs)])
+            return [value for chunk in chunks for value in chunk]
+        return points
+    def integral(variables):
+        result = integrate(body, var, lower(variables), upper(variables), variables,
+                           max_evals=max_evaluations(levels), evaluate_points=evaluate_points(variables))
+        return (checked(result) if outermost else result).value
+    return _run_scope(integral, keys)
+
+def integrand_points(expr, var, variables, xs, backend, levels=None):
+    """expr at var = x for every x of xs, as a worker computes one integral batch"""
+    ctx = _Context(backend)
+    ctx.integral_levels = levels
+    f = _compile(expr, ctx)
+    variables = dict(variables)
+    values = []
+    for x in xs:
+        variables[var] = x
+        values.append(f(variables))
+    return values
+
+def integrate_node(node, variables=None, tol=None, max_evals=None, backend=None):
+    """Evaluate an IntegralNode, returning the full QuadratureResult, converged or not"""
+    if variables is None:
+        variables = {}
+    ctx = _Context(backend)
+    ctx.integral_levels = integral_depth(node)
+    if max_evals is None:
+        max_evals = max_evaluations(ctx.integral_levels)
+    lower = _compile(node.lower, ctx)
+    upper = _compile(node.upper, ctx)
+    body, keys = _compile_body(node, ctx)
+    try:
+        return integrate(_counted(body, node_label(node)), node.var, lower(variables), upper(variables), variables, tol, max_evals)
+    finally:
+        for key in keys:
+            variables.pop(key, None)
+
+def integrate(body, var, a, b, variables, tol=None, max_evals=None, evaluate_points=None):
+    """Adaptively integrate the compiled body over var from a to b.
+
+    evaluate_points(xs), if given, may compute a batch of integrand values
+    itself; returning None leaves the batch to body.
+    """
+    def f(x):
+        variables[var] = x
+        return body(variables)
+    def points(xs):
+        values = evaluate_points(xs)
+        return [f(x) for x in xs] if values is None else values
+    result = quadrature.integrate(
+        f, a, b,
+        tol=functions.IntegralTolerance if tol is None else tol,
+        rel_tol=functions.IntegralTolerance if tol is None else tol,
+        max_evals=functions.IntegralMaxEvaluations if max_evals is None else max_evals,
+        evaluate_points=None if evaluate_points is None else points)
+    variables.pop(var, None)
+    return result
+
+def _compile_limit(node, ctx):
+    var = node.var
+    to = _compile(node.to, ctx)
+    body = _compile(node.expr, ctx)
+    def limit(variables):
+        if not isinstance(var, str):
+            raise ValueError("First argument to limit must be a variable name")
+        return functions.two_sided_limit(body, var, to(variables), variables)
+    return limit
@@ -0,0 +1,258 @@
+import itertools
+import functions
+import quadrature
+import aggregates
+import compiler
+from budget import EvaluationBudget, BudgetExceeded
+from functions import SigmaSumNode, ProductNode, IntegralNode, LimitNode, CONSTANTS
+from ast_tools import (
+    children, is_expensive, free_variables, bound_variables, binding_variable, node_label, integral_depth
+)
+
+# Static cost model: estimates how many node evaluations an expression needs,
+# before running anything.
+#
+# Loop bounds are evaluated at the corners of the ranges of the enclosing loop
+# variables (and of x over the plotted range), so nested triangular loops such
+# as sum(i, 1, n, sum(j, 1, i, ...)) are estimated from above. Loop-invariant
+# subtrees are counted once per entry into the loop they are hoisted out of,
+# as compiler.compile() and the vectorized engine evaluate them, and large
+# sums and products are counted at the cost of their fast paths.
+#
+# How long an infinite series runs depends on convergence, which is only
+# known at run time. It is counted at a typical length; budget.EvaluationBudget
+# bounds the worst case while running. Adaptive integrals are counted at their
+# worst case, the evaluation budget they are given (see
+# compiler.max_evaluations): typical integrals converge far sooner, but the
+# ones that do not, and nested integrals above all, take all of it.
+#
+# Plots are estimated for the vectorized engine, where one node evaluation
+# over an array of points costs a fraction of a scalar one per point, unless
+# the expression contains an integral or an infinite series and has to be
+# evaluated point by point.
+
+TYPICAL_SERIES_TERMS = 256
+# Cost of one array element relative to one scalar node evaluation
+ARRAY_ELEMENT_COST = 0.02
+# Bounds depending on more loop variables than this are not estimated
+MAX_CORNER_VARIABLES = 4
+# Loop steps a bound may take to evaluate before it counts as unknown
+MAX_BOUND_STEPS = 10**5
+
+class LoopCost:
+    def __init__(self, node, iterations, entries, evaluations):
+        self.node = node
+        self.label = node_label(node)
+        # Steps per entry into the loop, and the estimated number of entries
+        self.iterations = iterations
+        self.entries = entries
+        # Estimated evaluations of the loop and everything inside it
+        self.evaluations = evaluations
+
+    def __repr__(self):
+        return (f'LoopCost({self.label!r}, iterations={self.iterations:.3g}, '
+                f'entries={self.entries:.3g}, evaluations={self.evaluations:.3g})')
+
+class CostEstimate:
+    def __init__(self, evaluations, loops, vectorized, unknown_bounds):
+        self.evaluations = evaluations
+        # LoopCost of every sum, product and integral, outermost first
+        self.loops = loops
+        # Whether a plot was estimated for the vectorized engine
+        self.vectorized = vectorized
+        # Loops whose bounds could not be estimated and were counted as one step
+        self.unknown_bounds = unknown_bounds
+
+    def heaviest(self):
+        """The innermost loop holding at least half of the largest loop cost, or None without loops"""
+        if not self.loops:
+            return None
+        largest = max(loop.evaluations for loop in self.loops)
+        return [loop for loop in self.loops if loop.evaluations >= largest / 2][-1]
+
+    def describe(self) -> str:
+        text = f'about {self.evaluations:.3g} evaluations'
+        loop = self.heaviest()
+        if loop is not None:
+            text += f', mostly in {loop.label} ({loop.iterations:.3g} steps × {loop.entries:.3g} entries)'
+        return text
+
+    def __repr__(self):
+        return f'CostEstimate(evaluations={self.evaluations:.3g}, loops={len(self.loops)})'
+
+def estimate(node, variables=None, points=None, x_range=(-10, 10), backend=None) -> CostEstimate:
+    """Estimate the node evaluations of evaluating node once, or over a plot.
+
+    With points, node is taken to be plotted over points values of x spread
+    over x_range.
+    """
+    variables = dict(variables or {})
+    if points is None:
+        return _Estimator(variables, {}, backend, False).run(node, 1)
+    ranges = {'x': (float(x_range[0]), float(x_range[1]))}
+    try:
+        return _Estimator(variables, ranges, backend, True).run(node, points * ARRAY_ELEMENT_COST)
+    except _Scalar:
+        return _Estimator(variables, ranges, backend, False).run(node, points)
+
+class CostLimitExceeded(ValueError):
+    def __init__(self, estimate, limit):
+        super().__init__(f'Expression rejected: it needs {estimate.describe()}, '
+                         f'more than the limit of {limit:.3g}')
+        self.estimate = estimate
+        self.limit = limit
+
+def check_cost(node, variables=None, points=None, limit=None, backend=None, x_range=(-10, 10)) -> CostEstimate:
+    """estimate(), raising CostLimitExceeded above limit (default functions.MaxEstimatedCost)"""
+    limit = functions.MaxEstimatedCost if limit is None else limit
+    cost = estimate(node, variables, points, x_range, backend)
+    if cost.evaluations > limit:
+        raise CostLimitExceeded(cost, limit)
+    return cost
+
+class _Scalar(Exception):
+    """The vectorized engine would give up on this expression"""
+
+class _Scope:
+    def __init__(self, shadowed, entries):
+        self.shadowed = shadowed
+        self.entries = entries
+
+class _Estimator:
+    def __init__(self, variables, ranges, backend, vectorized):
+        self.variables = variables
+        self.ranges = ranges
+        self.backend = backend
+        self.vectorized = vectorized
+        self.total = 0.0
+        self.loops = []
+        self.unknown_bounds = 0
+        self.scopes = []
+        # Levels of nested integrals in the outermost integral being visited
+        self.integral_levels = None
+        self.free = {}
+        self.bound = {}
+        self.expensive = {}
+
+    def run(self, node, multiplier):
+        self.visit(node, multiplier)
+        return CostEstimate(self.total, self.loops, self.vectorized, self.unknown_bounds)
+
+    def visit(self, node, multiplier):
+        if self.scopes and is_expensive(node, self.expensive):
+            names = free_variables(node, self.free)
+            for scope in self.scopes:
+                if not names & scope.shadowed:
+                    # Hoisted: evaluated once per entry into that loop
+                    multiplier = min(multiplier, scope.entries)
+                    break
+        self.total += multiplier
+        if isinstance(node, (SigmaSumNode, ProductNode, IntegralNode)):
+            self.visit_loop(node, multiplier)
+        elif isinstance(node, LimitNode):
+            self.visit(node.to, multiplier)
+            self.visit_body(node, node.expr, 2 * multiplier, multiplier, self.bound_range(node.to))
+        else:
+            for child in children(node):
+                self.visit(child, multiplier)
+
+    def visit_loop(self, node, multiplier):
+        outermost = isinstance(node, IntegralNode) and self.integral_levels is None
+        if outermost:
+            self.integral_levels = integral_depth(node)
+        try:
+            self.visit_loop_parts(node, multiplier)
+        finally:
+            if outermost:
+                self.integral_levels = None
+
+    def visit_loop_parts(self, node, multiplier):
+        self.visit(node.lower, multiplier)
+        self.visit(node.upper, multiplier)
+        before = self.total
+        loop = LoopCost(node, 1, multiplier, 0.0)
+        self.loops.append(loop)
+        lower, upper = self.bound_range(node.lower), self.bound_range(node.upper)
+        if lower is None or upper is None:
+            self.unknown_bounds += 1
+            iterations, var_range, body_multiplier = 1, None, multiplier
+        else:
+            lo, hi = min(lower[0], upper[0]), max(lower[1], upper[1])
+            var_range = (lo, hi)
+            iterations, body_multiplier = self.loop_steps(node, lower, upper, multiplier)
+        loop.iterations = iterations
+        self.visit_body(node, node.expr, body_multiplier, multiplier, var_range)
+        loop.evaluations = self.total - before
+
+    def loop_steps(self, node, lower, upper, multiplier):
+        """(steps per entry, multiplier of the body) of a loop with the given bound ranges"""
+        if isinstance(node, IntegralNode):
+            if self.vectorized:
+                raise _Scalar()
+            iterations = compiler.max_evaluations(self.integral_levels)
+            return iterations, multiplier * iterations
+        a, b = lower[0], upper[1]
+        if compiler.is_series(a, b):
+            if self.vectorized:
+                raise _Scalar()
+            # Both bounds infinite: summed as two one-sided series
+            sides = 2 if quadrature.is_infinite(a) and quadrature.is_infinite(b) else 1
+            iterations = sides * TYPICAL_SERIES_TERMS
+            return iterations, multiplier * iterations
+        iterations = max(0, int(b) - int(a) + 1)
+        if not self.vectorized and iterations >= functions.AggregateFastPathTerms:
+            kind = aggregates.fast_path_kind(node, self.backend)
+            if kind == 'closed form':
+                # Only the coefficients are evaluated
+                return iterations, multiplier
+            elif kind == 'chunked':
+                return iterations, multiplier * iterations * ARRAY_ELEMENT_COST
+        return iterations, multiplier * iterations
+
+    def visit_body(self, node, body, body_multiplier, entries, var_range):
+        shadowed = bound_variables(body, self.bound)
+        var = binding_variable(node)
+        saved = _UNSET
+        if var is not None:
+            shadowed = shadowed | {var}
+            saved = self.ranges.get(var, _UNSET)
+            if var_range is None:
+                self.ranges.pop(var, None)
+            else:
+                self.ranges[var] = var_range
+        self.scopes.append(_Scope(shadowed, entries))
+        try:
+            self.visit(body, body_multiplier)
+        finally:
+            self.scopes.pop()
+            if var is not None:
+                if saved is _UNSET:
+                    self.ranges.pop(var, None)
+                else:
+                    self.ranges[var] = saved
+
+    def bound_range(self, node):
+        """(min, max) of node over the ranges of the variables it uses, or None"""
+        names = sorted(free_variables(node, self.free) - set(self.variables) - set(CONSTANTS))
+        if any(name not in self.ranges for name in names) or len(names) > MAX_CORNER_VARIABLES:
+            return None
+        f = compiler.compile(node, self.backend)
+        values = []
+        try:
+            with EvaluationBudget(max_steps=MAX_BOUND_STEPS):
+                for corner in itertools.product(*(self.ranges[name] for name in names)):
+                    scope = dict(self.variables)
+                    scope.update(zip(names, corner))
+                    try:
+                        values.append(float(f(scope)))
+                    except BudgetExceeded:
+                        raise
+                    except Exception:
+                        pass
+        except BudgetExceeded:
+            return None
+        if not values:
+            return None
+        return min(values), max(values)
+
+_UNSET = object()
@@ -0,0 +1,96 @@
+import re
+import threading
+from collections import OrderedDict
+from functions import tokenize, Parser, parse
+from compiler import compile
+from optimizer import optimize_with_stats
+import kernels
+
+# Process-wide cache of tokenized, parsed, optimized and compiled expressions.
+#
+# Streamlit reruns FunCG.py on every widget change, but the module is only
+# imported once per server process, so entries survive reruns and are shared
+# by every session. Sessions run on separate threads, hence the lock. Entries
+# are per kernel backend, since constants are folded with its kernels.
+
+def normalize(expr : str) -> str:
+    """Canonical cache key: no whitespace around operators, single spaces elsewhere"""
+    expr = re.sub(r'[ \t]*([^\w. \t])[ \t]*', r'\1', expr.strip(' \t'))
+    return re.sub(r'[ \t]+', ' ', expr)
+
+class CachedExpression:
+    def __init__(self, text, tokens, ast, compiled, stats, backend):
+        self.text = text
+        self.tokens = tokens
+        self.ast = ast
+        self.compiled = compiled
+        self.stats = stats
+        self.backend = backend
+
+class ExpressionCache:
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, expr : str, backend=None) -> CachedExpression:
+        """Return the cached entry for expr, parsing and compiling it on a miss.
+
+        Syntax errors propagate and are not cached.
+        """
+        backend = kernels.get_backend(backend)
+        text = normalize(expr)
+        key = (text, backend.name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        # Parse outside the lock so a slow expression does not block other sessions
+        try:
+            tokens = tokenize(text)
+            tree = Parser(tokens, text).parse()
+        except (SyntaxError, RuntimeError):
+            # Report the error at its position in expr as typed, not in the normalized text
+            parse(expr)
+            raise
+        ast, stats = optimize_with_stats(tree, backend)
+        entry = CachedExpression(text, tokens, ast, compile(ast, backend), stats, backend)
+
+        with self._lock:
+            existing = self._entries.get(key)
+            if existing is not None:
+                return existing
+            self._entries[key] = entry
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+expression_cache = ExpressionCache()
+
+def get_expression(expr : str, backend=None) -> CachedExpression:
+    return expression_cache.get(expr, backend)
@@ -0,0 +1,136 @@
+import math
+import threading
+from collections import OrderedDict
+from budget import current_budget
+
+# Factorial service shared by the kernel backends.
+#
+# Exact factorials are computed by binary splitting: the product lo * ... * hi
+# is split in halves recursively, so the big-integer multiplications stay
+# balanced. Instead of remembering every n! ever computed, only checkpoints
+# (multiples of CHECKPOINT_INTERVAL) are cached, at most MAX_CHECKPOINTS of
+# them and MAX_CACHED_BITS in total, least recently used evicted first. n!
+# then costs one product over fewer than CHECKPOINT_INTERVAL factors on top of
+# the nearest cached checkpoint.
+#
+# Float results come from a table up to 170! (the largest finite float) and
+# from math.lgamma beyond, without building big integers at all.
+#
+# Every run of factors multiplied in a loop ticks the EvaluationBudget in
+# force under 'factorial()', so a huge factorial can be timed out or
+# cancelled; only the few big multiplications joining the halves at the top
+# of the split cannot be interrupted.
+
+CHECKPOINT_INTERVAL = 256
+MAX_CHECKPOINTS = 64
+MAX_CACHED_BITS = 1 << 26
+# Below this many factors a plain loop beats splitting
+_SPLIT_THRESHOLD = 16
+MAX_FLOAT_FACTORIAL = 170
+
+def product_range(lo : int, hi : int) -> int:
+    """lo * (lo + 1) * ... * hi, or 1 if the range is empty"""
+    if hi - lo < _SPLIT_THRESHOLD:
+        budget = current_budget()
+        if budget is not None and hi >= lo:
+            budget.tick('factorial()', hi - lo + 1)
+        result = 1
+        for i in range(lo, hi + 1):
+            result *= i
+        return result
+    mid = (lo + hi) // 2
+    return product_range(lo, mid) * product_range(mid + 1, hi)
+
+class FactorialCache:
+    def __init__(self, interval=CHECKPOINT_INTERVAL, maxsize=MAX_CHECKPOINTS, max_bits=MAX_CACHED_BITS):
+        self.interval = interval
+        self.maxsize = maxsize
+        self.max_bits = max_bits
+        self.bits = 0
+        self.hits = 0
+        self.misses = 0
+        self._checkpoints = OrderedDict()
+        self._lock = threading.Lock()
+
+    def factorial(self, n : int) -> int:
+        if n < 0:
+            raise ValueError("factorial undefined for negative numbers")
+        if n < self.interval:
+            return product_range(2, n)
+        checkpoint = n - n % self.interval
+        with self._lock:
+            base = self._checkpoints.get(checkpoint)
+            if base is not None:
+                self._checkpoints.move_to_end(checkpoint)
+                self.hits += 1
+            else:
+                self.misses += 1
+                # Start from the largest cached checkpoint below, if any
+                below = max((c for c in self._checkpoints if c < checkpoint), default=0)
+                start = self._checkpoints.get(below, 1)
+        if base is None:
+            # Multiply outside the lock so a huge factorial does not block other sessions
+            base = start * product_range(below + 1, checkpoint)
+            self._store(checkpoint, base)
+        return base * product_range(checkpoint + 1, n)
+
+    def _store(self, checkpoint, value):
+        size = value.bit_length()
+        if size > self.max_bits:
+            return
+        with self._lock:
+            if checkpoint in self._checkpoints:
+                return
+            self._checkpoints[checkpoint] = value
+            self.bits += size
+            while len(self._checkpoints) > self.maxsize or self.bits > self.max_bits:
+                _, evicted = self._checkpoints.popitem(last=False)
+                self.bits -= evicted.bit_length()
+
+    def clear(self):
+        with self._lock:
+            self._checkpoints.clear()
+            self.bits = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'checkpoints': len(self._checkpoints),
+                'maxsize': self.maxsize,
+                'bits': self.bits,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+factorial_cache = FactorialCache()
+
+def factorial(n : int) -> int:
+    """Exact n!, for integer n >= 0"""
+    return factorial_cache.factorial(n)
+
+FLOAT_FACTORIALS = [float(product_range(2, n)) for n in range(MAX_FLOAT_FACTORIAL + 1)]
+RECIPROCAL_FACTORIALS = [1 / f for f in FLOAT_FACTORIALS]
+
+def log_factorial(n : float) -> float:
+    """ln(n!) via the log-gamma function, also for large or non-integer n"""
+    if n < 0:
+        raise ValueError("factorial undefined for negative numbers")
+    return math.lgamma(n + 1)
+
+def factorial_float(n : int) -> float:
+    """n! as a float (inf once it no longer fits)"""
+    if n < 0:
+        raise ValueError("factorial undefined for negative numbers")
+    if n <= MAX_FLOAT_FACTORIAL:
+        return FLOAT_FACTORIALS[n]
+    return math.inf
+
+def reciprocal_factorial(n : int) -> float:
+    """1 / n! as a float, 0.0 once it underflows"""
+    if n < 0:
+        raise ValueError("factorial undefined for negative numbers")
+    if n <= MAX_FLOAT_FACTORIAL:
+        return RECIPROCAL_FACTORIALS[n]
+    return math.exp(-log_factorial(n))
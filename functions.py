@@ -1,9 +1,12 @@
 import re
 import math
 from fractions import Fraction
+import factorials
+from budget import current_budget
 
-# Token types
-NUMBER, IDENT, OP, LPAREN, RPAREN, COMMA = 'NUMBER', 'IDENT', 'OP', 'LPAREN', 'RPAREN', 'COMMA'
+# Token types, as small integers; TOKEN_NAMES[type] spells them out for messages
+NUMBER, IDENT, OP, LPAREN, RPAREN, COMMA = range(6)
+TOKEN_NAMES = ('NUMBER', 'IDENT', 'OP', 'LPAREN', 'RPAREN', 'COMMA')
 
 SUPPORTED_FUNCTIONS = [
     'sum', 'integral', 'product', 'logarithm', 'absolute', 'factorial',
@@ -11,68 +14,82 @@ SUPPORTED_FUNCTIONS = [
     'sin', 'cos', 'tan', 'ctg', 'arcsin', 'arccos', 'arctan', 'arcctg'
 ]
 
+# The scanner: one precompiled pattern matching a token and the blanks before
+# it, with groups 1 to 4 for numbers, names, punctuation and any other
+# character, which is an error.
+_TOKEN_PATTERN = re.compile(
+    r'[ \t]*(?:(\d+(?:\.\d*)?(?:[eE][+-]?\d+)?)|([a-zA-Z_][a-zA-Z0-9_]*)|([-+*/^=(),])|([^ \t]))')
+_PUNCTUATION = {
+    '+': (OP, '+'), '-': (OP, '-'), '*': (OP, '*'), '/': (OP, '/'), '^': (OP, '^'), '=': (OP, '='),
+    '(': (LPAREN, '('), ')': (RPAREN, ')'), ',': (COMMA, ','),
+}
+
 def tokenize(expr : str) -> list:
-    token_spec = [
-        (NUMBER,  r'\d+(\.\d*)?([eE][+-]?\d+)?'),
-        (IDENT,   r'[a-zA-Z_][a-zA-Z0-9_]*'),
-        (OP,      r'[\+\-\*/\^=]'),
-        (LPAREN,  r'\('),
-        (RPAREN,  r'\)'),
-        (COMMA,   r','),
-        ('SKIP',  r'[ \t]+'),
-        ('MISMATCH', r'.'),
-    ]
-    tok_regex = '|'.join('(?P<%s>%s)' % pair for pair in token_spec)
-    get_token = re.compile(tok_regex).match
-    pos = 0
     tokens = []
-    mo = get_token(expr, pos)
-    while mo:
-        kind = mo.lastgroup
-        value = mo.group()
-        if kind == NUMBER:
-            tokens.append((NUMBER, float(value)))
-        elif kind == IDENT:
-            tokens.append((IDENT, value))
-        elif kind == OP:
-            tokens.append((OP, value))
-        elif kind == LPAREN:
-            tokens.append((LPAREN, value))
-        elif kind == RPAREN:
-            tokens.append((RPAREN, value))
-        elif kind == COMMA:
-            tokens.append((COMMA, value))
-        elif kind == 'SKIP':
-            pass
-        elif kind == 'MISMATCH':
-            raise RuntimeError(f'Unexpected character: {value}')
-        pos = mo.end()
-        mo = get_token(expr, pos)
+    append = tokens.append
+    for match in _TOKEN_PATTERN.finditer(expr):
+        kind = match.lastindex
+        value = match.group(kind)
+        if kind == 3:
+            append(_PUNCTUATION[value])
+        elif kind == 2:
+            append((IDENT, value))
+        elif kind == 1:
+            append((NUMBER, float(value)))
+        else:
+            position = match.start(kind)
+            character = value if value.isprintable() else repr(value)
+            error = RuntimeError(f'Unexpected character: {character} at position {position}')
+            error.position = position
+            raise error
     return tokens
 
+def token_offsets(expr : str) -> list:
+    """Character offset in expr of each token tokenize() finds, and of the
+    first unexpected character, if any"""
+    return [match.start(match.lastindex) for match in _TOKEN_PATTERN.finditer(expr)]
+
+# Nodes are slotted, without an instance __dict__, to keep large trees small.
+# __weakref__ is kept so that caches can key on nodes (see compiler.compile_cached)
 class ASTNode:
-    pass
+    __slots__ = ('__weakref__',)
 
 class NumberNode(ASTNode):
+    __slots__ = ('value',)
+
     def __init__(self, value):
         self.value = value
 
 class VariableNode(ASTNode):
+    __slots__ = ('name',)
+
     def __init__(self, name):
         self.name = name
 
 class BinaryOpNode(ASTNode):
+    __slots__ = ('left', 'op', 'right')
+
     def __init__(self, left, op, right):
         self.left = left
         self.op = op
         self.right = right
 
+class NegateNode(ASTNode):
+    __slots__ = ('operand',)
+
+    def __init__(self, operand):
+        self.operand = operand
+
 class FunctionCallNode(ASTNode):
+    __slots__ = ('func_name', 'args')
+
     def __init__(self, func_name, args):
         self.func_name = func_name
         self.args = args
 
 class SigmaSumNode(ASTNode):
+    __slots__ = ('var', 'lower', 'upper', 'expr')
+
     def __init__(self, var, lower, upper, expr):
         self.var = var
         self.lower = lower
@@ -80,6 +97,8 @@ class SigmaSumNode(ASTNode):
         self.expr = expr
 
 class ProductNode(ASTNode):
+    __slots__ = ('var', 'lower', 'upper', 'expr')
+
     def __init__(self, var, lower, upper, expr):
         self.var = var
         self.lower = lower
@@ -87,6 +106,8 @@ class ProductNode(ASTNode):
         self.expr = expr
 
 class IntegralNode(ASTNode):
+    __slots__ = ('var', 'lower', 'upper', 'expr')
+
     def __init__(self, var, lower, upper, expr):
         self.var = var
         self.lower = lower
@@ -94,146 +115,244 @@ class IntegralNode(ASTNode):
         self.expr = expr
 
 class LimitNode(ASTNode):
+    __slots__ = ('var', 'to', 'expr')
+
     def __init__(self, var, to, expr):
         self.var = var
         self.to = to
         self.expr = expr
 
+# Binding strength of the operators; NEGATE stands for a leading minus sign,
+# which binds tighter than * and / but looser than ^
+NEGATE = 'negate'
+PRECEDENCE = {'+': 1, '-': 1, '*': 2, '/': 2, NEGATE: 3, '^': 4}
+
+def _token_text(tok):
+    return None if tok is None else (TOKEN_NAMES[tok[0]], tok[1])
+
 class Parser:
-    def __init__(self, tokens):
-        self.tokens = tokens
-        self.pos = 0
+    """Parses a token list into an AST.
 
-    def peek(self):
-        if self.pos < len(self.tokens):
-            return self.tokens[self.pos]
-        return None
+    The parser keeps its own stacks of open parentheses and pending
+    operators instead of recursing, so the nesting depth of an expression
+    is not limited by Python's recursion limit.
 
-    def advance(self):
-        self.pos += 1
+    Given the text the tokens come from, syntax errors report the character
+    offset of the offending token in their message and as error.position.
+    """
+    def __init__(self, tokens, text=None):
+        self.tokens = tokens
+        self.text = text
+        self.pos = 0
 
-    def expect(self, token_type, value=None):
-        tok = self.peek()
-        if not tok or tok[0] != token_type or (value is not None and tok[1] != value):
-            raise SyntaxError(f'Expected {token_type} {value}, got {tok}')
-        self.advance()
-        return tok
+    def error(self, message, index) -> SyntaxError:
+        """SyntaxError about the token at index, or the end of input past the last one"""
+        position = None
+        if self.text is not None:
+            offsets = token_offsets(self.text)
+            position = offsets[index] if index < len(offsets) else len(self.text)
+            message = f'{message} at position {position}'
+        error = SyntaxError(message)
+        error.position = position
+        return error
 
     def parse(self):
-        node = self.parse_expression()
-        if self.peek() is not None:
-            raise SyntaxError('Unexpected token at end')
-        return node
-
-    def parse_expression(self):
-        node = self.parse_term()
-        while self.peek() and self.peek()[0] == OP and self.peek()[1] in ('+', '-'):
-            op = self.peek()[1]
-            self.advance()
-            right = self.parse_term()
-            node = BinaryOpNode(node, op, right)
-        return node
-
-    def parse_term(self):
-        node = self.parse_factor()
-        while self.peek() and self.peek()[0] == OP and self.peek()[1] in ('*', '/'):
-            op = self.peek()[1]
-            self.advance()
-            right = self.parse_factor()
-            node = BinaryOpNode(node, op, right)
-        return node
-
-    def parse_factor(self):
-        tok = self.peek()
-        if tok and tok[1] == '-':
-            self.advance()
-            return BinaryOpNode(NumberNode(0), '-', self.parse_power())
-        return self.parse_power()
-
-    def parse_power(self):
-        node = self.parse_atom()
-        if self.peek() and self.peek()[1] == '^':
-            op = self.peek()[1]
-            self.advance()
-            right = self.parse_power()
-            node = BinaryOpNode(node, op, right)
-        return node
-
-    def parse_atom(self):
-        tok = self.peek()
-        if not tok:
-            raise SyntaxError('Unexpected end of input')
-        if tok[0] == NUMBER:
-            self.advance()
-            return NumberNode(tok[1])
-        elif tok[0] == IDENT:
-            name = tok[1]
-            self.advance()
-            if self.peek() and self.peek()[0] == LPAREN:
-                self.advance()
-                args = self.parse_arguments()
-                self.expect(RPAREN)
-                if name == 'sum':
-                    if len(args) != 4:
-                        raise SyntaxError('sum expects 4 arguments: var, lower, upper, expr')
-                    return SigmaSumNode(args[0].name if isinstance(args[0], VariableNode) else args[0], args[1], args[2], args[3])
-                elif name == 'product':
-                    if len(args) != 4:
-                        raise SyntaxError('product expects 4 arguments: var, lower, upper, expr')
-                    return ProductNode(args[0].name if isinstance(args[0], VariableNode) else args[0], args[1], args[2], args[3])
-                elif name == 'integral':
-                    if len(args) != 4:
-                        raise SyntaxError('integral expects 4 arguments: var, lower, upper, expr')
-                    return IntegralNode(args[0].name if isinstance(args[0], VariableNode) else args[0], args[1], args[2], args[3])
-                elif name == 'lim':
-                    if len(args) != 3:
-                        raise SyntaxError('limit expects 3 arguments: var, to, expr')
-                    return LimitNode(args[0].name if isinstance(args[0], VariableNode) else args[0], args[1], args[2])
+        tokens = self.tokens
+        count = len(tokens)
+        pos = 0
+        # The open groups around the current one: (call name, arguments, operands, operators),
+        # with arguments None for a parenthesis
+        frames = []
+        name, args, operands, operators = None, None, [], []
+        expect_operand = True
+        # The operator before the expected operand, None at the start of an expression
+        after = None
+        while True:
+            tok = tokens[pos] if pos < count else None
+            if expect_operand:
+                if tok is None:
+                    raise self.error('Unexpected end of input', pos)
+                kind, value = tok
+                pos += 1
+                if value == '-' and after != '^' and after != NEGATE:
+                    operators.append(NEGATE)
+                    after = NEGATE
+                elif kind == NUMBER:
+                    operands.append(NumberNode(value))
+                    expect_operand = False
+                elif kind == IDENT and pos < count and tokens[pos][0] == LPAREN:
+                    pos += 1
+                    frames.append((name, args, operands, operators))
+                    name, args, operands, operators = value, [], [], []
+                    after = None
+                elif kind == IDENT:
+                    operands.append(VariableNode(value))
+                    expect_operand = False
+                elif kind == LPAREN:
+                    frames.append((name, args, operands, operators))
+                    name, args, operands, operators = None, None, [], []
+                    after = None
                 else:
-                    return FunctionCallNode(name, args)
-            else:
-                return VariableNode(name)
-        elif tok[0] == LPAREN:
-            self.advance()
-            node = self.parse_expression()
-            self.expect(RPAREN)
-            return node
-        else:
-            raise SyntaxError(f'Unexpected token: {tok}')
+                    raise self.error(f'Unexpected token: {_token_text(tok)}', pos - 1)
+                continue
 
-    def parse_arguments(self):
-        args = []
-        while True:
-            arg = self.parse_expression()
-            args.append(arg)
-            tok = self.peek()
-            if tok and tok[0] == COMMA:
-                self.advance()
+            if tok is not None and tok[0] == OP and tok[1] != '=':
+                op = tok[1]
+                # ^ is right-associative, the others left-associative
+                _reduce(operands, operators, PRECEDENCE[op] + (op == '^'))
+                operators.append(op)
+                after = op
+                expect_operand = True
+                pos += 1
                 continue
-            else:
-                break
-        return args
+
+            # End of the current expression
+            _reduce(operands, operators, 0)
+            node = operands.pop()
+            if not frames:
+                if tok is not None:
+                    raise self.error('Unexpected token at end', pos)
+                self.pos = pos
+                return node
+            if args is not None and tok is not None and tok[0] == COMMA:
+                args.append(node)
+                after = None
+                expect_operand = True
+                pos += 1
+                continue
+            if tok is None or tok[0] != RPAREN:
+                raise self.error(f'Expected RPAREN None, got {_token_text(tok)}', pos)
+            pos += 1
+            if args is not None:
+                args.append(node)
+                try:
+                    node = _call_node(name, args)
+                except SyntaxError as error:
+                    raise self.error(str(error), pos - 1) from None
+            name, args, operands, operators = frames.pop()
+            operands.append(node)
+
+def _reduce(operands, operators, precedence):
+    """Apply the pending operators binding at least as tightly as precedence"""
+    while operators and PRECEDENCE[operators[-1]] >= precedence:
+        op = operators.pop()
+        if op == NEGATE:
+            operands[-1] = BinaryOpNode(NumberNode(0), '-', operands[-1])
+        else:
+            right = operands.pop()
+            operands[-1] = BinaryOpNode(operands[-1], op, right)
+
+def _call_node(name, args):
+    if name == 'sum':
+        if len(args) != 4:
+            raise SyntaxError('sum expects 4 arguments: var, lower, upper, expr')
+        return SigmaSumNode(args[0].name if isinstance(args[0], VariableNode) else args[0], args[1], args[2], args[3])
+    elif name == 'product':
+        if len(args) != 4:
+            raise SyntaxError('product expects 4 arguments: var, lower, upper, expr')
+        return ProductNode(args[0].name if isinstance(args[0], VariableNode) else args[0], args[1], args[2], args[3])
+    elif name == 'integral':
+        if len(args) != 4:
+            raise SyntaxError('integral expects 4 arguments: var, lower, upper, expr')
+        return IntegralNode(args[0].name if isinstance(args[0], VariableNode) else args[0], args[1], args[2], args[3])
+    elif name == 'lim':
+        if len(args) != 3:
+            raise SyntaxError('limit expects 3 arguments: var, to, expr')
+        return LimitNode(args[0].name if isinstance(args[0], VariableNode) else args[0], args[1], args[2])
+    return FunctionCallNode(name, args)
+
+def parse(expr : str):
+    """Tokenize and parse expr into an AST"""
+    return Parser(tokenize(expr), expr).parse()
+
+def parse_many(expressions):
+    """Parse expressions one at a time as they are consumed, yielding
+    (expression, AST) pairs, or (expression, error) for one that does not
+    parse; error.position is where in the expression it went wrong.
+    """
+    for expr in expressions:
+        try:
+            yield expr, parse(expr)
+        except (SyntaxError, RuntimeError) as error:
+            yield expr, error
 
 ISPTCPrecision = 1000
 ESCPrecision = 100
 
-def evaluate(node, variables=None):
+# Adaptive integral(): absolute/relative tolerance and evaluation budget per call
+IntegralTolerance = 1e-10
+IntegralMaxEvaluations = 5000
+# Integrand evaluations of an integral and the integrals nested in it, over all
+# levels: each of n levels gets IntegralNestedMaxEvaluations ** (1/n) per call
+IntegralNestedMaxEvaluations = 10**6
+
+# Finite sum()/product() over at least this many terms try the closed-form and
+# vectorized fast paths first
+AggregateFastPathTerms = 256
+
+# sum()/product() with an inf bound: series tolerance and term budget per call
+SeriesTolerance = 1e-10
+SeriesMaxTerms = 2**20
+
+CONSTANTS = {'pi': math.pi, 'e': math.e, 'inf': 1e8}
+
+# Kernel backend used when evaluate()/compile() are not given one, see kernels.py
+DefaultKernelBackend = 'fast'
+
+# Evaluations started from the UI: expressions estimated (see cost.py) to need
+# more node evaluations than MaxEstimatedCost are rejected up front, running ones
+# are stopped after EvaluationMaxSteps loop steps or EvaluationTimeout seconds
+# (see budget.py)
+MaxEstimatedCost = 10**8
+EvaluationMaxSteps = 10**8
+EvaluationTimeout = 30.0
+
+# Parallel evaluation on a process pool (see parallel.py): with 'auto', work
+# estimated at ParallelMinCost node evaluations or more is split across
+# ParallelWorkers processes (None: one per CPU); 'serial' and 'parallel' force
+# either way
+ParallelMode = 'auto'
+ParallelWorkers = None
+ParallelMinCost = 10**6
+
+# Result cache (see result_cache.py): results and plot samples are kept in
+# memory, up to ResultCacheMemoryBytes, and in the SQLite file ResultCachePath
+# (None: memory only), up to ResultCacheDiskBytes, for ResultCacheTTL seconds.
+# Only the app keeps results on disk by default, in result_cache.DEFAULT_PATH
+ResultCacheEnabled = True
+ResultCachePath = None
+ResultCacheMemoryBytes = 1 << 26
+ResultCacheDiskBytes = 1 << 28
+ResultCacheTTL = 7 * 24 * 3600
+
+# Calculations started from the UI run as background jobs (see jobs.py) on
+# up to JobWorkers threads at once
+JobWorkers = 4
+
+def evaluate(node, variables=None, backend=None):
     if variables is None:
         variables = {}
+    backend = kernels.get_backend(backend)
+    try:
+        return _evaluate(node, variables, backend)
+    except RecursionError:
+        # Too deep to walk recursively: run it as a flat postfix program
+        return postfix.run(postfix.flatten(node, backend), variables)
+
+def _evaluate(node, variables, backend):
     if isinstance(node, NumberNode):
         return node.value
     elif isinstance(node, VariableNode):
-        constants = {'pi': math.pi, 'e': math.e, 'inf': 1e8}
         lname = node.name.lower()
         if lname in variables:
             return variables[lname]
-        elif lname in constants:
-            return constants[lname]
+        elif lname in CONSTANTS:
+            return CONSTANTS[lname]
         else:
             raise ValueError(f"Variable '{node.name}' not defined")
     elif isinstance(node, BinaryOpNode):
-        left = evaluate(node.left, variables)
-        right = evaluate(node.right, variables)
+        left = _evaluate(node.left, variables, backend)
+        right = _evaluate(node.right, variables, backend)
         if node.op == '+':
             return left + right
         elif node.op == '-':
@@ -243,109 +362,70 @@ def evaluate(node, variables=None):
         elif node.op == '/':
             return left / right
         elif node.op == '^':
-            return power(left, right)
+            return backend.power(left, right)
         else:
             raise ValueError(f"Unknown operator: {node.op}")
+    elif isinstance(node, NegateNode):
+        return -_evaluate(node.operand, variables, backend)
     elif isinstance(node, FunctionCallNode):
-        args = [evaluate(arg, variables) for arg in node.args]
+        args = [_evaluate(arg, variables, backend) for arg in node.args]
         fname = node.func_name.lower()
-        trig_funcs = {
-            'sin': sin, 'cos': cos, 'tg': tg, 'ctg' : ctg,
-            'arcsin': arcsin, 'arccos': arccos, 'arctg': arctg, 'arcctg' : arcctg
-        }
-        if fname in trig_funcs:
-            return trig_funcs[fname](*args)
+        if fname in backend.trig_funcs:
+            return backend.trig_funcs[fname](*args)
         elif fname == 'logarithm':
             if len(args) == 1:
-                return logarithm(math.e, args[0])
+                return backend.logarithm(math.e, args[0])
             elif len(args) == 2:
-                return logarithm(args[0], args[1])
+                return backend.logarithm(args[0], args[1])
             else:
                 raise ValueError('logarithm expects 1 or 2 arguments')
         elif fname == 'absolute':
-            return absolute(args[0])
+            return backend.absolute(args[0])
         elif fname == 'factorial':
-            return factorial(int(args[0]))
+            return backend.factorial(int(args[0]))
         elif fname == 'floor':
-            return floor(args[0])
+            return backend.floor(args[0])
         elif fname == 'ceiling':
-            return ceiling(args[0])
+            return backend.ceiling(args[0])
         else:
             raise ValueError(f"Unknown function: {fname}")
-    elif isinstance(node, SigmaSumNode):
-        var = node.var
-        lower = int(evaluate(node.lower, variables))
-        upper = int(evaluate(node.upper, variables))
-        total = 0
-        for i in range(lower, upper + 1):
-            variables[var] = i
-            total += evaluate(node.expr, variables)
-        del variables[var]
-        return total
-    elif isinstance(node, ProductNode):
-        var = node.var
-        lower = int(evaluate(node.lower, variables))
-        upper = int(evaluate(node.upper, variables))
-        prod = 1
-        for i in range(lower, upper + 1):
-            variables[var] = i
-            prod *= evaluate(node.expr, variables)
-        del variables[var]
-        return prod
-    elif isinstance(node, IntegralNode):
-        var = node.var
-        a = evaluate(node.lower, variables)
-        b = evaluate(node.upper, variables)
-        n = ISPTCPrecision
-        # Simpson's Rule
-        if n % 2 == 1:
-            n += 1
-        h = (b - a) / n
-        total = 0.0
-        for i in range(n + 1):
-            x = a + i * h
-            variables[var] = x
-            f = evaluate(node.expr, variables)
-            if i == 0 or i == n:
-                total += f
-            elif i % 2 == 1:
-                total += 4 * f
-            else:
-                total += 2 * f
-        del variables[var]
-        return total * h / 3
+    elif isinstance(node, (SigmaSumNode, ProductNode, IntegralNode)):
+        # Loops run compiled, with loop-invariant subtrees evaluated once
+        return compiler.compile_cached(node, backend)(variables)
     elif isinstance(node, LimitNode):
         var = node.var
         if not isinstance(var, str):
             raise ValueError("First argument to limit must be a variable name")
-        to = evaluate(node.to, variables)
-        eps = 1e-6
-        try:
-            variables[var] = to - eps
-            left = evaluate(node.expr, variables)
-            variables[var] = to + eps
-            right = evaluate(node.expr, variables)
-        finally:
-            if var in variables:
-                del variables[var]
-        if abs(left - right) < 1e-4 and all(map(lambda v: abs(v) < 1e10, [left, right])):
-            return (left + right) / 2
-        else:
-            raise ValueError("Limit does not exist (left/right limits differ)")
+        to = _evaluate(node.to, variables, backend)
+        return two_sided_limit(compiler.compile_cached(node.expr, backend), var, to, variables)
     else:
         raise ValueError(f"Unknown AST node: {type(node)}")
 
+def two_sided_limit(f, var, to, variables):
+    """Approach `to` from both sides with the compiled callable f"""
+    eps = 1e-6
+    try:
+        variables[var] = to - eps
+        left = f(variables)
+        variables[var] = to + eps
+        right = f(variables)
+    finally:
+        if var in variables:
+            del variables[var]
+    if abs(left - right) < 1e-4 and all(map(lambda v: abs(v) < 1e10, [left, right])):
+        return (left + right) / 2
+    else:
+        raise ValueError("Limit does not exist (left/right limits differ)")
+
 # Math functions
-factorialsmemo = {0 : 1, 1 : 1}
+
+# The reference floor() and integer power() loop once per unit of their
+# argument; they tick the EvaluationBudget in force every this many steps
+KERNEL_TICK_STEPS = 1024
+
 def factorial(x : int) -> int:
-    if x in factorialsmemo:
-        return factorialsmemo[x]
-    last = max(factorialsmemo)
-    ans = factorialsmemo[last]
-    for i in range(last + 1, x + 1):
-        ans *= i
-        factorialsmemo[i] = ans
-    return ans
+    # Bounded, thread-safe checkpoint cache, see factorials.py
+    return factorials.factorial(x)
 
 def absolute(x : float) -> float:
     return -x if x < 0 else x
@@ -357,13 +437,19 @@ def ceiling(x: float) -> int:
     return ans
 
 def floor(x: float) -> int:
+    # Counts to x, so a budget in force is ticked every KERNEL_TICK_STEPS steps
+    budget = current_budget()
     ans = 0
     if x >= 0:
         while ans + 1 <= x:
             ans += 1
+            if budget is not None and ans % KERNEL_TICK_STEPS == 0:
+                budget.tick('floor()', KERNEL_TICK_STEPS)
     else:
         while ans - 1 >= x:
             ans -= 1
+            if budget is not None and ans % KERNEL_TICK_STEPS == 0:
+                budget.tick('floor()', KERNEL_TICK_STEPS)
     return ans
 
 def integer(x: float) -> int:
@@ -418,11 +504,14 @@ def power(b : float, p : float) -> float:
     
     # Integer powers - use repeated multiplication
     if p == integer(p):
+        budget = current_budget()
         ans = 1.0
         exp = int(abs(p))
         base = b if p > 0 else 1/b
-        for _ in range(exp):
+        for i in range(1, exp + 1):
             ans *= base
+            if budget is not None and i % KERNEL_TICK_STEPS == 0:
+                budget.tick('power()', KERNEL_TICK_STEPS)
         return ans
     
     # Negative base with non-integer exponent
@@ -434,7 +523,7 @@ def power(b : float, p : float) -> float:
         result = 0.0
         for i in range(ESCPrecision + 1):
             p_power = _int_power(p, i)
-            result += p_power / factorial(i)
+            result += p_power * factorials.reciprocal_factorial(i)
         return result
     
     # For general b^p where b > 0, use: b^p = e^(p * ln(b))
@@ -517,3 +606,14 @@ def arctg(x: float) -> float:
 
 def arcctg(x : float) -> float:
     return math.pi / 2 - arctg(x)
+
+TRIG_FUNCS = {
+    'sin': sin, 'cos': cos, 'tg': tg, 'ctg' : ctg,
+    'arcsin': arcsin, 'arccos': arccos, 'arctg': arctg, 'arcctg' : arcctg
+}
+
+# Imported last: the kernel backends, the compiler and the postfix machine build
+# on the node classes and kernels above
+import kernels
+import compiler
+import postfix
@@ -1,49 +1,176 @@
-import matplotlib.pyplot as plt
-import math
-from functions import evaluate
-
-num_points = 20000
-def plot_function(ast, x_min=-10, x_max=10, y_min=-8, y_max=8):
-
-    x_values = []
-    y_values = []
-    
-    for i in range(num_points):
-        x = x_min + (x_max - x_min) * i / num_points
-        x_values.append(x)
-
-        try:
-            y = evaluate(ast, {"x": x})
-
-            if math.isfinite(y) and y_min <= y <= y_max:
-                y_values.append(y)
-            else:
-                y_values.append(None)
-
-        except:
-            y_values.append(None)
-
-    if all(v is None for v in y_values):
-        raise ValueError("Function has no valid values in visible range")
-    
-    fig, ax = plt.subplots(figsize=(10, 5))
-    ax.plot(x_values, y_values, color = 'red', linewidth=2)
-
-    ax.set_xlim(x_min, x_max)
-    ax.set_ylim(y_min, y_max)
-    ax.grid(True)
-
-    # Optional: hide top and right spines
-    ax.spines['top'].set_visible(False)
-    ax.spines['right'].set_visible(False)
-
-    if x_min <= 0 <= x_max:
-        ax.axvline(0, color = "#000000")
-
-    if y_min <= 0 <= y_max:
-        ax.axhline(0, color = "#000000")
-
-    ax.set_xlabel("x")
-    ax.set_ylabel("y")
-
-    return fig
+import matplotlib
+import numpy as np
+from matplotlib.figure import Figure
+from compiler import compile
+from budget import current_budget, BudgetExceeded
+from sampling import adaptive_sample
+import intervals
+import tiles
+import result_cache
+import rendering
+import parallel
+import cost
+import kernels
+from vectorized import evaluate_array, evaluate_arrays, NotVectorizable
+
+num_points = 20000
+
+def sample_function(ast, x_values, backend=None):
+    """Evaluate ast over x_values, returning NaN wherever f(x) is undefined.
+
+    Uses the vectorized engine and falls back to the compiled scalar evaluator
+    only for constructs it cannot vectorize.
+    """
+    try:
+        return evaluate_array(ast, {"x": x_values}, backend)
+    except NotVectorizable:
+        return _sample_scalar(ast, x_values, backend)
+    except BudgetExceeded:
+        raise
+    except Exception:
+        return np.full(len(x_values), np.nan)
+
+def sample_functions(asts, x_values, backend=None):
+    """Evaluate several ASTs over x_values in one pass, as a 2-D array with
+    one row per AST. Subexpressions common to several of them are computed
+    once, and an AST that fails gives a row of NaN without affecting the others.
+    """
+    rows = []
+    for ast, result in zip(asts, evaluate_arrays(asts, {"x": x_values}, backend)):
+        if isinstance(result, NotVectorizable):
+            result = _sample_scalar(ast, x_values, backend)
+        elif isinstance(result, Exception):
+            result = np.full(len(x_values), np.nan)
+        rows.append(result)
+    return np.array(rows, dtype=float).reshape(len(asts), len(x_values))
+
+def _sample_scalar(ast, x_values, backend):
+    f = compile(ast, backend)
+    y_values = np.empty(len(x_values))
+    budget = current_budget()
+    for i, x in enumerate(x_values):
+        if budget is not None:
+            budget.tick('plot')
+        try:
+            y_values[i] = f({"x": float(x)})
+        except BudgetExceeded:
+            raise
+        except Exception:
+            y_values[i] = np.nan
+    return y_values
+
+def sample_plots(asts, x_min=-10, x_max=10, y_min=-8, y_max=8, backend=None, max_points=None, cache_key=None):
+    """Sample several ASTs over the window on one shared grid, adaptively
+    with at most max_points evaluations (num_points by default), as arrays
+    x and y with one row of y per AST, NaN wherever a curve is undefined,
+    broken or outside the window. With exact kernels, regions that interval
+    arithmetic proves to be off-screen for every curve are not sampled.
+
+    With a cache_key identifying the expressions, samples come from the tile
+    cache (see tiles.py), so panning and zooming back only sample new tiles,
+    and a view sampled before, in any session, comes whole from the result
+    cache (see result_cache.py) as read-only arrays.
+    """
+    if max_points is None:
+        max_points = num_points
+    def sample():
+        f = _sampler(asts, backend, x_min, x_max)
+        def bound(lo, hi):
+            bounds = [intervals.bound(ast, lo, hi) for ast in asts]
+            return np.array([b[0] for b in bounds]), np.array([b[1] for b in bounds])
+        if not kernels.get_backend(backend).exact:
+            # Inaccurate kernels may put points outside the exact bounds
+            bound = None
+        if cache_key is None:
+            samples = adaptive_sample(f, x_min, x_max, max_points, y_min, y_max, bound=bound)
+        else:
+            viewport = tiles.Viewport(x_min, x_max, y_min, y_max)
+            samples = tiles.sample_viewport(cache_key, f, viewport, max_points, bound)
+        y_values = samples.y
+        y_values[~(np.isfinite(y_values) & (y_values >= y_min) & (y_values <= y_max))] = np.nan
+        return samples.x, y_values
+
+    if cache_key is None:
+        x_values, y_values = sample()
+    else:
+        x_values, y_values = result_cache.cached('plot', asts, sample, backend,
+                                                 (float(x_min), float(x_max), float(y_min), float(y_max), max_points))
+
+    if np.isnan(y_values).all():
+        if len(asts) == 1:
+            raise ValueError("Function has no valid values in visible range")
+        raise ValueError("No function has valid values in visible range")
+    return x_values, y_values
+
+def _sampler(asts, backend, x_min, x_max):
+    """sample_functions() of asts as a function of x, split across the worker
+    pool for batches estimated to be expensive enough (see parallel.py)"""
+    backend = kernels.get_backend(backend).name
+    point_cost = sum(cost.estimate(ast, points=1, x_range=(x_min, x_max), backend=backend).evaluations
+                     for ast in asts)
+    def f(x_values):
+        budget = current_budget()
+        if budget is not None:
+            # Counts the points sampled, and lets a cancelled plot stop between rounds
+            budget.tick('points', len(x_values))
+        if len(x_values) >= 2 * parallel.MIN_CHUNK and parallel.worthwhile(point_cost * len(x_values)):
+            chunks = parallel.split(x_values)
+            return np.concatenate(parallel.run(sample_functions, [(asts, chunk, backend) for chunk in chunks]), axis=-1)
+        return sample_functions(asts, x_values, backend)
+    return f
+
+def sample_plot(ast, x_min=-10, x_max=10, y_min=-8, y_max=8, backend=None, max_points=None, cache_key=None):
+    """sample_plots() of a single AST, with y as a 1-D array"""
+    x_values, y_values = sample_plots([ast], x_min, x_max, y_min, y_max, backend, max_points, cache_key)
+    return x_values, y_values[0]
+
+def plot_functions(asts, x_min=-10, x_max=10, y_min=-8, y_max=8, backend=None, max_points=None,
+                   cache_key=None, labels=None):
+    """Figure of several ASTs over the window, sampled as by sample_plots()
+    and decimated to the pixel width of the axes, with a legend of labels."""
+    x_values, y_values = sample_plots(asts, x_min, x_max, y_min, y_max, backend, max_points, cache_key)
+    return rendering.plot_figure(x_values, y_values, x_min, x_max, y_min, y_max, labels)
+
+def plot_function(ast, x_min=-10, x_max=10, y_min=-8, y_max=8, backend=None, max_points=None, cache_key=None):
+    """Figure of ast over the window, as plot_functions() draws it"""
+    return plot_functions([ast], x_min, x_max, y_min, y_max, backend, max_points, cache_key)
+
+def flame_chart(profile):
+    """Icicle-style flame chart of a profiler.Profile: one row per AST depth,
+    each node as wide as its cumulative time, nested under its parent."""
+    bars = []
+    def layout(stats, start, width, depth):
+        bars.append((stats, start, width, depth))
+        total = sum(child.time for child in stats.children)
+        # Sampled times are estimates, so children may add up to a little more than their parent
+        scale = width / total if total > width and total > 0 else 1.0
+        offset = start
+        for child in stats.children:
+            child_width = child.time * scale
+            if child_width > 0:
+                layout(child, offset, child_width, depth + 1)
+            offset += child_width
+    root_time = profile.root.time
+    layout(profile.root, 0.0, root_time, 0)
+    max_depth = max(depth for _, _, _, depth in bars)
+
+    fig = Figure(figsize=(10, 1 + 0.4 * (max_depth + 1)))
+    ax = fig.subplots()
+    colors = matplotlib.colormaps['autumn']
+    for stats, start, width, depth in bars:
+        share = stats.self_time / root_time if root_time else 0.0
+        ax.barh(depth, width * 1000, left=start * 1000, height=0.9,
+                color=colors(1 - share), edgecolor='white', linewidth=0.5)
+        if root_time and width / root_time > 0.06:
+            ax.text((start + width / 2) * 1000, depth, f'{stats.label} ×{stats.calls}',
+                    ha='center', va='center', fontsize=8, clip_on=True)
+
+    ax.set_ylim(max_depth + 0.5, -0.5)
+    ax.set_xlim(0, max(root_time * 1000, 1e-6))
+    ax.set_yticks([])
+    ax.set_xlabel("cumulative time (ms)")
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+    ax.spines['left'].set_visible(False)
+
+    return fig
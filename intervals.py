@@ -0,0 +1,188 @@
+import math
+import numpy as np
+from functions import (
+    NumberNode, VariableNode, BinaryOpNode, NegateNode, FunctionCallNode, CONSTANTS
+)
+
+# Interval arithmetic over Parser ASTs.
+#
+# bound(node, lo, hi) returns arrays (y_lo, y_hi) such that, for every i,
+# node evaluated at any x in [lo[i], hi[i]] lies in [y_lo[i], y_hi[i]], or
+# is undefined there. Many intervals are bounded in one pass, like the
+# vectorized engine evaluates many points.
+#
+# Bounds are computed for the exact mathematical functions and widened by one
+# ulp after every operation. They do not hold for kernels less accurate than
+# that, such as the reference backend's series (its arcsin(1) is 1.339), so
+# plots only prune with backends marked exact (see kernels.py). Where no useful
+# bound is known -- sums, products, integrals, limits, factorial, poles inside
+# the interval, 0 * inf -- the result is (-inf, inf), so a bound is always
+# safe, only sometimes loose.
+
+_UNKNOWN = (-math.inf, math.inf)
+
+def bound(node, lo, hi, variables=None):
+    """Bounds of node for x in [lo, hi] (arrays or scalars), as (y_lo, y_hi) arrays.
+
+    variables maps other names to a value or a (lo, hi) pair; names that are
+    neither x, a variable nor a constant are unbounded.
+    """
+    lo = np.asarray(lo, dtype=float)
+    hi = np.asarray(hi, dtype=float)
+    scope = {'x': (lo, hi)}
+    for name, value in (variables or {}).items():
+        scope[name.lower()] = value if isinstance(value, tuple) else (value, value)
+    with np.errstate(all='ignore'):
+        y_lo, y_hi = _bound(node, scope)
+        shape = np.broadcast_shapes(lo.shape, hi.shape)
+        return np.broadcast_to(y_lo, shape).copy(), np.broadcast_to(y_hi, shape).copy()
+
+def _widen(lo, hi):
+    """Round outward by one ulp; NaN bounds become unbounded"""
+    lo = np.nextafter(lo, -np.inf)
+    hi = np.nextafter(hi, np.inf)
+    return np.where(np.isnan(lo), -np.inf, lo), np.where(np.isnan(hi), np.inf, hi)
+
+def _bound(node, scope):
+    if isinstance(node, NumberNode):
+        return node.value, node.value
+    elif isinstance(node, VariableNode):
+        lname = node.name.lower()
+        if lname in scope:
+            return scope[lname]
+        elif lname in CONSTANTS:
+            return CONSTANTS[lname], CONSTANTS[lname]
+        return _UNKNOWN
+    elif isinstance(node, BinaryOpNode):
+        left = _bound(node.left, scope)
+        right = _bound(node.right, scope)
+        if node.op == '+':
+            return _widen(left[0] + right[0], left[1] + right[1])
+        elif node.op == '-':
+            return _widen(left[0] - right[1], left[1] - right[0])
+        elif node.op == '*':
+            return _multiply(left, right)
+        elif node.op == '/':
+            return _divide(left, right)
+        elif node.op == '^':
+            return _power(left, right)
+        return _UNKNOWN
+    elif isinstance(node, NegateNode):
+        lo, hi = _bound(node.operand, scope)
+        return -np.asarray(hi), -np.asarray(lo)
+    elif isinstance(node, FunctionCallNode):
+        args = [_bound(arg, scope) for arg in node.args]
+        fname = node.func_name.lower()
+        if fname in _FUNCTIONS and len(args) == 1:
+            return _FUNCTIONS[fname](*args[0])
+        elif fname == 'logarithm' and len(args) == 1:
+            return _log(*args[0])
+        elif fname == 'logarithm' and len(args) == 2:
+            return _divide(_log(*args[1]), _log(*args[0]))
+        return _UNKNOWN
+    # Loops and limits
+    return _UNKNOWN
+
+def _multiply(a, b):
+    corners = [a[0] * b[0], a[0] * b[1], a[1] * b[0], a[1] * b[1]]
+    lo, hi = np.minimum.reduce(corners), np.maximum.reduce(corners)
+    # 0 * inf: no bound
+    unknown = np.isnan(lo) | np.isnan(hi)
+    return _widen(np.where(unknown, -np.inf, lo), np.where(unknown, np.inf, hi))
+
+def _divide(a, b):
+    b_lo, b_hi = np.asarray(b[0], dtype=float), np.asarray(b[1], dtype=float)
+    pole = (b_lo <= 0) & (b_hi >= 0)
+    lo, hi = _multiply(a, (1 / b_hi, 1 / b_lo))
+    return np.where(pole, -np.inf, lo), np.where(pole, np.inf, hi)
+
+def _integer_power(b, n):
+    lo, hi = np.asarray(b[0], dtype=float), np.asarray(b[1], dtype=float)
+    if n == 0:
+        return 1.0, 1.0
+    if n < 0:
+        return _divide((1.0, 1.0), _integer_power(b, -n))
+    lo_n, hi_n = lo ** n, hi ** n
+    if n % 2:
+        return _widen(lo_n, hi_n)
+    contains_zero = (lo <= 0) & (hi >= 0)
+    return _widen(np.where(contains_zero, 0.0, np.minimum(lo_n, hi_n)), np.maximum(lo_n, hi_n))
+
+def _power(b, p):
+    p_lo, p_hi = np.asarray(p[0], dtype=float), np.asarray(p[1], dtype=float)
+    if p_lo.size == 1 and p_hi.size == 1:
+        exponent = float(p_lo.flat[0])
+        if exponent == float(p_hi.flat[0]) and exponent.is_integer() and abs(exponent) <= 1024:
+            return _integer_power(b, int(exponent))
+    # b^p = exp(p * ln b) over the positive part of the base
+    b_lo, b_hi = np.asarray(b[0], dtype=float), np.asarray(b[1], dtype=float)
+    log_lo, log_hi = _log(b_lo, b_hi)
+    lo, hi = _multiply((p_lo, p_hi), (log_lo, log_hi))
+    lo, hi = _widen(np.exp(lo), np.exp(hi))
+    # Below 0 the base is only defined at integer exponents, which the bound ignores
+    unknown = (b_lo < 0) & (np.floor(p_hi) >= p_lo)
+    return np.where(unknown, -np.inf, lo), np.where(unknown, np.inf, hi)
+
+def _log(lo, hi):
+    lo, hi = np.asarray(lo, dtype=float), np.asarray(hi, dtype=float)
+    # Only the part of the interval above 0 is defined
+    y_lo, y_hi = _widen(np.log(np.maximum(lo, 0.0)), np.log(hi))
+    undefined = hi <= 0
+    return np.where(undefined, -np.inf, y_lo), np.where(undefined, np.inf, y_hi)
+
+def _sin(lo, hi):
+    lo, hi = np.asarray(lo, dtype=float), np.asarray(hi, dtype=float)
+    s_lo, s_hi = np.sin(lo), np.sin(hi)
+    y_lo, y_hi = np.minimum(s_lo, s_hi), np.maximum(s_lo, s_hi)
+    # First maximum (pi/2 + 2k pi) and minimum (-pi/2 + 2k pi) at or after lo
+    peak = math.pi / 2 + 2 * math.pi * np.ceil((lo - math.pi / 2) / (2 * math.pi))
+    trough = -math.pi / 2 + 2 * math.pi * np.ceil((lo + math.pi / 2) / (2 * math.pi))
+    y_hi = np.where(peak <= hi, 1.0, y_hi)
+    y_lo = np.where(trough <= hi, -1.0, y_lo)
+    wide = ~np.isfinite(lo) | ~np.isfinite(hi) | (hi - lo >= 2 * math.pi)
+    y_lo, y_hi = _widen(y_lo, y_hi)
+    return np.where(wide, -1.0, np.maximum(y_lo, -1.0)), np.where(wide, 1.0, np.minimum(y_hi, 1.0))
+
+def _cos(lo, hi):
+    return _sin(np.asarray(lo) + math.pi / 2, np.asarray(hi) + math.pi / 2)
+
+def _monotone_between_poles(f, lo, hi, first_pole, increasing):
+    """Bounds of f, monotone between poles at first_pole + k pi"""
+    lo, hi = np.asarray(lo, dtype=float), np.asarray(hi, dtype=float)
+    pole = first_pole + math.pi * np.ceil((lo - first_pole) / math.pi)
+    crosses = (pole <= hi) | ~np.isfinite(lo) | ~np.isfinite(hi)
+    y_lo, y_hi = (f(lo), f(hi)) if increasing else (f(hi), f(lo))
+    y_lo, y_hi = _widen(y_lo, y_hi)
+    return np.where(crosses, -np.inf, y_lo), np.where(crosses, np.inf, y_hi)
+
+def _tg(lo, hi):
+    return _monotone_between_poles(np.tan, lo, hi, math.pi / 2, True)
+
+def _ctg(lo, hi):
+    return _monotone_between_poles(lambda x: 1 / np.tan(x), lo, hi, 0.0, False)
+
+def _clipped_monotone(f, lo, hi, increasing):
+    """Bounds of f defined on [-1, 1], monotone there"""
+    lo, hi = np.clip(lo, -1.0, 1.0), np.clip(hi, -1.0, 1.0)
+    return _widen(f(lo), f(hi)) if increasing else _widen(f(hi), f(lo))
+
+def _absolute(lo, hi):
+    lo, hi = np.asarray(lo, dtype=float), np.asarray(hi, dtype=float)
+    contains_zero = (lo <= 0) & (hi >= 0)
+    a, b = np.abs(lo), np.abs(hi)
+    return np.where(contains_zero, 0.0, np.minimum(a, b)), np.maximum(a, b)
+
+_FUNCTIONS = {
+    'sin': _sin,
+    'cos': _cos,
+    'tg': _tg,
+    'ctg': _ctg,
+    'arcsin': lambda lo, hi: _clipped_monotone(np.arcsin, lo, hi, True),
+    'arccos': lambda lo, hi: _clipped_monotone(np.arccos, lo, hi, False),
+    'arctg': lambda lo, hi: _widen(np.arctan(lo), np.arctan(hi)),
+    'arcctg': lambda lo, hi: _widen(math.pi / 2 - np.arctan(hi), math.pi / 2 - np.arctan(lo)),
+    'absolute': _absolute,
+    # floor() rounds toward zero in both kernel backends; both are monotone
+    'floor': lambda lo, hi: (np.trunc(lo), np.trunc(hi)),
+    'ceiling': lambda lo, hi: (np.ceil(lo), np.ceil(hi)),
+}
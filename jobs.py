@@ -0,0 +1,116 @@
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import functions
+from budget import EvaluationBudget, EvaluationCancelled
+
+# Background evaluation jobs.
+#
+#     job = submit(evaluate, ast, timeout=30.0)
+#     job.progress()      {'sum(k)': 120000}
+#     job.cancel()
+#     job.result()        the value, or raises the error
+#
+# submit() runs a computation on a thread of a shared executor, under an
+# EvaluationBudget of its own, and returns a Job at once. The Job is the
+# handle the caller keeps, e.g. in Streamlit's session state across reruns.
+# progress() reads the steps the evaluation loops have ticked so far, by
+# construct: points a plot sampled, terms of sums and products, integrand
+# evaluations. cancel() makes the next tick raise EvaluationCancelled, so the
+# work really stops, including while waiting for chunks on the worker pool
+# (see parallel.py); a job still queued never starts.
+#
+# Jobs run Python code under the GIL, so a running job slows the thread
+# serving the UI down but does not block it.
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+_ids = itertools.count(1)
+
+class Job:
+    def __init__(self, fn, args, max_steps=None, timeout=None, description=''):
+        self.id = next(_ids)
+        self.description = description
+        self.budget = EvaluationBudget(max_steps, timeout)
+        self.started = None
+        self.finished = None
+        self._fn = fn
+        self._args = args
+        self._future = None
+
+    def _run(self):
+        self.started = time.perf_counter()
+        try:
+            with self.budget:
+                return self._fn(*self._args)
+        finally:
+            self.finished = time.perf_counter()
+
+    @property
+    def status(self) -> str:
+        if not self._future.done():
+            return QUEUED if self.started is None else RUNNING
+        if self._future.cancelled() or isinstance(self._future.exception(), EvaluationCancelled):
+            return CANCELLED
+        return FAILED if self._future.exception() is not None else DONE
+
+    def done(self) -> bool:
+        return self._future.done()
+
+    def cancel(self):
+        """Stop the job at its next budget tick, or before it starts; safe from any thread"""
+        self._future.cancel()
+        self.budget.cancel()
+
+    def progress(self) -> dict:
+        """Steps ticked so far by construct label"""
+        # Copying a Counter is a single step under the GIL, safe while the job ticks
+        return dict(self.budget.where)
+
+    def elapsed(self) -> float:
+        """Seconds the job has been running, or ran"""
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.perf_counter()) - self.started
+
+    def result(self, timeout=None):
+        """The value the job computed, waiting up to timeout seconds; raises its error"""
+        if self._future.cancelled():
+            raise EvaluationCancelled('Evaluation cancelled', self.budget)
+        return self._future.result(timeout)
+
+    def error(self):
+        """The exception the finished job raised, or None"""
+        if self._future.cancelled():
+            return EvaluationCancelled('Evaluation cancelled', self.budget)
+        return self._future.exception()
+
+    def __repr__(self):
+        return f'Job(id={self.id}, description={self.description!r}, status={self.status})'
+
+_executor = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+def get_executor() -> ThreadPoolExecutor:
+    """The shared job executor, created on first use"""
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != functions.JobWorkers:
+            if _executor is not None:
+                # Jobs already submitted still finish on the old executor
+                _executor.shutdown(wait=False)
+            _executor_workers = functions.JobWorkers
+            _executor = ThreadPoolExecutor(_executor_workers, thread_name_prefix='funcg-job')
+        return _executor
+
+def submit(fn, *args, max_steps=None, timeout=None, description='') -> Job:
+    """Start fn(*args) in the background under a budget of max_steps and timeout"""
+    job = Job(fn, args, max_steps, timeout, description)
+    job._future = get_executor().submit(job._run)
+    return job
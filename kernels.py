@@ -0,0 +1,238 @@
+import math
+import random
+import time
+import functions
+import factorials
+
+# Pluggable scalar kernel backends for evaluate() and compile().
+#
+# A backend provides power, logarithm, factorial, absolute, floor, ceiling and
+# the trigonometric functions in trig_funcs. Two are built in:
+#
+# - 'reference': the hand-written series and loops in functions.py
+# - 'fast': exponentiation by squaring for integer powers and the C math
+#   library (range-reduced exp, log and trigonometry) for everything else
+#
+# Both raise the same errors for the same domain violations, and floor()
+# rounds toward zero in both, as the reference always has. Select a backend
+# per call with evaluate(..., backend='reference') or compile(node, backend=...);
+# functions.DefaultKernelBackend is used otherwise.
+
+class KernelBackend:
+    """Interface of a kernel backend; subclasses implement the static methods"""
+    name = None
+    trig_funcs = {}
+    # Whether the kernels are as accurate as the exact functions intervals.py
+    # bounds, so plots may skip what those bounds prove to be off-screen
+    exact = False
+
+    @staticmethod
+    def power(b, p):
+        raise NotImplementedError
+
+    @staticmethod
+    def logarithm(b, x):
+        raise NotImplementedError
+
+    @staticmethod
+    def factorial(x):
+        raise NotImplementedError
+
+    @staticmethod
+    def absolute(x):
+        raise NotImplementedError
+
+    @staticmethod
+    def floor(x):
+        raise NotImplementedError
+
+    @staticmethod
+    def ceiling(x):
+        raise NotImplementedError
+
+    def __repr__(self):
+        return f'<{type(self).__name__} {self.name!r}>'
+
+class ReferenceBackend(KernelBackend):
+    name = 'reference'
+    trig_funcs = functions.TRIG_FUNCS
+    power = staticmethod(functions.power)
+    logarithm = staticmethod(functions.logarithm)
+    factorial = staticmethod(functions.factorial)
+    absolute = staticmethod(functions.absolute)
+    floor = staticmethod(functions.floor)
+    ceiling = staticmethod(functions.ceiling)
+
+def _power_by_squaring(base : float, exp : int) -> float:
+    result = 1.0
+    while exp:
+        if exp & 1:
+            result *= base
+        exp >>= 1
+        if exp:
+            base *= base
+    return result
+
+def fast_power(b, p):
+    if b == 1 or p == 0:
+        return 1.0
+    elif b == 0:
+        if p > 0:
+            return 0.0
+        raise ValueError("0^(negative power) is undefined")
+    if float(p).is_integer():
+        return _power_by_squaring(float(b) if p > 0 else 1 / b, int(abs(p)))
+    if b < 0:
+        raise ValueError("Negative base with non-integer exponent")
+    try:
+        if b == math.e:
+            return math.exp(p)
+        return math.pow(b, p)
+    except OverflowError:
+        # The reference kernels overflow to inf rather than raising
+        return math.inf
+
+def fast_logarithm(b, x):
+    if x <= 0 or b <= 0:
+        raise ValueError("logarithm undefined for x <= 0")
+    if b == math.e:
+        return math.log(x)
+    return math.log(x) / math.log(b)
+
+def fast_tg(x):
+    c = math.cos(x)
+    if abs(c) < 1e-10:
+        raise ValueError("tangent undefined (cos(x) ≈ 0)")
+    return math.sin(x) / c
+
+def fast_ctg(x):
+    s = math.sin(x)
+    if abs(s) < 1e-10:
+        raise ValueError("cotangent undefined (sin(x) ≈ 0)")
+    return math.cos(x) / s
+
+def fast_arcsin(x):
+    if abs(x) > 1:
+        raise ValueError("arcsin undefined for abs(x) > 1")
+    return math.asin(x)
+
+def fast_arccos(x):
+    if abs(x) > 1:
+        raise ValueError("arcsin undefined for abs(x) > 1")
+    return math.acos(x)
+
+def fast_arcctg(x):
+    return math.pi / 2 - math.atan(x)
+
+class FastBackend(KernelBackend):
+    name = 'fast'
+    exact = True
+    trig_funcs = {
+        'sin': math.sin, 'cos': math.cos, 'tg': fast_tg, 'ctg': fast_ctg,
+        'arcsin': fast_arcsin, 'arccos': fast_arccos, 'arctg': math.atan, 'arcctg': fast_arcctg
+    }
+    power = staticmethod(fast_power)
+    logarithm = staticmethod(fast_logarithm)
+    factorial = staticmethod(factorials.factorial)
+    absolute = staticmethod(functions.absolute)
+    # Round toward zero, like the reference floor()
+    floor = staticmethod(math.trunc)
+    ceiling = staticmethod(math.ceil)
+
+BACKENDS = {
+    'reference': ReferenceBackend(),
+    'fast': FastBackend(),
+}
+
+def get_backend(backend=None) -> KernelBackend:
+    """Resolve a backend name or instance; None means functions.DefaultKernelBackend"""
+    if isinstance(backend, KernelBackend):
+        return backend
+    if backend is None:
+        backend = functions.DefaultKernelBackend
+    try:
+        return BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown kernel backend: {backend}") from None
+
+# Cross-checking the backends
+
+class KernelComparison:
+    def __init__(self, kernel, samples, max_abs_error, max_rel_error, mismatched_errors, reference_time, fast_time):
+        self.kernel = kernel
+        self.samples = samples
+        self.max_abs_error = max_abs_error
+        self.max_rel_error = max_rel_error
+        # Inputs where exactly one backend raised
+        self.mismatched_errors = mismatched_errors
+        self.reference_time = reference_time
+        self.fast_time = fast_time
+
+    def __repr__(self):
+        return (f'KernelComparison({self.kernel!r}, samples={self.samples}, '
+                f'max_abs_error={self.max_abs_error:.3g}, max_rel_error={self.max_rel_error:.3g}, '
+                f'mismatched_errors={self.mismatched_errors})')
+
+def _uniform(rng, lo, hi, n):
+    return [(rng.uniform(lo, hi),) for _ in range(n)]
+
+def cross_check_inputs(samples=2000, seed=0) -> dict:
+    """Argument tuples per kernel, spread over a wide range of inputs"""
+    rng = random.Random(seed)
+    return {
+        'power': [(rng.uniform(0.01, 20), rng.uniform(-30, 30)) for _ in range(samples)]
+                 + [(rng.uniform(-10, 10), float(rng.randint(-60, 60))) for _ in range(samples)]
+                 + [(math.e, rng.uniform(-50, 50)) for _ in range(samples)],
+        'logarithm': [(math.e, 10 ** rng.uniform(-12, 12)) for _ in range(samples)]
+                     + [(rng.uniform(1.1, 16), 10 ** rng.uniform(-6, 6)) for _ in range(samples)],
+        'factorial': [(n,) for n in range(0, 171)],
+        'floor': _uniform(rng, -1e4, 1e4, samples),
+        'ceiling': _uniform(rng, -1e4, 1e4, samples),
+        'sin': _uniform(rng, -100, 100, samples),
+        'cos': _uniform(rng, -100, 100, samples),
+        'tg': _uniform(rng, -1.5, 1.5, samples),
+        'ctg': _uniform(rng, 0.05, 3.1, samples),
+        'arcsin': _uniform(rng, -1, 1, samples),
+        'arccos': _uniform(rng, -1, 1, samples),
+        'arctg': _uniform(rng, -1e3, 1e3, samples),
+        'arcctg': _uniform(rng, -1e3, 1e3, samples),
+    }
+
+def _kernel(backend, name):
+    if name in backend.trig_funcs:
+        return backend.trig_funcs[name]
+    return getattr(backend, name)
+
+def _run(kernel, inputs):
+    results = []
+    start = time.perf_counter()
+    for args in inputs:
+        try:
+            results.append(kernel(*args))
+        except (ValueError, ZeroDivisionError, OverflowError) as e:
+            results.append(e)
+    return results, time.perf_counter() - start
+
+def cross_check(reference='reference', candidate='fast', samples=2000, seed=0) -> list:
+    """Compare two backends kernel by kernel, returning a KernelComparison per kernel"""
+    reference = get_backend(reference)
+    candidate = get_backend(candidate)
+    comparisons = []
+    for name, inputs in cross_check_inputs(samples, seed).items():
+        expected, reference_time = _run(_kernel(reference, name), inputs)
+        actual, fast_time = _run(_kernel(candidate, name), inputs)
+        max_abs = max_rel = 0.0
+        mismatched = 0
+        for e, a in zip(expected, actual):
+            if isinstance(e, Exception) or isinstance(a, Exception):
+                mismatched += isinstance(e, Exception) != isinstance(a, Exception)
+                continue
+            e, a = float(e), float(a)
+            if math.isinf(e) or math.isinf(a):
+                mismatched += e != a
+                continue
+            diff = abs(e - a)
+            max_abs = max(max_abs, diff)
+            max_rel = max(max_rel, diff / max(abs(e), 1e-300))
+        comparisons.append(KernelComparison(name, len(inputs), max_abs, max_rel, mismatched, reference_time, fast_time))
+    return comparisons
@@ -0,0 +1,121 @@
+from functions import (
+    NumberNode, VariableNode, BinaryOpNode, NegateNode, FunctionCallNode,
+    SigmaSumNode, ProductNode, IntegralNode, LimitNode, CONSTANTS, evaluate
+)
+from ast_tools import count_nodes, may_be_int
+import kernels
+
+# AST optimizer, run between Parser.parse() and evaluation.
+#
+# - folds constant subtrees, including pi, e, inf and calls such as sin(pi/4)
+# - rewrites the parser's unary minus, 0 - x, into a NegateNode
+# - drops x*1, 1*x, x/1, x+0, 0+x and x-0
+#
+# The last two are skipped where x may be a Python int (sum and product
+# indices, floor(), ...), so that an int loop variable never turns a float
+# product into an exact big integer. Other variables are taken to be floats.
+#
+# Folding evaluates with the kernels of the backend the tree will run on, so
+# the optimized tree gives the same results. Subtrees that raise while folding are left alone so
+# the error still surfaces at evaluation time. Sums, products, integrals and
+# limits are never evaluated here, only their arguments are optimized.
+# Constants are assumed not to be overridden by the caller's variables.
+
+class OptimizationStats:
+    def __init__(self, nodes_before, nodes_after):
+        self.nodes_before = nodes_before
+        self.nodes_after = nodes_after
+
+    @property
+    def nodes_removed(self) -> int:
+        return self.nodes_before - self.nodes_after
+
+    def __repr__(self):
+        return f'OptimizationStats(nodes_before={self.nodes_before}, nodes_after={self.nodes_after})'
+
+def optimize(node, backend=None):
+    """Return an optimized copy of node; the input tree is not modified.
+
+    Constants are folded with the given kernel backend, see kernels.py.
+    """
+    return _optimize(node, frozenset(), frozenset(), kernels.get_backend(backend))
+
+def optimize_with_stats(node, backend=None):
+    """Like optimize(), also returning node counts before and after"""
+    optimized = optimize(node, backend)
+    return optimized, OptimizationStats(count_nodes(node), count_nodes(optimized))
+
+def _fold(node, backend):
+    try:
+        return NumberNode(evaluate(node, backend=backend))
+    except Exception:
+        return node
+
+def _is_number(node, value=None) -> bool:
+    return isinstance(node, NumberNode) and (value is None or node.value == value)
+
+def _optimize(node, bound, int_vars, backend):
+    if isinstance(node, VariableNode):
+        lname = node.name.lower()
+        if lname in CONSTANTS and lname not in bound:
+            return NumberNode(CONSTANTS[lname])
+        return node
+    elif isinstance(node, BinaryOpNode):
+        return _optimize_binary(node, bound, int_vars, backend)
+    elif isinstance(node, NegateNode):
+        return _negate(_optimize(node.operand, bound, int_vars, backend), backend)
+    elif isinstance(node, FunctionCallNode):
+        args = [_optimize(arg, bound, int_vars, backend) for arg in node.args]
+        call = FunctionCallNode(node.func_name, args)
+        if all(isinstance(arg, NumberNode) for arg in args):
+            return _fold(call, backend)
+        return call
+    elif isinstance(node, (SigmaSumNode, ProductNode, IntegralNode, LimitNode)):
+        inner_bound, inner_ints = bound, int_vars
+        if isinstance(node.var, str):
+            inner_bound = bound | {node.var}
+            # Sum and product indices are Python ints
+            if isinstance(node, (SigmaSumNode, ProductNode)):
+                inner_ints = int_vars | {node.var.lower()}
+        expr = _optimize(node.expr, inner_bound, inner_ints, backend)
+        if isinstance(node, LimitNode):
+            return LimitNode(node.var, _optimize(node.to, bound, int_vars, backend), expr)
+        return type(node)(node.var, _optimize(node.lower, bound, int_vars, backend),
+                          _optimize(node.upper, bound, int_vars, backend), expr)
+    return node
+
+def _negate(operand, backend):
+    if isinstance(operand, NumberNode):
+        return _fold(NegateNode(operand), backend)
+    if isinstance(operand, NegateNode):
+        return operand.operand
+    return NegateNode(operand)
+
+def _optimize_binary(node, bound, int_vars, backend):
+    left = _optimize(node.left, bound, int_vars, backend)
+    right = _optimize(node.right, bound, int_vars, backend)
+    op = node.op
+    if isinstance(left, NumberNode) and isinstance(right, NumberNode):
+        return _fold(BinaryOpNode(left, op, right), backend)
+
+    left_float = not may_be_int(left, int_vars)
+    right_float = not may_be_int(right, int_vars)
+    if op == '-' and _is_number(left, 0) and right_float:
+        return _negate(right, backend)
+    if op == '+':
+        if _is_number(right, 0) and left_float:
+            return left
+        if _is_number(left, 0) and right_float:
+            return right
+    elif op == '-':
+        if _is_number(right, 0) and left_float:
+            return left
+    elif op == '*':
+        if _is_number(right, 1) and left_float:
+            return left
+        if _is_number(left, 1) and right_float:
+            return right
+    elif op == '/':
+        if _is_number(right, 1) and left_float:
+            return left
+    return BinaryOpNode(left, op, right)
@@ -0,0 +1,138 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import functions
+from budget import EvaluationBudget, current_budget, remaining
+
+# Multi-core evaluation on a shared process pool.
+#
+# Evaluation is pure Python under the GIL, so heavy work is split into chunks
+# and run in worker processes: the x values of a plot batch, the index
+# chunks of large vectorized sums and products, and the integrand points of
+# an adaptive integral's batches. Each chunk computes exactly what the serial
+# code computes for it and the results are combined in the same order, so
+# parallel results are identical to serial ones. ASTs are plain objects and
+# travel to the workers by pickling.
+#
+# worthwhile(cost) decides per piece of work, from its estimated number of
+# node evaluations (see cost.py), following functions.ParallelMode. The pool
+# is created on first use and reused by every later request. Workers never
+# start parallel work of their own.
+#
+# Workers start with the settings of functions.py as they were when the pool
+# was created, such as the result cache path.
+#
+# A worker runs under an EvaluationBudget with the steps and time left to the
+# caller's, whose ticks are added back to the caller's budget. While waiting,
+# the caller keeps checking its budget, so timeouts and cancel() still stop
+# the evaluation, although chunks already running finish in the background.
+
+# Chunks smaller than this are not worth sending to a worker
+MIN_CHUNK = 64
+# Seconds between budget checks while waiting for workers
+POLL_INTERVAL = 0.05
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+_in_worker = False
+
+def workers() -> int:
+    """Number of worker processes a pool gets"""
+    return functions.ParallelWorkers or os.cpu_count() or 1
+
+def worthwhile(cost) -> bool:
+    """Whether work of the given estimated cost should run on the pool"""
+    if _in_worker or functions.ParallelMode == 'serial':
+        return False
+    if functions.ParallelMode == 'parallel':
+        return True
+    return workers() > 1 and cost >= functions.ParallelMinCost
+
+def get_pool() -> ProcessPoolExecutor:
+    """The shared worker pool, created on first use"""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers():
+            if _pool is not None:
+                _pool.shutdown(wait=False, cancel_futures=True)
+            # Forking a threaded server process is unsafe; start workers from a clean process
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _pool_workers = workers()
+            _pool = ProcessPoolExecutor(_pool_workers, multiprocessing.get_context(method),
+                                        initializer=_init_worker, initargs=(_settings(),))
+        return _pool
+
+def shutdown():
+    """Stop the worker pool; the next parallel call starts a new one"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+def split(values, min_chunk=MIN_CHUNK) -> list:
+    """values cut into contiguous chunks, one per worker and none below min_chunk"""
+    count = max(1, min(workers(), len(values) // min_chunk))
+    if isinstance(values, np.ndarray):
+        return np.array_split(values, count)
+    size = -(-len(values) // count)
+    return [values[i:i + size] for i in range(0, len(values), size)]
+
+def run(fn, arg_lists) -> list:
+    """[fn(*args) for args in arg_lists], computed on the pool, in order.
+
+    fn must be a module-level function and the arguments picklable. The
+    first exception, in order, is raised as the serial loop would raise it.
+    """
+    budget = current_budget()
+    limits = (None, None) if budget is None else remaining(budget)
+    try:
+        futures = [get_pool().submit(_call, fn, args, *limits) for args in arg_lists]
+    except BrokenProcessPool:
+        shutdown()
+        futures = [get_pool().submit(_call, fn, args, *limits) for args in arg_lists]
+    try:
+        pending = set(futures)
+        while pending:
+            _, pending = wait(pending, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            if budget is not None:
+                budget.check()
+        results = []
+        for future in futures:
+            result, steps = future.result()
+            if budget is not None:
+                for where, count in steps.items():
+                    budget.tick(where, count)
+            results.append(result)
+        return results
+    except BrokenProcessPool:
+        shutdown()
+        raise
+    finally:
+        for future in futures:
+            future.cancel()
+
+def _settings() -> dict:
+    """The settings of functions.py, its capitalized names holding plain values"""
+    return {name: value for name, value in vars(functions).items()
+            if name[:1].isupper() and isinstance(value, (bool, int, float, str, type(None)))}
+
+def _init_worker(settings):
+    global _in_worker
+    _in_worker = True
+    for name, value in settings.items():
+        setattr(functions, name, value)
+
+def _call(fn, args, max_steps, timeout):
+    """Run fn(*args) in a worker, returning its result and the steps it took by construct"""
+    with EvaluationBudget(max_steps, timeout) as budget:
+        result = fn(*args)
+    return result, dict(budget.where)
+
+def scalar_variables(variables) -> dict:
+    """The user-visible entries of a variables dict, without private memo keys"""
+    return {name: value for name, value in variables.items() if isinstance(name, str)}
@@ -0,0 +1,130 @@
+import operator
+import kernels
+import compiler
+from functions import (
+    NumberNode, VariableNode, BinaryOpNode, NegateNode, FunctionCallNode,
+    SigmaSumNode, ProductNode, IntegralNode, LimitNode, CONSTANTS
+)
+from ast_tools import children
+
+# Flat postfix form of an AST and the stack machine that runs it.
+#
+# flatten() lays a tree out in post-order as one list of (opcode, operand)
+# instructions, with names, operators and kernels resolved ahead of time as
+# compiler.compile() resolves them. run() executes the list in a single loop
+# over a value stack, without recursion or attribute lookups per node, so it
+# evaluates trees of any depth, such as power towers thousands of levels deep
+# that the recursive evaluators cannot reach the bottom of. Results and
+# errors are those of compile().
+#
+# Sums, products, integrals and limits are single LOOP instructions running
+# the compiled loop (see compiler.py); only their bodies are compiled as
+# closures.
+
+CONST, LOAD, LOAD_CONSTANT, BINARY, NEGATE, CALL1, CALL, LOOP = range(8)
+OPCODE_NAMES = ('CONST', 'LOAD', 'LOAD_CONSTANT', 'BINARY', 'NEGATE', 'CALL1', 'CALL', 'LOOP')
+
+LOOP_NODES = (SigmaSumNode, ProductNode, IntegralNode, LimitNode)
+
+class Program:
+    __slots__ = ('code', 'max_stack')
+
+    def __init__(self, code, max_stack):
+        # (opcode, operand) instructions in execution order
+        self.code = code
+        # Largest number of values on the stack while running
+        self.max_stack = max_stack
+
+    def __len__(self):
+        return len(self.code)
+
+    def listing(self) -> list:
+        """The instructions as text, one line each"""
+        return [f'{OPCODE_NAMES[opcode]} {operand!r}' for opcode, operand in self.code]
+
+    def __repr__(self):
+        return f'Program(instructions={len(self.code)}, max_stack={self.max_stack})'
+
+def _unknown_operator(op):
+    def unknown(left, right):
+        raise ValueError(f"Unknown operator: {op}")
+    return unknown
+
+def flatten(node, backend=None) -> Program:
+    """The postfix program evaluating node"""
+    backend = kernels.get_backend(backend)
+    binary = {'+': operator.add, '-': operator.sub, '*': operator.mul,
+              '/': operator.truediv, '^': backend.power}
+    code = []
+    size = max_stack = 0
+    # (node, whether its children have been emitted)
+    pending = [(node, False)]
+    while pending:
+        current, ready = pending.pop()
+        if not ready and not isinstance(current, LOOP_NODES) and children(current):
+            pending.append((current, True))
+            pending.extend((child, False) for child in reversed(children(current)))
+            continue
+        if isinstance(current, NumberNode):
+            code.append((CONST, current.value))
+            size += 1
+        elif isinstance(current, VariableNode):
+            lname = current.name.lower()
+            if lname in CONSTANTS:
+                code.append((LOAD_CONSTANT, (lname, CONSTANTS[lname])))
+            else:
+                code.append((LOAD, (lname, f"Variable '{current.name}' not defined")))
+            size += 1
+        elif isinstance(current, BinaryOpNode):
+            code.append((BINARY, binary.get(current.op) or _unknown_operator(current.op)))
+            size -= 1
+        elif isinstance(current, NegateNode):
+            code.append((NEGATE, None))
+        elif isinstance(current, FunctionCallNode):
+            count = len(current.args)
+            kernel = compiler.resolve_kernel(current.func_name.lower(), count, backend)
+            code.append((CALL1, kernel) if count == 1 else (CALL, (kernel, count)))
+            size += 1 - count
+        elif isinstance(current, LOOP_NODES):
+            code.append((LOOP, compiler.compile_cached(current, backend)))
+            size += 1
+        else:
+            raise ValueError(f"Unknown AST node: {type(current)}")
+        max_stack = max(max_stack, size)
+    return Program(code, max_stack)
+
+def run(program, variables=None):
+    """Evaluate a flattened program, as evaluate() evaluates its tree"""
+    if variables is None:
+        variables = {}
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    # Opcodes as locals, saving a global lookup per comparison
+    binary, load, const, call1, load_constant, negate, call = BINARY, LOAD, CONST, CALL1, LOAD_CONSTANT, NEGATE, CALL
+    for opcode, operand in program.code:
+        if opcode == binary:
+            right = pop()
+            stack[-1] = operand(stack[-1], right)
+        elif opcode == load:
+            try:
+                push(variables[operand[0]])
+            except KeyError:
+                raise ValueError(operand[1]) from None
+        elif opcode == const:
+            push(operand)
+        elif opcode == call1:
+            stack[-1] = operand(stack[-1])
+        elif opcode == load_constant:
+            push(variables.get(*operand))
+        elif opcode == negate:
+            stack[-1] = -stack[-1]
+        elif opcode == call:
+            kernel, count = operand
+            start = len(stack) - count
+            values = stack[start:]
+            del stack[start:]
+            push(kernel(*values))
+        else:
+            push(operand(variables))
+    return stack[0]
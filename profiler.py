@@ -0,0 +1,172 @@
+import time
+import compiler
+from budget import BudgetExceeded
+from ast_tools import children, node_label
+
+# Per-node profiling of compiled evaluation.
+#
+# A Profiler hooks into compiler.compile() and wraps the callable of every AST
+# node, counting its calls and the exceptions raised out of it and timing it.
+# Times are cumulative: a node's time includes its children's. Reading the
+# clock dominates the overhead, so with sample_every=N only every Nth call of
+# a node is timed and its total time is extrapolated from those; call and
+# exception counts are always exact.
+#
+# The results form a Profile tree shaped like the AST, for the flame chart in
+# the UI (graphing_utilities.flame_chart) or for offline analysis through
+# Profile.rows() and Profile.to_dict(). Profilers are not thread-safe.
+
+DEFAULT_SAMPLE_EVERY = 1
+
+class NodeStats:
+    def __init__(self, node):
+        self.node = node
+        self.label = node_label(node)
+        self.calls = 0
+        self.exceptions = 0
+        # Calls actually timed, and their total time
+        self.sampled = 0
+        self.sampled_time = 0.0
+        self.children = []
+
+    @property
+    def time(self) -> float:
+        """Estimated cumulative seconds over all calls"""
+        if not self.sampled:
+            return 0.0
+        return self.sampled_time * self.calls / self.sampled
+
+    @property
+    def self_time(self) -> float:
+        """Estimated seconds spent in this node itself, excluding its children"""
+        return max(0.0, self.time - sum(child.time for child in self.children))
+
+    def __repr__(self):
+        return (f'NodeStats({self.label!r}, calls={self.calls}, time={self.time:.3g}, '
+                f'exceptions={self.exceptions})')
+
+class Profile:
+    def __init__(self, root, evaluations, errors, wall_time, sample_every):
+        self.root = root
+        self.evaluations = evaluations
+        # Evaluations that raised
+        self.errors = errors
+        self.wall_time = wall_time
+        self.sample_every = sample_every
+
+    def nodes(self):
+        """Yield (depth, NodeStats) for every node, parents before children"""
+        stack = [(0, self.root)]
+        while stack:
+            depth, stats = stack.pop()
+            yield depth, stats
+            stack.extend((depth + 1, child) for child in reversed(stats.children))
+
+    def rows(self) -> list:
+        """One dict per node, parents before children, e.g. for a table"""
+        return [{
+            'node': '  ' * depth + stats.label,
+            'depth': depth,
+            'calls': stats.calls,
+            'time': stats.time,
+            'self_time': stats.self_time,
+            'exceptions': stats.exceptions,
+        } for depth, stats in self.nodes()]
+
+    def hottest(self, n=5) -> list:
+        """The n nodes with the largest self time"""
+        return sorted((stats for _, stats in self.nodes()), key=lambda s: s.self_time, reverse=True)[:n]
+
+    def to_dict(self) -> dict:
+        """The profile as nested JSON-ready dicts"""
+        def node(stats):
+            return {
+                'node': stats.label,
+                'calls': stats.calls,
+                'time': stats.time,
+                'self_time': stats.self_time,
+                'exceptions': stats.exceptions,
+                'children': [node(child) for child in stats.children],
+            }
+        return {
+            'evaluations': self.evaluations,
+            'errors': self.errors,
+            'wall_time': self.wall_time,
+            'sample_every': self.sample_every,
+            'root': node(self.root),
+        }
+
+    def __repr__(self):
+        return f'Profile({self.root.label!r}, evaluations={self.evaluations}, wall_time={self.wall_time:.3g})'
+
+class Profiler:
+    def __init__(self, sample_every=DEFAULT_SAMPLE_EVERY):
+        if sample_every < 1:
+            raise ValueError("sample_every must be at least 1")
+        self.sample_every = int(sample_every)
+        self._stats = {}
+
+    def stats(self, node) -> NodeStats:
+        """The NodeStats of node, created on first use"""
+        stats = self._stats.get(id(node))
+        if stats is None:
+            stats = self._stats[id(node)] = NodeStats(node)
+        return stats
+
+    def instrument(self, node, fn):
+        """The compiler.compile() hook: fn wrapped to record into the stats of node"""
+        stats = self.stats(node)
+        every = self.sample_every
+        clock = time.perf_counter
+        def profiled(variables):
+            stats.calls += 1
+            # Time the first call and every Nth after it
+            if (stats.calls - 1) % every:
+                try:
+                    return fn(variables)
+                except Exception:
+                    stats.exceptions += 1
+                    raise
+            start = clock()
+            try:
+                return fn(variables)
+            except Exception:
+                stats.exceptions += 1
+                raise
+            finally:
+                stats.sampled += 1
+                stats.sampled_time += clock() - start
+        return profiled
+
+    def compile(self, node, backend=None):
+        """compiler.compile() with every node instrumented"""
+        return compiler.compile(node, backend, self.instrument)
+
+    def tree(self, node) -> NodeStats:
+        """The stats of node with its children linked in, following the AST"""
+        stats = self.stats(node)
+        stats.children = [self.tree(child) for child in children(node)]
+        return stats
+
+def profile_expression(node, scopes=None, backend=None, sample_every=DEFAULT_SAMPLE_EVERY) -> Profile:
+    """Evaluate node once per variables dict in scopes and profile it.
+
+    scopes defaults to a single evaluation without variables. Evaluations
+    that raise are counted in Profile.errors rather than propagated.
+    """
+    if scopes is None:
+        scopes = [{}]
+    profiler = Profiler(sample_every)
+    f = profiler.compile(node, backend)
+    evaluations = errors = 0
+    start = time.perf_counter()
+    for variables in scopes:
+        evaluations += 1
+        try:
+            f(dict(variables))
+        except BudgetExceeded:
+            raise
+        except Exception:
+            errors += 1
+    wall_time = time.perf_counter() - start
+    return Profile(profiler.tree(node), evaluations, errors, wall_time, profiler.sample_every)
@@ -0,0 +1,170 @@
+import math
+from functions import CONSTANTS
+from budget import current_budget
+
+# Adaptive Gauss-Kronrod quadrature for integral().
+#
+# Each panel is integrated with the 15-point Kronrod rule; the difference from
+# the embedded 7-point Gauss rule is its error estimate. Panels whose error is
+# above their share of the tolerance are bisected, one round at a time, until
+# the total error estimate meets the tolerance or the evaluation budget runs
+# out. Infinite bounds (inf, i.e. anything at or beyond 1e8) are mapped onto a
+# finite interval by a change of variable instead of being cut off.
+
+# Kronrod abscissae on [0, 1] (mirrored for the negative half) and weights
+_XGK = [
+    0.991455371120812639206854697526329, 0.949107912342758524526189684047851,
+    0.864864423359769072789712788640926, 0.741531185599394439863864773280788,
+    0.586087235467691130294144845693013, 0.405845151377397166906606412076961,
+    0.207784955007898467600689403773245, 0.000000000000000000000000000000000,
+]
+_WGK = [
+    0.022935322010529224963732008058970, 0.063092092629978553290700663189204,
+    0.104790010322250183839876322541518, 0.140653259715525918745189590510238,
+    0.169004726639267902826583426598550, 0.190350578064785409913256402421014,
+    0.204432940075298892414161999234649, 0.209482141084727828012999174891714,
+]
+# Gauss weights for _XGK[1], _XGK[3], _XGK[5] and _XGK[7]
+_WG = [
+    0.129484966168869693270611432679082, 0.279705391489276667901467771423780,
+    0.381830050505118944950369775488975, 0.417959183673469387755102040816327,
+]
+
+NODES = [-x for x in _XGK[:-1]] + _XGK[::-1]
+KRONROD_WEIGHTS = _WGK[:-1] + _WGK[::-1]
+GAUSS_WEIGHTS = [_WG[i // 2] if i % 2 else 0.0 for i in range(7)]
+GAUSS_WEIGHTS = GAUSS_WEIGHTS + [_WG[3]] + GAUSS_WEIGHTS[::-1]
+POINTS_PER_PANEL = len(NODES)
+
+INFINITE_BOUND = CONSTANTS['inf']
+
+def is_infinite(bound) -> bool:
+    return abs(bound) >= INFINITE_BOUND
+
+class QuadratureResult:
+    def __init__(self, value, error, evaluations, converged):
+        self.value = value
+        self.error = error
+        self.evaluations = evaluations
+        self.converged = converged
+
+    def __repr__(self):
+        return (f'QuadratureResult(value={self.value!r}, error={self.error!r}, '
+                f'evaluations={self.evaluations}, converged={self.converged})')
+
+class IntegralWarning(RuntimeWarning):
+    def __init__(self, result):
+        # The same text for every result, so the warning is shown once per place
+        super().__init__('Integral did not converge to the tolerance; the value is an estimate')
+        self.result = result
+
+class Mapping:
+    """Change of variable x = to_x(t) taking (t_lo, t_hi) onto (a, b)"""
+    def __init__(self, a, b):
+        self.a = a
+        self.b = b
+        if is_infinite(a) and is_infinite(b):
+            # x = t / (1 - t^2) over (-1, 1)
+            self.kind = 'both'
+            self.t_lo, self.t_hi = -1.0, 1.0
+        elif is_infinite(b):
+            # x = a + t / (1 - t) over (0, 1)
+            self.kind = 'upper'
+            self.t_lo, self.t_hi = 0.0, 1.0
+        elif is_infinite(a):
+            # x = b - t / (1 - t) over (0, 1)
+            self.kind = 'lower'
+            self.t_lo, self.t_hi = 0.0, 1.0
+        else:
+            self.kind = 'finite'
+            self.t_lo, self.t_hi = a, b
+
+    def to_x(self, t):
+        if self.kind == 'finite':
+            return t
+        elif self.kind == 'upper':
+            return self.a + t / (1 - t)
+        elif self.kind == 'lower':
+            return self.b - t / (1 - t)
+        return t / (1 - t * t)
+
+    def jacobian(self, t):
+        if self.kind == 'finite':
+            return 1.0
+        elif self.kind in ('upper', 'lower'):
+            return 1 / ((1 - t) * (1 - t))
+        return (1 + t * t) / ((1 - t * t) * (1 - t * t))
+
+def panel_points(lo, hi) -> list:
+    center = (lo + hi) / 2
+    half = (hi - lo) / 2
+    return [center + half * node for node in NODES]
+
+def panel_estimate(values, lo, hi):
+    """Kronrod estimate and error of one panel from its POINTS_PER_PANEL values"""
+    half = (hi - lo) / 2
+    kronrod = half * math.fsum(w * v for w, v in zip(KRONROD_WEIGHTS, values))
+    gauss = half * math.fsum(w * v for w, v in zip(GAUSS_WEIGHTS, values))
+    return kronrod, abs(kronrod - gauss)
+
+def integrate(f, a, b, tol=1e-10, rel_tol=1e-10, max_evals=5000, evaluate_points=None) -> QuadratureResult:
+    """Integrate f over [a, b] to within max(tol, rel_tol * |result|).
+
+    evaluate_points, if given, maps a list of x values to the list of f(x)
+    values and is used instead of calling f once per point. Evaluation stops
+    after max_evals points even if the tolerance has not been met; the result
+    then has converged=False and reports its error estimate.
+    """
+    if a == b:
+        return QuadratureResult(0.0, 0.0, 0, True)
+    if a > b:
+        result = integrate(f, b, a, tol, rel_tol, max_evals, evaluate_points)
+        result.value = -result.value
+        return result
+    if evaluate_points is None:
+        evaluate_points = lambda xs: [f(x) for x in xs]
+
+    mapping = Mapping(a, b)
+
+    def integrate_panels(bounds):
+        ts = [t for lo, hi in bounds for t in panel_points(lo, hi)]
+        values = evaluate_points([mapping.to_x(t) for t in ts])
+        results = []
+        for i, (lo, hi) in enumerate(bounds):
+            chunk = values[i * POINTS_PER_PANEL:(i + 1) * POINTS_PER_PANEL]
+            ts_chunk = ts[i * POINTS_PER_PANEL:(i + 1) * POINTS_PER_PANEL]
+            weighted = [v * mapping.jacobian(t) for v, t in zip(chunk, ts_chunk)]
+            results.append((lo, hi) + panel_estimate(weighted, lo, hi))
+        return results
+
+    panels = integrate_panels([(mapping.t_lo, mapping.t_hi)])
+    evaluations = POINTS_PER_PANEL
+    width = mapping.t_hi - mapping.t_lo
+    while True:
+        value = math.fsum(p[2] for p in panels)
+        error = math.fsum(p[3] for p in panels)
+        target = max(tol, rel_tol * abs(value))
+        if error <= target:
+            return QuadratureResult(value, error, evaluations, True)
+        if not math.isfinite(value) or not math.isfinite(error):
+            return QuadratureResult(value, error, evaluations, False)
+
+        # Bisect every panel above its share of the tolerance, worst first,
+        # as far as the budget allows
+        refine = [p for p in panels if p[3] > target * (p[1] - p[0]) / width]
+        refine.sort(key=lambda p: p[3], reverse=True)
+        affordable = (max_evals - evaluations) // (2 * POINTS_PER_PANEL)
+        refine = refine[:affordable]
+        if not refine:
+            return QuadratureResult(value, error, evaluations, False)
+        budget = current_budget()
+        if budget is not None:
+            # A timeout or cancel() stops the integral between rounds, whatever its integrand ticks
+            budget.check()
+        refined = set(id(p) for p in refine)
+        halves = []
+        for lo, hi, _, _ in refine:
+            mid = (lo + hi) / 2
+            halves += [(lo, mid), (mid, hi)]
+        panels = [p for p in panels if id(p) not in refined] + integrate_panels(halves)
+        evaluations += len(halves) * POINTS_PER_PANEL
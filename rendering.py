@@ -0,0 +1,117 @@
+import numpy as np
+from matplotlib.figure import Figure
+
+# Drawing of sampled curves.
+#
+# A plot may hold far more samples than its axes have pixel columns, and
+# drawing them all dominates the time of a request. decimate() keeps, per
+# pixel column and per unbroken piece of the curve, the first, last, lowest
+# and highest sample (the M4 method): the line drawn through them covers the
+# same pixels as the line through every sample, at no more than four points
+# per column.
+#
+# Figures are built as matplotlib.figure.Figure objects rather than through
+# pyplot, which keeps every figure it creates open until plt.close() is
+# called. A Figure is not registered anywhere, so it is freed as soon as the
+# caller drops it and memory stays flat however many plots a server draws.
+#
+# chart_data() gives the decimated series as plain columns, for charts drawn
+# client-side (st.line_chart) instead of sending a rendered image.
+
+FIGURE_SIZE = (10, 5)
+FIGURE_DPI = 100
+# Pixel columns assumed when no figure is at hand
+DEFAULT_PIXELS = FIGURE_SIZE[0] * FIGURE_DPI
+CURVE_COLORS = ['red', 'tab:blue', 'tab:green', 'tab:purple', 'tab:orange', 'tab:brown', 'tab:pink', 'tab:olive']
+
+def decimate(x, y, x_min, x_max, pixels=DEFAULT_PIXELS):
+    """The samples of x (sorted), y drawn identically at pixels columns over [x_min, x_max].
+
+    NaN values in y break the curve and are kept, one per run of NaNs. y may
+    also hold one curve per row, sharing x; every curve is then kept whole.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if len(x) <= 4 * pixels:
+        return x, y
+    column = np.clip(((x - x_min) / (x_max - x_min) * pixels).astype(np.int64), -1, pixels)
+    keep = np.unique(np.concatenate([_kept(column, row, pixels) for row in y.reshape(-1, len(x))]))
+    return x[keep], y[..., keep]
+
+def _kept(column, y, pixels):
+    """Indices M4 keeps of one curve y, given the pixel column of every sample"""
+    gap = np.isnan(y)
+    # A NaN starts a new piece of the curve; runs of NaNs count once
+    first_gap = gap & ~np.concatenate(([False], gap[:-1]))
+    piece = np.cumsum(first_gap)
+    # Pieces and columns both increase along x, so groups are contiguous
+    group = piece * (pixels + 2) + column + 1
+    points = np.flatnonzero(~gap)
+    if not points.size:
+        return np.flatnonzero(first_gap)
+    values = y[points]
+    g = group[points]
+    starts = np.flatnonzero(np.concatenate(([True], g[1:] != g[:-1])))
+    ends = np.concatenate((starts[1:], [len(points)])) - 1
+    index = np.repeat(np.arange(len(starts)), ends - starts + 1)
+    lowest = _first_per_group(values == np.minimum.reduceat(values, starts)[index], index)
+    highest = _first_per_group(values == np.maximum.reduceat(values, starts)[index], index)
+    keep = np.concatenate((starts, ends, lowest, highest))
+    return np.union1d(points[keep], np.flatnonzero(first_gap))
+
+def _first_per_group(mask, index):
+    """Position of the first True of mask in each run of equal, sorted index values"""
+    hits = np.flatnonzero(mask)
+    return hits[np.concatenate(([True], index[hits][1:] != index[hits][:-1]))]
+
+def axes_pixels(ax) -> int:
+    """Width of ax in pixel columns"""
+    fig = ax.get_figure()
+    return max(1, int(round(ax.get_position().width * fig.get_figwidth() * fig.dpi)))
+
+def plot_figure(x, y, x_min, x_max, y_min, y_max, labels=None) -> Figure:
+    """A figure of the curve x, y in the window, decimated to its pixel width.
+
+    y may hold one curve per row, drawn in CURVE_COLORS order; labels, if
+    given, name them in a legend.
+    """
+    fig = Figure(figsize=FIGURE_SIZE, dpi=FIGURE_DPI)
+    ax = fig.subplots()
+    x, y = decimate(x, y, x_min, x_max, axes_pixels(ax))
+    for i, row in enumerate(np.reshape(y, (-1, len(x)))):
+        label = labels[i] if labels else None
+        ax.plot(x, row, color = CURVE_COLORS[i % len(CURVE_COLORS)], linewidth=2, label=label)
+
+    ax.set_xlim(x_min, x_max)
+    ax.set_ylim(y_min, y_max)
+    ax.grid(True)
+
+    # Optional: hide top and right spines
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+
+    if x_min <= 0 <= x_max:
+        ax.axvline(0, color = "#000000")
+
+    if y_min <= 0 <= y_max:
+        ax.axhline(0, color = "#000000")
+
+    ax.set_xlabel("x")
+    ax.set_ylabel("y")
+    if labels:
+        ax.legend(loc='upper right')
+
+    return fig
+
+def chart_data(x, y, x_min, x_max, pixels=DEFAULT_PIXELS, labels=None) -> dict:
+    """The decimated curve as {'x': [...], 'y': [...]} columns, None at breaks.
+
+    With one curve per row of y, each gets its own column, named by labels.
+    """
+    x, y = decimate(x, y, x_min, x_max, pixels)
+    if labels is None:
+        labels = ['y'] if y.ndim == 1 else [f'y{i + 1}' for i in range(len(y))]
+    data = {'x': x.tolist()}
+    for label, row in zip(labels, np.reshape(y, (-1, len(x)))):
+        data[label] = [None if np.isnan(value) else value for value in row.tolist()]
+    return data
@@ -0,0 +1,298 @@
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+import functions
+import kernels
+from ast_tools import canonical_form
+
+# Results kept across sessions and restarts.
+#
+# Results are keyed by what decides them: a kind ('value', 'plot'), the
+# canonical form of the ASTs (see ast_tools.canonical_form, so whitespace and
+# redundant parentheses do not matter), the kernel backend, the parameters of
+# the computation and the numeric settings of functions.py, hashed together
+# with SHA-256. Values are records of JSON numbers, or tuples of NumPy arrays
+# such as the x and y of a sampled plot; arrays are made read-only, as they
+# are shared by every caller.
+#
+# There are two tiers: a process-wide LRU in memory, bounded in entries and
+# bytes, in front of a SQLite file shared by every process using the same
+# path, bounded in bytes, least recently used rows deleted first. Both expire
+# entries after a TTL. Every entry records the cache version, a digest of the
+# source of every module of FunCG and of the NumPy version, so changing any
+# code that could decide a result, down to the AST helpers the compiler and
+# the closed forms consult, invalidates the entries computed before.
+# A disk that cannot be written only costs the disk tier.
+#
+# Errors, including budgets running out, are never cached.
+
+FORMAT_VERSION = 1
+# The file the app keeps results in; the library, cli.py and server.py only
+# use one when given a path
+DEFAULT_PATH = '~/.cache/funcg/results.sqlite3'
+# Settings of functions.py that change results, part of every key
+NUMERIC_SETTINGS = ('CONSTANTS', 'ISPTCPrecision', 'ESCPrecision', 'IntegralTolerance', 'IntegralMaxEvaluations',
+                    'IntegralNestedMaxEvaluations', 'AggregateFastPathTerms', 'SeriesTolerance', 'SeriesMaxTerms')
+MAX_ENTRIES = 4096
+# Disk writes between checks of the file's size and expired rows
+PRUNE_INTERVAL = 64
+
+_version = None
+
+def cache_version() -> str:
+    """Digest of the code and libraries computing results, without importing them"""
+    global _version
+    if _version is None:
+        digest = hashlib.sha256(f'{FORMAT_VERSION} numpy {np.__version__}'.encode())
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.py'):
+                digest.update(name.encode('utf-8'))
+                with open(os.path.join(directory, name), 'rb') as f:
+                    digest.update(f.read())
+        _version = digest.hexdigest()[:16]
+    return _version
+
+def result_key(kind, asts, backend=None, params=()) -> str:
+    """Key of the result of kind computed from asts with backend and params"""
+    backend = kernels.get_backend(backend)
+    settings = [getattr(functions, name) for name in NUMERIC_SETTINGS]
+    parts = [kind, backend.name, repr(settings), repr(params)] + [canonical_form(ast) for ast in asts]
+    return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()
+
+def _encode(value):
+    """(format, bytes) of a value"""
+    if isinstance(value, tuple):
+        buffer = io.BytesIO()
+        np.savez(buffer, *value)
+        return 'arrays', buffer.getvalue()
+    return 'json', json.dumps(value).encode('utf-8')
+
+def _decode(kind, blob):
+    if kind == 'arrays':
+        with np.load(io.BytesIO(blob)) as data:
+            return tuple(_frozen(data[f'arr_{i}']) for i in range(len(data.files)))
+    return json.loads(blob)
+
+def _frozen(array):
+    array.setflags(write=False)
+    return array
+
+class ResultCache:
+    def __init__(self, path=None, max_bytes=1 << 26, disk_bytes=1 << 28, ttl=None,
+                 max_entries=MAX_ENTRIES, version=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.disk_bytes = disk_bytes
+        # Seconds an entry stays valid, None for ever
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version = cache_version() if version is None else version
+        self.nbytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        # key -> (value, size in bytes, creation time)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._db = None
+        if path is not None:
+            self._open()
+
+    def _open(self):
+        try:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, version TEXT, kind TEXT, '
+                       'created REAL, accessed REAL, size INTEGER, value BLOB)')
+            db.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+            db.execute('DELETE FROM results WHERE version != ?', (self.version,))
+            self._db = db
+        except (sqlite3.Error, OSError):
+            self._db = None
+
+    def _expired(self, created, now) -> bool:
+        return self.ttl is not None and now - created >= self.ttl
+
+    def get(self, key):
+        """The cached value for key, or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry[2], now):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self._entries[key]
+                self.nbytes -= entry[1]
+            entry = self._load(key, now)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, *entry)
+            return entry[0]
+
+    def put(self, key, value):
+        """Cache value, a record of JSON numbers or a tuple of arrays, under key"""
+        try:
+            kind, blob = _encode(value)
+        except (TypeError, ValueError):
+            return
+        if kind == 'arrays':
+            value = tuple(_frozen(array) for array in value)
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, len(blob), now)
+            self._store(key, kind, blob, now)
+
+    def _remember(self, key, value, size, created):
+        if size > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.nbytes -= previous[1]
+        self._entries[key] = (value, size, created)
+        self.nbytes += size
+        while len(self._entries) > self.max_entries or self.nbytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.nbytes -= evicted[1]
+
+    def _load(self, key, now):
+        """(value, size, creation time) of key's row on disk, or None"""
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute('SELECT kind, created, value FROM results WHERE key = ? AND version = ?',
+                                   (key, self.version)).fetchone()
+            if row is None:
+                return None
+            kind, created, blob = row
+            if self._expired(created, now):
+                self._db.execute('DELETE FROM results WHERE key = ?', (key,))
+                return None
+            self._db.execute('UPDATE results SET accessed = ? WHERE key = ?', (now, key))
+            return _decode(kind, blob), len(blob), created
+        except (sqlite3.Error, ValueError, OSError):
+            return None
+
+    def _store(self, key, kind, blob, now):
+        if self._db is None or len(blob) > self.disk_bytes:
+            return
+        try:
+            self._db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (key, self.version, kind, now, now, len(blob), blob))
+            self._writes += 1
+            if self._writes % PRUNE_INTERVAL == 0:
+                self._prune(now)
+        except sqlite3.Error:
+            pass
+
+    def _prune(self, now):
+        """Delete expired rows, then the least recently used ones beyond disk_bytes"""
+        if self.ttl is not None:
+            self._db.execute('DELETE FROM results WHERE created <= ?', (now - self.ttl,))
+        excess = (self._db.execute('SELECT SUM(size) FROM results').fetchone()[0] or 0) - self.disk_bytes
+        if excess <= 0:
+            return
+        stale = []
+        for key, size in self._db.execute('SELECT key, size FROM results ORDER BY accessed'):
+            stale.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._db.executemany('DELETE FROM results WHERE key = ?', stale)
+
+    def prune(self):
+        with self._lock:
+            if self._db is not None:
+                try:
+                    self._prune(time.time())
+                except sqlite3.Error:
+                    pass
+
+    def clear(self):
+        """Forget every entry, on disk too"""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.disk_hits = 0
+            self.misses = 0
+            if self._db is not None:
+                try:
+                    self._db.execute('DELETE FROM results')
+                except sqlite3.Error:
+                    pass
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {
+                'entries': len(self._entries),
+                'bytes': self.nbytes,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'version': self.version,
+            }
+            if self._db is not None:
+                try:
+                    stats['disk_entries'], stats['disk_bytes'] = self._db.execute(
+                        'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone()
+                except sqlite3.Error:
+                    pass
+            return stats
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def __repr__(self):
+        return f'ResultCache(path={self.path!r}, entries={len(self)}, version={self.version})'
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """The process-wide cache as configured in functions.py, or None if disabled"""
+    global _cache
+    if not functions.ResultCacheEnabled:
+        return None
+    path = functions.ResultCachePath
+    if path is not None:
+        path = os.path.expanduser(path)
+    with _cache_lock:
+        settings = (path, functions.ResultCacheMemoryBytes, functions.ResultCacheDiskBytes, functions.ResultCacheTTL)
+        if _cache is None or (_cache.path, _cache.max_bytes, _cache.disk_bytes, _cache.ttl) != settings:
+            if _cache is not None:
+                _cache.close()
+            _cache = ResultCache(*settings)
+        return _cache
+
+def cached(kind, asts, compute, backend=None, params=()):
+    """compute(), or the value it gave before for the same kind, asts, backend and params"""
+    cache = get_cache()
+    if cache is None:
+        return compute()
+    key = result_key(kind, asts, backend, params)
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.put(key, value)
+    return value
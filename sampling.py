@@ -0,0 +1,169 @@
+import numpy as np
+
+# Adaptive sampling of f(x) for plotting.
+#
+# Starts from a coarse uniform grid and then, round by round, bisects only the
+# intervals that do not look like a straight line on screen: where the curve
+# bends by more than CURVATURE_TOLERANCE of the window height, jumps by more
+# than JUMP_TOLERANCE of it, changes sign at a large magnitude, or becomes
+# defined or undefined. Each round's new points are evaluated in one batch.
+# The requested point count is a budget: smooth curves stop early, and when
+# more intervals need refining than the budget allows, the worst ones go first.
+#
+# Values are compared after clipping to the window extended by one height on
+# either side, so detail far off screen costs nothing. Once sampling is done,
+# an interval whose jump is much larger than its neighbours' is taken to be an
+# asymptote or a jump discontinuity, and a NaN is inserted there so that the
+# plotted line breaks instead of drawing a false vertical segment.
+#
+# Given a bound function (see intervals.py), intervals proven to lie above or
+# below the window by more than PRUNE_MARGIN of its height are never split,
+# and points inside such regions of the initial grid are not evaluated at all.
+
+INITIAL_POINTS = 129
+CURVATURE_TOLERANCE = 1e-3
+JUMP_TOLERANCE = 0.02
+MAX_ROUNDS = 40
+# Intervals are not split below this fraction of the x range
+MIN_WIDTH_FRACTION = 2.0 ** -30
+# A jump is a break when it is this many times larger than its neighbours'
+BREAK_RATIO = 8
+# Off-screen proofs must clear the window by this fraction of its height,
+# covering kernels less accurate than the exact bounds
+PRUNE_MARGIN = 0.05
+
+class SampleResult:
+    def __init__(self, x, y, evaluations, rounds, breaks, pruned):
+        # Sorted sample points, with a NaN point inserted at every break
+        self.x = x
+        self.y = y
+        self.evaluations = evaluations
+        self.rounds = rounds
+        # x positions where the curve was broken
+        self.breaks = breaks
+        # Width of the x range proven off-screen
+        self.pruned = pruned
+
+    def __repr__(self):
+        return (f'SampleResult(evaluations={self.evaluations}, rounds={self.rounds}, '
+                f'breaks={len(self.breaks)}, pruned={self.pruned:.3g})')
+
+def adaptive_sample(f, x_min, x_max, max_points, y_min, y_max, bound=None,
+                    initial_points=INITIAL_POINTS) -> SampleResult:
+    """Sample f over [x_min, x_max] with at most max_points evaluations.
+
+    f maps an array of x values to an array of y values, NaN where undefined;
+    y_min and y_max are the visible window the tolerances are relative to.
+    bound, if given, maps arrays lo, hi of x intervals to arrays bounding f
+    over them, as intervals.bound() does. Sampling starts from a uniform grid
+    of initial_points.
+
+    To sample several curves on one shared grid, f returns a 2-D array with
+    one row per curve, and bound a pair of such arrays. An interval is then
+    split where any curve needs it and pruned where every curve is off-screen.
+    """
+    height = y_max - y_min
+    band = (y_min - height, y_max + height)
+    off_screen = _off_screen_test(bound, y_min - PRUNE_MARGIN * height, y_max + PRUNE_MARGIN * height)
+    x = np.linspace(x_min, x_max, max(3, min(initial_points, max_points)))
+    pruned = off_screen(x[:-1], x[1:])
+    # Points with pruned intervals on both sides cannot be seen
+    hidden = np.concatenate(([True], pruned)) & np.concatenate((pruned, [True]))
+    values = np.asarray(f(x[~hidden]), dtype=float)
+    curves = 1 if values.ndim == 1 else len(values)
+    y = np.full((curves, len(x)), np.nan)
+    y[:, ~hidden] = values
+    evaluations = int((~hidden).sum())
+    min_width = (x_max - x_min) * MIN_WIDTH_FRACTION
+    rounds = 0
+    while evaluations < max_points and rounds < MAX_ROUNDS:
+        scores = np.max([interval_scores(x, row, band) for row in y], axis=0)
+        scores[pruned | (np.diff(x) <= min_width)] = 0.0
+        split = np.flatnonzero(scores > 0)
+        if split.size and bound is not None:
+            off = off_screen(x[split], x[split + 1])
+            pruned[split[off]] = True
+            split = split[~off]
+        if not split.size:
+            break
+        budget = max_points - evaluations
+        if split.size > budget:
+            split = np.sort(split[np.argsort(scores[split], kind='stable')[::-1][:budget]])
+        new_x = (x[split] + x[split + 1]) / 2
+        new_y = np.asarray(f(new_x), dtype=float).reshape(curves, len(new_x))
+        x = np.insert(x, split + 1, new_x)
+        y = np.insert(y, split + 1, new_y, axis=1)
+        pruned = np.insert(pruned, split + 1, False)
+        evaluations += len(new_x)
+        rounds += 1
+
+    pruned_width = float(np.diff(x)[pruned].sum())
+    broken = [find_breaks(x, row, band) for row in y]
+    breaks = np.unique(np.concatenate(broken))
+    break_x = (x[breaks] + x[breaks + 1]) / 2
+    # Curves not broken there get the midpoint of their chord
+    break_y = (y[:, breaks] + y[:, breaks + 1]) / 2
+    for row, indices in enumerate(broken):
+        break_y[row, np.searchsorted(breaks, indices)] = np.nan
+    x = np.insert(x, breaks + 1, break_x)
+    y = np.insert(y, breaks + 1, break_y, axis=1)
+    if values.ndim == 1:
+        y = y[0]
+    return SampleResult(x, y, evaluations, rounds, break_x, pruned_width)
+
+def _off_screen_test(bound, low, high):
+    """off_screen(lo, hi) -> bool array: intervals whose bounds lie entirely outside [low, high]"""
+    if bound is None:
+        return lambda lo, hi: np.zeros(len(lo), dtype=bool)
+    def off_screen(lo, hi):
+        y_lo, y_hi = bound(lo, hi)
+        off = (np.asarray(y_hi) < low) | (np.asarray(y_lo) > high)
+        return off.reshape(-1, len(lo)).all(axis=0)
+    return off_screen
+
+def interval_scores(x, y, band) -> np.ndarray:
+    """How badly each interval between samples needs splitting, 0 if not at all"""
+    height = (band[1] - band[0]) / 3
+    clipped = np.clip(y, *band)
+    finite = np.isfinite(y)
+    both = finite[:-1] & finite[1:]
+    scores = np.zeros(len(x) - 1)
+
+    # Defined on one side only: the edge of the domain, or a pole
+    scores[finite[:-1] != finite[1:]] = 1.0
+
+    jump = np.where(both, np.abs(np.diff(clipped)), 0.0) / height
+    scores = np.maximum(scores, np.where(jump > JUMP_TOLERANCE, jump, 0.0))
+
+    # Sign change at a magnitude beyond the window: a likely asymptote
+    with np.errstate(invalid='ignore'):
+        sign_change = both & (np.sign(y[:-1]) * np.sign(y[1:]) < 0)
+        large = np.maximum(np.abs(y[:-1]), np.abs(y[1:])) > height
+    scores[sign_change & large] = np.maximum(scores[sign_change & large], 1.0)
+
+    if len(x) >= 3:
+        # Distance of each inner point from the chord through its neighbours
+        t = (x[1:-1] - x[:-2]) / (x[2:] - x[:-2])
+        chord = clipped[:-2] + t * (clipped[2:] - clipped[:-2])
+        bend = np.nan_to_num(np.abs(clipped[1:-1] - chord) / height)
+        bend = np.where(bend > CURVATURE_TOLERANCE, bend, 0.0)
+        scores[:-1] = np.maximum(scores[:-1], bend)
+        scores[1:] = np.maximum(scores[1:], bend)
+    return scores
+
+def find_breaks(x, y, band) -> np.ndarray:
+    """Indices i where the curve should not be drawn from x[i] to x[i + 1]"""
+    if len(x) < 2:
+        return np.zeros(0, dtype=int)
+    height = (band[1] - band[0]) / 3
+    clipped = np.clip(y, *band)
+    both = np.isfinite(y[:-1]) & np.isfinite(y[1:])
+    jump = np.where(both, np.abs(np.diff(clipped)), 0.0)
+    padded = np.concatenate(([0.0], jump, [0.0]))
+    neighbours = np.maximum(padded[:-2], padded[2:])
+    # Segments entirely above or below the window are never seen
+    with np.errstate(invalid='ignore'):
+        above = y > band[1] - height
+        below = y < band[0] + height
+    hidden = (above[:-1] & above[1:]) | (below[:-1] & below[1:])
+    return np.flatnonzero((jump > JUMP_TOLERANCE * height) & (jump > BREAK_RATIO * neighbours) & ~hidden)
@@ -0,0 +1,189 @@
+import math
+from collections import deque
+
+# Infinite series and products for sum() and product() with an inf bound.
+#
+# Terms are summed one at a time. At every power-of-two term count the partial
+# sums are extrapolated to the limit: with an Euler-Maclaurin tail estimate
+# when the terms are one-signed and decay like C n^-p, and with Wynn's epsilon
+# algorithm otherwise (alternating or geometrically decaying terms). Summation
+# stops once two successive extrapolations agree to the tolerance, and the
+# difference between them is reported as the error estimate. Products are
+# summed as series of logarithms.
+#
+# A series is declared divergent when, at three checkpoints in a row from
+# DIVERGENCE_MIN_TERMS terms on, its terms stop shrinking or decay no faster
+# than 1/n within the error of the fitted exponent. Slower convergent series,
+# such as 1/n^1.01, are summed as far as max_terms allows; the result then
+# has converged=False, and the compiler warns with SeriesWarning.
+
+DIVERGENCE_MIN_TERMS = 4096
+WYNN_SUMS = 21
+
+class SeriesDivergence(ValueError):
+    def __init__(self, message, direction=0):
+        super().__init__(message)
+        # +1 or -1 when the partial sums run off to +/- infinity, else 0
+        self.direction = direction
+
+class SeriesWarning(RuntimeWarning):
+    def __init__(self, result):
+        # The same text for every result, so the warning is shown once per place
+        super().__init__('Series did not converge within the term budget; the value is an estimate')
+        self.result = result
+
+class SeriesResult:
+    def __init__(self, value, error, terms, converged):
+        self.value = value
+        self.error = error
+        self.terms = terms
+        self.converged = converged
+
+    def __repr__(self):
+        return (f'SeriesResult(value={self.value!r}, error={self.error!r}, '
+                f'terms={self.terms}, converged={self.converged})')
+
+def wynn_epsilon(sums) -> float:
+    """Limit of a sequence of partial sums estimated by Wynn's epsilon algorithm"""
+    previous = [0.0] * (len(sums) + 1)
+    current = list(sums)
+    best = current[-1]
+    for k in range(1, len(sums)):
+        following = []
+        for n in range(len(current) - 1):
+            diff = current[n + 1] - current[n]
+            if diff == 0:
+                # The table has stalled; keep the last even-column estimate
+                return best
+            following.append(previous[n + 1] + 1 / diff)
+        previous, current = current, following
+        if k % 2 == 0:
+            best = current[-1]
+    return best
+
+def euler_maclaurin_tail(last_term, last_index, p) -> float:
+    """Sum of the terms after last_index, for terms behaving like C n^-p"""
+    n = last_index
+    return last_term * (n / (p - 1) - 0.5 + p / (12 * n))
+
+class _Checkpoint:
+    def __init__(self, index, term, previous_term, one_signed):
+        self.index = index
+        self.term = term
+        self.previous_term = previous_term
+        self.one_signed = one_signed
+
+def _decay_order(current, previous):
+    """Exponent p of a C n^-p decay, if the terms are consistent with one"""
+    if previous is None or not current.one_signed or current.index <= 1 or previous.index <= 0:
+        return None
+    if current.term == 0 or previous.term == 0 or current.previous_term == 0:
+        return None
+    if (current.term < 0) != (previous.term < 0):
+        return None
+    return math.log(previous.term / current.term) / math.log(current.index / previous.index)
+
+def sum_series(term, start, tol=1e-10, max_terms=2**20) -> SeriesResult:
+    """Sum term(n) for n = start, start + 1, ... to infinity.
+
+    Raises SeriesDivergence when the series is detected to diverge. If
+    max_terms are used up first, the best estimate is returned with
+    converged=False.
+    """
+    total = 0.0
+    recent = deque(maxlen=WYNN_SUMS)
+    count = 0
+    next_checkpoint = 16
+    previous = None
+    previous_term = None
+    estimate = None
+    error = math.inf
+    suspicious = 0
+    one_signed = True
+    n = start
+    while count < max_terms:
+        a = float(term(n))
+        if not math.isfinite(a):
+            raise ValueError(f'Series term is not finite at {n}')
+        if previous_term is not None and a != 0 and previous_term != 0 and (a < 0) != (previous_term < 0):
+            one_signed = False
+        total += a
+        recent.append(total)
+        count += 1
+        if count == next_checkpoint:
+            current = _Checkpoint(n, a, previous_term, one_signed)
+            new_estimate, diverging = _extrapolate(total, recent, current, previous)
+            if estimate is not None:
+                error = abs(new_estimate - estimate)
+                if error <= tol * max(1.0, abs(new_estimate)) and not diverging:
+                    return SeriesResult(new_estimate, error, count, True)
+            estimate = new_estimate
+            suspicious = suspicious + 1 if diverging else 0
+            if suspicious >= 3 and count >= DIVERGENCE_MIN_TERMS:
+                direction = (1 if a > 0 else -1) if one_signed else 0
+                raise SeriesDivergence(diverging, direction)
+            previous = current
+            one_signed = True
+            next_checkpoint *= 2
+        previous_term = a
+        n += 1
+    if estimate is None:
+        estimate = total
+    return SeriesResult(estimate, error, count, False)
+
+def _extrapolate(total, recent, current, previous):
+    """Estimate the limit at a checkpoint.
+
+    Returns the estimate and, if the terms look divergent, the reason.
+    """
+    a = abs(current.term)
+    if current.previous_term is not None and a > 0 and a >= abs(current.previous_term):
+        return wynn_epsilon(list(recent)), 'Series diverges (terms do not tend to zero)'
+    p = _decay_order(current, previous)
+    if p is not None:
+        # Decay order seen locally, from the last two terms; it matches p
+        # for algebraic decay and is far larger for geometric decay. The
+        # difference is the error of the fit
+        local_p = math.log(current.previous_term / current.term) * current.index
+        if p - abs(local_p - p) <= 1:
+            return total, 'Series diverges (terms decay no faster than 1/n)'
+        if abs(local_p - p) <= 0.2 * p:
+            return total + euler_maclaurin_tail(current.term, current.index, p), None
+    return wynn_epsilon(list(recent)), None
+
+class _ZeroFactor(Exception):
+    pass
+
+def product_series(term, start, tol=1e-10, max_terms=2**20) -> SeriesResult:
+    """Multiply term(n) for n = start, start + 1, ... to infinity via a series of logs"""
+    negatives = []
+    count = 0
+
+    def log_term(n):
+        nonlocal count
+        a = float(term(n))
+        count += 1
+        if a == 0:
+            raise _ZeroFactor()
+        if a < 0:
+            negatives.append(n)
+        return math.log(abs(a))
+
+    try:
+        result = sum_series(log_term, start, tol, max_terms)
+    except _ZeroFactor:
+        return SeriesResult(0.0, 0.0, count, True)
+    except SeriesDivergence as divergence:
+        # Logs running off to -infinity mean the factors shrink the product to zero
+        if divergence.direction < 0:
+            return SeriesResult(0.0, 0.0, count, True)
+        raise SeriesDivergence('Product diverges', divergence.direction) from None
+
+    if negatives and negatives[-1] - start >= result.terms // 2:
+        raise SeriesDivergence('Product diverges (factors keep changing sign)')
+    sign = -1.0 if len(negatives) % 2 else 1.0
+    try:
+        value = sign * math.exp(result.value)
+    except OverflowError:
+        raise OverflowError('Product is too large for a float') from None
+    return SeriesResult(value, abs(value) * result.error, result.terms, result.converged)
@@ -0,0 +1,184 @@
+import argparse
+import asyncio
+import json
+import sys
+import time
+from concurrent.futures.process import BrokenProcessPool
+import functions
+import parallel
+import result_cache
+import service
+
+# Local HTTP/JSON evaluation service, without Streamlit.
+#
+#   python server.py [--host 127.0.0.1] [--port 8765] [--workers N] [--cache PATH]
+#
+#   POST /evaluate   a request object, or a list of them (see service.py);
+#                    answered with the response object or the list of responses
+#   GET  /health     {"status": "ok", "workers": N}
+#
+# The asyncio front end only reads HTTP and JSON; requests are evaluated in
+# the worker processes of parallel.py's shared pool, which is started once
+# and reused, so every worker keeps its expression and tile caches warm.
+# Requests arriving within BATCH_DELAY seconds of each other are batched, up
+# to BATCH_SIZE, and the batch is split into one job per worker: a burst of
+# small requests costs a few round trips to the pool instead of one each.
+#
+# Evaluation errors are part of the response, which is still a 200. Timing
+# adds queue_ms, the time from arrival to the response being ready.
+# Matplotlib is only imported by the workers, for plot requests. With
+# --cache, the workers share a result cache file across restarts.
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+BATCH_SIZE = 64
+BATCH_DELAY = 0.002
+MAX_BODY_BYTES = 1 << 24
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large'}
+
+class Batcher:
+    def __init__(self, batch_size=BATCH_SIZE, delay=BATCH_DELAY):
+        self.batch_size = batch_size
+        self.delay = delay
+        self._queue = asyncio.Queue()
+
+    async def submit(self, request) -> dict:
+        """The response to request, evaluated in a batch on the pool"""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((request, future, time.perf_counter()))
+        return await future
+
+    async def run(self):
+        """Send queued requests to the pool, batch by batch, until cancelled"""
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self._queue.get()]
+            deadline = loop.time() + self.delay
+            while len(pending) < self.batch_size:
+                try:
+                    pending.append(await asyncio.wait_for(self._queue.get(), deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    break
+            for part in parallel.split(pending, min_chunk=1):
+                loop.create_task(self._dispatch(part))
+
+    async def _dispatch(self, part):
+        requests = [request for request, _, _ in part]
+        try:
+            responses = await asyncio.get_running_loop().run_in_executor(
+                parallel.get_pool(), service.handle_many, requests)
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                # A worker died; the next batch starts a new pool
+                parallel.shutdown()
+            responses = [{'ok': False, 'error': f'Worker failed: {e}', 'error_type': type(e).__name__, 'timing': {}}
+                         for _ in requests]
+        done = time.perf_counter()
+        for (request, future, arrived), response in zip(part, responses):
+            response['timing']['queue_ms'] = round((done - arrived) * 1000, 3)
+            if not future.done():
+                future.set_result(response)
+
+async def _route(method, path, body, batcher):
+    """(status, payload) answering one HTTP request"""
+    path = path.split('?', 1)[0]
+    if path == '/health':
+        if method != 'GET':
+            return 405, {'error': 'Use GET'}
+        return 200, {'status': 'ok', 'workers': parallel.workers()}
+    if path != '/evaluate':
+        return 404, {'error': f'No such endpoint: {path}'}
+    if method != 'POST':
+        return 405, {'error': 'Use POST with a JSON body'}
+    try:
+        payload = json.loads(body)
+    except ValueError as e:
+        return 400, {'error': f'Invalid JSON: {e}'}
+    if isinstance(payload, list):
+        return 200, list(await asyncio.gather(*(batcher.submit(request) for request in payload)))
+    return 200, await batcher.submit(payload)
+
+async def _serve(reader, writer, batcher):
+    """Answer the HTTP/1.1 requests of one connection"""
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            try:
+                method, path, version = request_line.decode('latin-1').split()
+                length = int(headers.get('content-length', 0))
+            except ValueError:
+                _respond(writer, 400, {'error': 'Malformed HTTP request'}, False)
+                break
+            if length > MAX_BODY_BYTES:
+                _respond(writer, 413, {'error': f'Bodies are limited to {MAX_BODY_BYTES} bytes'}, False)
+                break
+            body = await reader.readexactly(length)
+            status, payload = await _route(method, path, body, batcher)
+            keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+            _respond(writer, status, payload, keep_alive)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+def _respond(writer, status, payload, keep_alive):
+    body = service.dumps(payload).encode('utf-8')
+    head = (f'HTTP/1.1 {status} {REASONS[status]}\r\n'
+            f'Content-Type: application/json\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n')
+    writer.write(head.encode('latin-1') + body)
+
+async def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, ready=None):
+    """Run the service until cancelled; ready(sockets), if given, is called once it listens"""
+    batcher = Batcher()
+    # Start the workers now rather than on the first request
+    await asyncio.get_running_loop().run_in_executor(parallel.get_pool(), service.handle_many, [])
+    server = await asyncio.start_server(lambda r, w: _serve(r, w, batcher), host, port)
+    batching = asyncio.get_running_loop().create_task(batcher.run())
+    if ready is not None:
+        ready(server.sockets)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        batching.cancel()
+        parallel.shutdown()
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='FunCG HTTP/JSON evaluation service')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, help='worker processes (default: one per CPU)')
+    parser.add_argument('--cache', metavar='PATH',
+                        help=f'keep results across restarts in this SQLite file, e.g. {result_cache.DEFAULT_PATH}')
+    args = parser.parse_args(argv)
+    if args.workers is not None:
+        functions.ParallelWorkers = args.workers
+    if args.cache is not None:
+        functions.ResultCachePath = args.cache
+    def ready(sockets):
+        print(f'serving on {", ".join(str(s.getsockname()) for s in sockets)} with {parallel.workers()} workers',
+              flush=True)
+    try:
+        asyncio.run(serve(args.host, args.port, ready))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,228 @@
+import base64
+import io
+import json
+import math
+import time
+import functions
+import batch
+import result_cache
+from functions import IntegralNode, SigmaSumNode, ProductNode, ASTNode, Parser, CONSTANTS, evaluate
+from expression_cache import get_expression
+from compiler import integrate_node, series_node, is_series, compile_cached
+from cost import check_cost
+from budget import EvaluationBudget, BudgetExceeded
+from tiles import Viewport
+from ast_tools import free_variables
+
+# Headless evaluation requests, shared by cli.py and server.py.
+#
+# A request is a JSON object naming an expression and what to do with it:
+#
+#   {"expr": "x^2 + y", "variables": {"x": 2, "y": 1}}
+#   {"mode": "batch", "expr": "1/(x - 1)", "rows": [{"x": 0}, {"x": 1}]}
+#   {"mode": "plot", "expr": "sin(x); cos(x)", "x_min": -5, "x_max": 5}
+#
+# handle() answers it with a response object holding the result or the error
+# and the time spent per stage, in milliseconds. An "id" given in the request
+# is copied to its response. Evaluation runs as in the app: expressions come
+# from the expression cache, expensive ones are rejected up front, and the
+# evaluation runs under an EvaluationBudget, which a request may tighten with
+# "timeout" and "max_steps" but not loosen. Variables may rebind constants
+# such as e and pi, as in evaluate().
+#
+# Plots are sampled as the app samples them and returned as chart data, the
+# decimated columns of rendering.chart_data(), or with "format": "png" as a
+# base64-encoded image. Only they import Matplotlib, on first use.
+#
+# Results and plot samples computed before, in this process or another one
+# sharing the result cache file, are returned from the cache (see
+# result_cache.py).
+#
+# Non-finite floats are not valid JSON numbers and are returned as the
+# strings "inf", "-inf" and "nan".
+
+MODES = ('evaluate', 'batch', 'plot')
+PLOT_FORMATS = ('data', 'png')
+# Upper limit on the points of a plot, as in the app
+MAX_PLOT_POINTS = 100000
+
+class RequestError(ValueError):
+    """A request that is not well-formed"""
+
+def json_number(value):
+    """value as a JSON-safe number"""
+    if isinstance(value, int):
+        return value
+    value = float(value)
+    return value if math.isfinite(value) else repr(value)
+
+def dumps(response) -> str:
+    """response as one line of JSON"""
+    return json.dumps(response, allow_nan=False, separators=(',', ':'))
+
+class _Timer:
+    def __init__(self, timing, stage):
+        self.timing = timing
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.timing[f'{self.stage}_ms'] = round((time.perf_counter() - self.started) * 1000, 3)
+
+def handle(request) -> dict:
+    """The response to one request"""
+    started = time.perf_counter()
+    response = {}
+    timing = {}
+    try:
+        if not isinstance(request, dict):
+            raise RequestError("A request must be a JSON object")
+        if 'id' in request:
+            response['id'] = request['id']
+        mode = request.get('mode', 'evaluate')
+        if mode not in MODES:
+            raise RequestError(f"Unknown mode: {mode} (expected one of {', '.join(MODES)})")
+        response['ok'] = True
+        response.update(_HANDLERS[mode](request, timing))
+    except BudgetExceeded as e:
+        response.update(ok=False, error=f'Evaluation stopped: {e}', error_type=type(e).__name__)
+    except Exception as e:
+        response.update(ok=False, error=str(e), error_type=type(e).__name__)
+    timing['total_ms'] = round((time.perf_counter() - started) * 1000, 3)
+    response['timing'] = timing
+    return response
+
+def handle_many(requests) -> list:
+    """handle() of every request, in order"""
+    return [handle(request) for request in requests]
+
+def _text(request) -> str:
+    expr = request.get('expr')
+    if not isinstance(expr, str) or not expr.strip():
+        raise RequestError("The request has no expression ('expr')")
+    return expr
+
+def _variables(bindings) -> dict:
+    """A bindings object as a variables dict, names lower-cased as evaluate() reads them"""
+    if bindings is None:
+        return {}
+    if not isinstance(bindings, dict):
+        raise RequestError("Variables must be a JSON object of names and numbers")
+    variables = {}
+    for name, value in bindings.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise RequestError(f"Variable '{name}' is not a number")
+        variables[name.lower()] = value
+    return variables
+
+def _budget(request) -> EvaluationBudget:
+    """The app's budget, tightened by the request's timeout and max_steps"""
+    max_steps = functions.EvaluationMaxSteps
+    timeout = functions.EvaluationTimeout
+    if request.get('max_steps') is not None:
+        max_steps = min(max_steps, int(request['max_steps']))
+    if request.get('timeout') is not None:
+        timeout = min(timeout, float(request['timeout']))
+    return EvaluationBudget(max_steps, timeout)
+
+def expression_tree(cached, names=()) -> ASTNode:
+    """The tree to evaluate a cached expression with bindings for names: the
+    optimized one, unless they rebind a constant such as e or pi that the
+    optimizer folded, which only the tree as parsed still reads.
+    """
+    rebound = CONSTANTS.keys() & set(names)
+    if rebound:
+        tree = Parser(cached.tokens, cached.text).parse()
+        if rebound & free_variables(tree):
+            return tree
+    return cached.ast
+
+def evaluate_expression(cached, variables=None) -> dict:
+    """The result of a cached expression as the app computes it, with the error
+    estimate and effort of integrals and infinite series. Results come from
+    the result cache when the same one was computed before.
+    """
+    variables = {} if variables is None else variables
+    ast = expression_tree(cached, variables)
+    compiled = cached.compiled if ast is cached.ast else compile_cached(ast, cached.backend)
+    def compute():
+        if isinstance(ast, IntegralNode):
+            report = integrate_node(ast, dict(variables), backend=cached.backend)
+            return {'result': report.value, 'error_estimate': report.error,
+                    'evaluations': report.evaluations, 'converged': report.converged}
+        if isinstance(ast, (SigmaSumNode, ProductNode)) and \
+                is_series(evaluate(ast.lower, dict(variables)), evaluate(ast.upper, dict(variables))):
+            report = series_node(ast, dict(variables), backend=cached.backend)
+            return {'result': report.value, 'error_estimate': report.error,
+                    'terms': report.terms, 'converged': report.converged}
+        return {'result': compiled(dict(variables))}
+    # Only the variables ast reads tell results apart
+    names = free_variables(ast)
+    params = tuple(sorted((name, value) for name, value in variables.items() if name in names))
+    return result_cache.cached('value', [ast], compute, cached.backend, params)
+
+def _evaluate(request, timing) -> dict:
+    variables = _variables(request.get('variables'))
+    with _Timer(timing, 'parse'):
+        cached = get_expression(_text(request), request.get('backend'))
+    check_cost(expression_tree(cached, variables), variables, backend=cached.backend)
+    with _Timer(timing, 'evaluate'), _budget(request):
+        outcome = evaluate_expression(cached, variables)
+    return {name: json_number(value) if name == 'result' or isinstance(value, float) else value
+            for name, value in outcome.items()}
+
+def _batch(request, timing) -> dict:
+    rows = request.get('rows')
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise RequestError("A batch request needs a list of variable bindings ('rows')")
+    with _Timer(timing, 'parse'):
+        cached = get_expression(_text(request), request.get('backend'))
+    # A row binding a name to something other than a number fails on its own
+    bindings = [{name.lower(): value for name, value in row.items()} for row in rows]
+    ast = expression_tree(cached, {name for row in bindings for name in row})
+    results = []
+    errors = {}
+    with _Timer(timing, 'evaluate'), _budget(request):
+        for i, value in enumerate(batch.evaluate_rows(ast, bindings, cached.backend)):
+            if isinstance(value, Exception):
+                errors[str(i)] = str(value)
+                results.append(None)
+            else:
+                results.append(json_number(value))
+    return {'results': results, 'errors': errors}
+
+def _plot(request, timing) -> dict:
+    # Matplotlib comes in with the plotting modules, only once a plot is asked for
+    import graphing_utilities
+    import rendering
+    plot_format = request.get('format', 'data')
+    if plot_format not in PLOT_FORMATS:
+        raise RequestError(f"Unknown plot format: {plot_format} (expected one of {', '.join(PLOT_FORMATS)})")
+    default = Viewport()
+    viewport = Viewport(*(request.get(key, value) for key, value in
+                          zip(('x_min', 'x_max', 'y_min', 'y_max'), default.bounds())))
+    points = min(int(request.get('points', graphing_utilities.num_points)), MAX_PLOT_POINTS)
+    backend = request.get('backend')
+    # Curves are separated by semicolons, as in the app
+    texts = list(dict.fromkeys(part.strip() for part in _text(request).split(';') if part.strip()))
+    with _Timer(timing, 'parse'):
+        curves = [get_expression(text, backend) for text in texts]
+    for curve in curves:
+        check_cost(curve.ast, points=points, x_range=(viewport.x_min, viewport.x_max), backend=curve.backend)
+    with _Timer(timing, 'evaluate'), _budget(request):
+        x_values, y_values = graphing_utilities.sample_plots(
+            [curve.ast for curve in curves], *viewport.bounds(), backend=backend, max_points=points,
+            cache_key=tuple((curve.text, curve.backend.name) for curve in curves))
+    labels = [f'y = {curve.text}' for curve in curves]
+    with _Timer(timing, 'render'):
+        if plot_format == 'png':
+            fig = rendering.plot_figure(x_values, y_values, *viewport.bounds(), labels if len(curves) > 1 else None)
+            image = io.BytesIO()
+            fig.savefig(image, format='png')
+            return {'png': base64.b64encode(image.getvalue()).decode('ascii')}
+        pixels = int(request.get('pixels', rendering.DEFAULT_PIXELS))
+        return {'data': rendering.chart_data(x_values, y_values, viewport.x_min, viewport.x_max, pixels, labels)}
+
+_HANDLERS = {'evaluate': _evaluate, 'batch': _batch, 'plot': _plot}
@@ -0,0 +1,14 @@
+import os
+import sys
+import pytest
+
+# The modules live at the top level of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import functions
+
+@pytest.fixture(autouse=True)
+def no_result_cache(monkeypatch):
+    """Tests compute every result, never reading or writing a user's result cache"""
+    monkeypatch.setattr(functions, 'ResultCacheEnabled', False)
+    monkeypatch.setattr(functions, 'ResultCachePath', None)
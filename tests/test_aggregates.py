@@ -0,0 +1,39 @@
+import math
+from fractions import Fraction
+import pytest
+import functions
+from functions import parse, evaluate
+from aggregates import fast_path_kind
+
+def loop_and_fast(expr, monkeypatch, variables=None):
+    """evaluate(expr) by the plain loop and through the fast paths"""
+    ast = parse(expr)
+    with monkeypatch.context() as patch:
+        patch.setattr(functions, 'AggregateFastPathTerms', math.inf)
+        loop = evaluate(ast, dict(variables or {}))
+    return loop, evaluate(ast, dict(variables or {}))
+
+@pytest.mark.parametrize('expr', [
+    'sum(k, 1, 1000, k*k*k - n*k)', 'sum(k, -500, 700, (k + n) * k * (k - m))', 'sum(k, 1, n, m)', 'sum(k, 0, 2000, k)',
+])
+def test_faulhaber_sums_of_ints_are_exact_ints(expr, monkeypatch):
+    assert fast_path_kind(parse(expr)) == 'closed form'
+    loop, fast = loop_and_fast(expr, monkeypatch, {'n': 999, 'm': 2})
+    assert type(loop) is int and type(fast) is int
+    assert fast == loop
+
+def test_faulhaber_sums_of_floats_are_correctly_rounded(monkeypatch):
+    # Literals are floats, so the loop adds floats
+    loop, fast = loop_and_fast('sum(k, 1, 100000, k^3 - 2*k + 0.5)', monkeypatch)
+    assert type(loop) is float and type(fast) is float
+    assert fast == float(sum(Fraction(k ** 3 - 2 * k) + Fraction(1, 2) for k in range(1, 100001)))
+    assert math.isclose(fast, loop, rel_tol=1e-12)
+    loop, fast = loop_and_fast('sum(k, 1, 2000, a*k^2 - k)', monkeypatch, {'a': 0.1})
+    assert type(fast) is float and math.isclose(fast, loop, rel_tol=1e-12)
+
+@pytest.mark.parametrize('expr', ['sum(k, 0, 1000, 3 * 0.99^k)', 'sum(k, 1, 500, 1.01^k / 2)', 'sum(k, 10, 400, 0.5^(k + 1))'])
+def test_geometric_sums_match_the_loop(expr, monkeypatch):
+    assert fast_path_kind(parse(expr)) == 'closed form'
+    loop, fast = loop_and_fast(expr, monkeypatch)
+    assert type(fast) is type(loop)
+    assert math.isclose(fast, loop, rel_tol=1e-12)
@@ -0,0 +1,48 @@
+import io
+import math
+from functions import parse, evaluate
+from optimizer import optimize
+import batch
+import service
+
+def test_rows_match_scalar_evaluation():
+    ast = parse('1/(x - 1) + logarithm(e, y)')
+    rows = [{'x': i % 5, 'y': (i % 7) - 2} for i in range(40)]
+    for row, value in zip(rows, batch.evaluate_rows(ast, rows)):
+        try:
+            expected = evaluate(ast, dict(row))
+        except Exception as e:
+            assert isinstance(value, Exception) and str(value) == str(e)
+        else:
+            assert math.isclose(value, expected, rel_tol=1e-12)
+
+def test_constant_expressions():
+    assert list(batch.evaluate_rows(parse('2+3'), [{}, {'x': 1}])) == [5.0, 5.0]
+    folded = optimize(parse('pi*2'))
+    assert list(batch.evaluate_rows(folded, [{}, {}])) == [2 * math.pi] * 2
+    result = batch.evaluate_columns(parse('2+3'), {}, rows=3)
+    assert list(result.values) == [5.0] * 3 and not result.errors
+    destination = io.StringIO()
+    summary = batch.evaluate_csv(parse('2+3'), io.StringIO('a\n1\n2\n'), destination)
+    assert summary.rows == 2 and summary.errors == 0
+    assert destination.getvalue().splitlines()[1:] == ['1,5.0,', '2,5.0,']
+
+def test_constant_batch_request():
+    response = service.handle({'mode': 'batch', 'expr': '2+3', 'rows': [{}, {}]})
+    assert response['ok'] and response['results'] == [5.0, 5.0]
+
+def test_failing_rows_do_not_stop_the_batch():
+    values = list(batch.evaluate_rows(parse('1/(x - 1)'), [{'x': 0}, {'x': 1}, {}, {'x': 'a'}]))
+    assert values[0] == -1.0
+    assert all(isinstance(value, Exception) for value in values[1:])
+
+def test_integrals_match_scalar_evaluation():
+    # A sharp peak a fixed rule would miss, and bounds varying per row
+    for text in ['integral(t, -1, 1, 1/(1e-4 + (t - x)^2))', 'integral(t, 0, x, sin(t^2))']:
+        ast = parse(text)
+        xs = [0.0, 0.3, 2.5]
+        result = batch.evaluate_columns(ast, {'x': xs})
+        assert not result.errors
+        for x, value in zip(xs, result.values):
+            assert value == evaluate(ast, {'x': x})
+        assert list(batch.evaluate_rows(ast, [{'x': x} for x in xs])) == list(result.values)
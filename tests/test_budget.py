@@ -0,0 +1,25 @@
+import time
+import pytest
+from functions import parse, evaluate
+from budget import EvaluationBudget, BudgetExceeded
+
+@pytest.mark.parametrize('expr, backend, where', [
+    ('factorial(10^7)', 'fast', 'factorial()'),
+    ('floor(10^9)', 'reference', 'floor()'),
+    # The reference power() counts up to an integer exponent with floor() first
+    ('1.0000001^(10^9)', 'reference', 'floor()'),
+])
+def test_long_kernels_time_out(expr, backend, where):
+    started = time.perf_counter()
+    with pytest.raises(BudgetExceeded) as error:
+        with EvaluationBudget(timeout=0.2):
+            evaluate(parse(expr), backend=backend)
+    assert time.perf_counter() - started < 2.0
+    assert dict(error.value.where).get(where, 0) > 0
+
+def test_integrals_check_the_budget_between_rounds():
+    budget = EvaluationBudget()
+    budget.cancel()
+    with pytest.raises(BudgetExceeded):
+        with budget:
+            evaluate(parse('integral(x, 0, 1, sin(1/x))'))
@@ -0,0 +1,73 @@
+import math
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from functions import parse, evaluate, IntegralNode
+from compiler import compile, compile_cached
+
+@pytest.mark.parametrize('expr', [
+    '2 + 3 * x - x^2 / 4', '-(x - 1)^3', 'sin(x) * cos(2 * x) + tg(x / 3)', 'logarithm(x + 4) + logarithm(2, x + 4)',
+    'absolute(x - 2) + floor(x * 1.5) + ceiling(x / 2)', 'factorial(5) + arctg(x) + pi * e',
+])
+def test_compiled_matches_evaluate(expr):
+    ast = parse(expr)
+    f = compile(ast)
+    for x in [-1.5, 0.0, 0.7, 3.0]:
+        assert f({'x': x}) == evaluate(ast, {'x': x})
+
+def test_compiled_loops_match_python_loops():
+    f = compile(parse('sum(i, 1, n, product(j, 1, i, 1 + 1/j) - i)'))
+    for n in [0, 1, 5, 20]:
+        assert math.isclose(f({'n': n}), sum(math.prod(1 + 1 / j for j in range(1, i + 1)) - i for i in range(1, n + 1)))
+
+def test_errors_are_raised_as_evaluate_raises_them():
+    f = compile(parse('1 / x + y'))
+    with pytest.raises(ZeroDivisionError):
+        f({'x': 0, 'y': 1})
+    with pytest.raises(ValueError, match="Variable 'y' not defined"):
+        f({'x': 1})
+
+def test_cached_callables_are_shared_between_threads():
+    ast = parse('sum(k, 1, 200, k * a)')
+    f = compile_cached(ast)
+    assert compile_cached(ast) is f
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(lambda a: f({'a': a}), range(50)))
+    assert results == [20100 * a for a in range(50)]
+
+def counting_integrals(expr):
+    """compile(expr) and a list holding the number of integrals computed so far"""
+    count = [0]
+    def instrument(node, fn):
+        if not isinstance(node, IntegralNode):
+            return fn
+        def counted(variables):
+            count[0] += 1
+            return fn(variables)
+        return counted
+    return compile(parse(expr), instrument=instrument), count
+
+def test_invariant_integral_is_computed_once_per_loop():
+    f, counts = counting_integrals('sum(i, 1, 1000, i * integral(t, 0, 1, t^2))')
+    assert math.isclose(f(), 500500 / 3)
+    assert counts == [1]
+    assert math.isclose(f(), 500500 / 3)
+    assert counts == [2]
+
+def test_hoisted_values_are_recomputed_per_entry_of_the_outer_loop():
+    f, counts = counting_integrals('sum(j, 1, 3, sum(i, 1, 10, i * integral(t, 0, j, t)))')
+    assert math.isclose(f(), 55 * (1 + 4 + 9) / 2)
+    assert counts == [3]
+    f, counts = counting_integrals('sum(i, 1, 5, integral(t, 0, i, t))')
+    assert math.isclose(f(), (1 + 4 + 9 + 16 + 25) / 2)
+    assert counts == [5]
+
+def test_memo_keys_live_in_the_call_variables_only():
+    f, counts = counting_integrals('sum(i, 1, 100, integral(t, 0, a, t) + i)')
+    for a in [1.0, 2.0]:
+        variables = {'a': a}
+        assert math.isclose(f(variables), 100 * a * a / 2 + 5050)
+        assert variables == {'a': a}
+    assert counts == [2]
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(lambda a: f({'a': a}), range(20)))
+    assert all(math.isclose(value, 50 * a * a + 5050) for a, value in zip(range(20), results))
@@ -0,0 +1,15 @@
+import warnings
+from functions import parse, evaluate
+from budget import EvaluationBudget
+from cost import estimate
+
+def test_nested_integral_estimate_bounds_actual_evaluations():
+    ast = parse('integral(y, 0, 1, integral(x, 0, 10, floor(x + y)))')
+    loops = estimate(ast).loops
+    with EvaluationBudget(None, None) as budget, warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        evaluate(ast)
+    for loop in loops:
+        steps = loop.iterations * loop.entries
+        actual = budget.where[loop.label]
+        assert actual <= steps <= 2 * actual, loop
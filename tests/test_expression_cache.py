@@ -0,0 +1,46 @@
+import pytest
+from functions import parse, evaluate
+from expression_cache import ExpressionCache, normalize
+
+def test_spacing_variants_share_an_entry():
+    cache = ExpressionCache()
+    entry = cache.get('x+1')
+    for text in [' x + 1 ', 'x  +1', '\tx+ 1']:
+        assert cache.get(text) is entry
+    assert cache.stats() == {'size': 1, 'maxsize': 256, 'hits': 3, 'misses': 1}
+    assert entry.text == 'x+1'
+    assert entry.compiled({'x': 2.0}) == evaluate(parse('x+1'), {'x': 2.0})
+
+def test_normalization_keeps_meaningful_spaces():
+    assert normalize(' sin ( x ) * 2 ') == 'sin(x)*2'
+    assert normalize('1 2') == '1 2' and normalize('a  b') == 'a b'
+    cache = ExpressionCache()
+    assert cache.get('sin (x)') is cache.get('sin(x)')
+    assert cache.get('1.5 * x') is not cache.get('15 * x')
+
+def test_entries_are_per_backend():
+    cache = ExpressionCache()
+    fast = cache.get('x^2', 'fast')
+    reference = cache.get('x ^ 2', 'reference')
+    assert fast is not reference and reference.backend.name == 'reference'
+    assert cache.get('x^2', 'fast') is fast
+    assert len(cache) == 2
+
+def test_least_recently_used_entries_are_evicted():
+    cache = ExpressionCache(maxsize=2)
+    first = cache.get('x + 1')
+    cache.get('x + 2')
+    assert cache.get('x+1') is first
+    cache.get('x + 3')
+    assert len(cache) == 2
+    assert cache.get('x + 1') is first
+    misses = cache.stats()['misses']
+    cache.get('x + 2')
+    assert cache.stats()['misses'] == misses + 1
+
+def test_syntax_errors_point_into_the_typed_text_and_are_not_cached():
+    cache = ExpressionCache()
+    with pytest.raises(SyntaxError) as raised:
+        cache.get('  1 +  * 2')
+    assert raised.value.position == 7
+    assert len(cache) == 0
@@ -0,0 +1,26 @@
+import math
+import warnings
+import pytest
+import functions
+from functions import parse, evaluate
+from budget import EvaluationBudget
+from quadrature import IntegralWarning
+
+def test_nested_integrals_share_one_budget():
+    with EvaluationBudget(None, None) as budget:
+        with pytest.warns(IntegralWarning):
+            value = evaluate(parse('integral(y, 0, 1, integral(x, 0, 10, floor(x + y)))'))
+    assert math.isclose(value, 50, rel_tol=1e-4)
+    assert sum(budget.where.values()) <= functions.IntegralNestedMaxEvaluations
+
+def test_unconverged_integral_warns():
+    with pytest.warns(IntegralWarning) as record:
+        value = evaluate(parse('integral(x, 0, 1, sin(1/x))'))
+    assert math.isclose(value, 0.504067, rel_tol=1e-3)
+    assert not record[0].message.result.converged
+
+def test_converged_integrals_do_not_warn():
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        assert evaluate(parse('integral(z, 0, 1, integral(y, 0, 1, integral(x, 0, 1, x + y + z)))')) == 1.5
+        assert math.isclose(evaluate(parse('integral(x, 0, pi, sin(x))')), 2)
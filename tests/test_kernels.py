@@ -0,0 +1,55 @@
+import math
+import pytest
+import kernels
+from functions import parse, evaluate
+
+# The reference kernels are series truncated after ESCPrecision terms, good to
+# about 1e-4 over these arguments
+VALUE_TOLERANCE = 1e-4
+
+CORPUS = [
+    'x^2 + 3*x - 1', '2^10', '(x + 1)^3 / (x - 2)', 'sin(x) * cos(x)', 'tg(x / 4)', 'ctg(x / 4)',
+    'arctg(x)', 'arcctg(x)', 'arcsin(x / 4)', 'arccos(x / 4)', 'logarithm(2, 1024)', 'logarithm(x)',
+    'logarithm(10, x^3)', 'factorial(10)', 'factorial(20) / factorial(18)', 'floor(x) + ceiling(x)',
+    'floor(-x)', 'absolute(-x)', '-x^2', 'e^x', '2^0.5', 'x^1.5', 'sum(k, 1, 20, 1/k^2)',
+    'product(k, 1, 10, k)', 'sum(k, 0, inf, 0.5^k)', 'integral(t, 0, 1, t^2)', 'integral(t, 0, x, sin(t))',
+    'lim(t, 0, sin(t)/t)',
+]
+
+# Poles are tested where both backends see them: the reference cos(pi/2) is
+# 5e-7, not small enough for tg() to reject
+ERRORS = [
+    '1/0', 'x/(x - x)', 'logarithm(0)', 'logarithm(-1)', 'logarithm(x, 0)', 'logarithm(1, 5)', 'arcsin(2)',
+    'arccos(-1.5)', 'factorial(-1)', 'ctg(0)', '0^(-1)', '(-8)^(1/3)', 'foo(1)', 'sum(k, 1, inf, 1)',
+]
+
+def _outcome(expr, x, backend):
+    try:
+        return evaluate(parse(expr), {'x': x}, backend=backend)
+    except Exception as e:
+        return e
+
+@pytest.mark.parametrize('expr', CORPUS)
+@pytest.mark.parametrize('x', [-1.3, 0.5, 1.7])
+def test_backends_agree(expr, x):
+    reference = _outcome(expr, x, 'reference')
+    fast = _outcome(expr, x, 'fast')
+    if isinstance(reference, Exception) or isinstance(fast, Exception):
+        assert (type(reference), str(reference)) == (type(fast), str(fast))
+    else:
+        assert math.isclose(reference, fast, rel_tol=VALUE_TOLERANCE, abs_tol=1e-12)
+
+@pytest.mark.parametrize('expr', ERRORS)
+def test_backends_raise_the_same_errors(expr):
+    reference = _outcome(expr, 2.0, 'reference')
+    fast = _outcome(expr, 2.0, 'fast')
+    assert isinstance(reference, Exception) and isinstance(fast, Exception)
+    assert (type(reference), str(reference)) == (type(fast), str(fast))
+
+def test_cross_check():
+    comparisons = {comparison.kernel: comparison for comparison in kernels.cross_check(samples=200)}
+    assert all(comparison.mismatched_errors == 0 for comparison in comparisons.values())
+    for name in ('factorial', 'floor', 'ceiling'):
+        assert comparisons[name].max_abs_error == 0
+    for name in ('logarithm', 'arctg', 'arcctg'):
+        assert comparisons[name].max_rel_error < 1e-12
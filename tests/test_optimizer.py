@@ -0,0 +1,16 @@
+from functions import parse, evaluate, NegateNode, VariableNode, NumberNode
+from optimizer import optimize
+from ast_tools import walk
+
+def test_optimizes_a_tree_holding_a_negate_node():
+    once = optimize(parse('-x+2'))
+    assert any(isinstance(node, NegateNode) for node in walk(once))
+    twice = optimize(once)
+    assert evaluate(twice, {'x': 5.0}) == evaluate(parse('-x+2'), {'x': 5.0})
+
+def test_double_negation_cancels():
+    assert isinstance(optimize(NegateNode(NegateNode(VariableNode('x')))), VariableNode)
+
+def test_negated_number_is_folded():
+    folded = optimize(NegateNode(NumberNode(3.0)))
+    assert isinstance(folded, NumberNode) and folded.value == -3.0
@@ -0,0 +1,71 @@
+import threading
+import time
+import numpy as np
+import pytest
+import functions
+import parallel
+from functions import parse, evaluate
+from compiler import integrand_points
+from graphing_utilities import sample_plots
+from budget import EvaluationBudget, BudgetExceeded, EvaluationCancelled
+
+@pytest.fixture(scope='module', autouse=True)
+def pool():
+    yield
+    parallel.shutdown()
+
+@pytest.fixture
+def pooled_runs(monkeypatch):
+    """Forces work onto a pool of two workers, recording the functions run there"""
+    monkeypatch.setattr(functions, 'ParallelWorkers', 2)
+    monkeypatch.setattr(parallel, 'MIN_CHUNK', 4)
+    calls = []
+    run = parallel.run
+    def recording_run(fn, arg_lists):
+        calls.append(fn.__name__)
+        return run(fn, arg_lists)
+    monkeypatch.setattr(parallel, 'run', recording_run)
+    return calls
+
+def _both_ways(monkeypatch, compute):
+    monkeypatch.setattr(functions, 'ParallelMode', 'serial')
+    serial = compute()
+    monkeypatch.setattr(functions, 'ParallelMode', 'parallel')
+    return serial, compute()
+
+def test_plots_match_serial(monkeypatch, pooled_runs):
+    asts = [parse('sin(x) / x'), parse('sum(k, 1, 20, cos(k * x) / k)')]
+    serial, pooled = _both_ways(monkeypatch, lambda: sample_plots(asts, -6, 6, -3, 3))
+    assert 'sample_functions' in pooled_runs
+    for a, b in zip(serial, pooled):
+        np.testing.assert_array_equal(a, b)
+
+def test_aggregates_match_serial(monkeypatch, pooled_runs):
+    ast = parse('sum(k, 1, 100000, sin(k) / k)')
+    serial, pooled = _both_ways(monkeypatch, lambda: evaluate(ast))
+    assert 'chunk_part' in pooled_runs
+    assert serial == pooled
+
+def test_integral_points_match_serial(monkeypatch, pooled_runs):
+    ast = parse('integral(t, 0, 3, sin(t) * sum(k, 1, 30, cos(k * t) / k^2))')
+    serial, pooled = _both_ways(monkeypatch, lambda: evaluate(ast))
+    assert 'integrand_points' in pooled_runs
+    assert serial == pooled
+
+def _points(count):
+    # Every point runs a 200-term loop, below the fast path threshold
+    return [(parse('sum(k, 1, 200, sin(k * t))'), 't', {}, list(np.linspace(0, 1, count)), 'fast', None)]
+
+def test_budget_reaches_workers(pooled_runs):
+    with pytest.raises(BudgetExceeded):
+        with EvaluationBudget(max_steps=10000):
+            parallel.run(integrand_points, _points(1000))
+
+def test_cancelled_budget_stops_pooled_run(pooled_runs):
+    parallel.run(integrand_points, _points(1))
+    started = time.perf_counter()
+    with pytest.raises(EvaluationCancelled):
+        with EvaluationBudget() as budget:
+            threading.Timer(0.2, budget.cancel).start()
+            parallel.run(integrand_points, _points(20000) * 2)
+    assert time.perf_counter() - started < 2.0
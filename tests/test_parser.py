@@ -0,0 +1,25 @@
+import itertools
+import pytest
+from functions import parse, parse_many, evaluate, ASTNode
+
+@pytest.mark.parametrize('expr, position', [
+    ('1 + * 2', 4), ('sin(x', 5), ('2 $ 3', 2), ('1 +', 3), ('(1 + 2))', 7), ('sum(k, 1)', 8), ('a b', 2),
+])
+def test_errors_point_at_the_offending_character(expr, position):
+    [(text, error)] = parse_many([expr])
+    assert text == expr
+    assert isinstance(error, (SyntaxError, RuntimeError))
+    assert error.position == position
+    assert str(error).endswith(f'at position {position}')
+
+def test_parse_many_keeps_going_past_errors():
+    results = list(parse_many(['x + 1', '1 +', ' 2 * x ', '']))
+    assert [text for text, _ in results] == ['x + 1', '1 +', ' 2 * x ', '']
+    assert isinstance(results[0][1], ASTNode) and isinstance(results[2][1], ASTNode)
+    assert evaluate(results[2][1], {'x': 4}) == evaluate(parse('2 * x'), {'x': 4}) == 8
+    assert results[1][1].position == 3 and results[3][1].position == 0
+
+def test_parse_many_is_lazy():
+    expressions = (f'x + {i}' for i in itertools.count())
+    first = list(itertools.islice(parse_many(expressions), 3))
+    assert [evaluate(ast, {'x': 1}) for _, ast in first] == [1, 2, 3]
@@ -0,0 +1,11 @@
+import numpy as np
+from functions import parse
+from graphing_utilities import sample_plots
+
+def test_reference_kernels_are_not_pruned_by_exact_bounds():
+    # The reference arcsin(1) is 1.339, outside the exact range of arcsin
+    x, y = sample_plots([parse('arcsin(x)')], 0.999, 1, 1.30, 1.40, backend='reference')
+    assert np.isfinite(y).any()
+    x, y = sample_plots([parse('arcsin(x)')], 0.999, 1, 1.30, 1.40, backend='reference',
+                        cache_key=(('arcsin(x)', 'reference'),))
+    assert np.isfinite(y).any()
@@ -0,0 +1,44 @@
+import math
+import pytest
+from functions import parse, evaluate
+from compiler import compile, MAX_CLOSURE_DEPTH
+from ast_tools import depth
+import postfix
+
+def nested(template, inner, levels):
+    """template applied levels times around inner, e.g. nested('sin({})', 'x', 3) = sin(sin(sin(x)))"""
+    for _ in range(levels):
+        inner = template.format(inner)
+    return inner
+
+@pytest.mark.parametrize('template', [
+    '({} + x * 0.5)', '-({} / 1.001)', 'sin({})', 'logarithm(2, absolute({}) + 3)', '(sum(i, 1, 3, i * x) - {})',
+])
+def test_deep_trees_match_evaluate(template):
+    ast = parse(nested(template, 'x', MAX_CLOSURE_DEPTH + 50))
+    assert depth(ast) > MAX_CLOSURE_DEPTH
+    f = compile(ast)
+    for x in [-0.7, 0.3, 2.0]:
+        assert f({'x': x}) == evaluate(ast, {'x': x}) == postfix.run(postfix.flatten(ast), {'x': x})
+
+def test_trees_too_deep_to_recurse():
+    ast = parse(nested('({} + 1)', 'x', 5000))
+    assert compile(ast)({'x': 0.5}) == evaluate(ast, {'x': 0.5}) == 5000.5
+    tower = parse(nested('1.0001^{}', '1', 3000))
+    expected = 1.0
+    for _ in range(3000):
+        expected = 1.0001 ** expected
+    assert math.isclose(evaluate(tower), expected, rel_tol=1e-12)
+
+def test_deep_tree_errors_match_evaluate():
+    ast = parse(nested('({} + 1)', '1/x', MAX_CLOSURE_DEPTH + 50))
+    with pytest.raises(ZeroDivisionError):
+        compile(ast)({'x': 0})
+    with pytest.raises(ValueError, match="Variable 'x' not defined"):
+        compile(ast)()
+
+def test_program_layout():
+    program = postfix.flatten(parse('2 * (x + 1) - sin(x)'))
+    assert [line.split()[0] for line in program.listing()] == [
+        'CONST', 'LOAD', 'CONST', 'BINARY', 'BINARY', 'LOAD', 'CALL1', 'BINARY']
+    assert program.max_stack == 3
@@ -0,0 +1,33 @@
+import functions
+import result_cache
+from functions import parse
+
+def test_library_keeps_results_in_memory_only(monkeypatch):
+    monkeypatch.setattr(functions, 'ResultCacheEnabled', True)
+    cache = result_cache.get_cache()
+    assert cache.path is None
+    assert result_cache.cached('value', [parse('1 + 2')], lambda: {'result': 3}) == {'result': 3}
+    assert result_cache.cached('value', [parse('(1) + 2')], lambda: {'result': 0}) == {'result': 3}
+
+def test_disk_tier_is_shared_by_caches_on_one_file(tmp_path):
+    path = str(tmp_path / 'results.sqlite3')
+    key = result_cache.result_key('value', [parse('x^2')], params=(('x', 2),))
+    writer = result_cache.ResultCache(path)
+    writer.put(key, {'result': 4})
+    writer.close()
+    reader = result_cache.ResultCache(path)
+    assert reader.get(key) == {'result': 4}
+    assert reader.stats()['disk_hits'] == 1
+    reader.close()
+
+def test_version_covers_the_ast_helpers(monkeypatch):
+    opened = []
+    real_open = open
+    def recording_open(path, *args, **kwargs):
+        opened.append(str(path))
+        return real_open(path, *args, **kwargs)
+    monkeypatch.setattr(result_cache, '_version', None)
+    monkeypatch.setattr('builtins.open', recording_open)
+    result_cache.cache_version()
+    names = {path.replace('\\', '/').rsplit('/', 1)[-1] for path in opened}
+    assert {'ast_tools.py', 'cost.py', 'parallel.py', 'budget.py', 'compiler.py'} <= names
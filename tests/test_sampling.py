@@ -0,0 +1,53 @@
+import math
+import numpy as np
+import pytest
+from sampling import adaptive_sample, INITIAL_POINTS
+
+CURVES = {
+    'tan': (np.tan, -3, 3),
+    'reciprocal': (lambda x: 1 / x, -2, 3),
+    'steep': (lambda x: 4 * np.arctan(20 * x), -3, 3),
+    'oscillating': (lambda x: np.sin(1 / x), -1, 1),
+}
+
+def counted(f):
+    """f, and a list of the number of points of each call"""
+    calls = []
+    def g(x):
+        calls.append(len(x))
+        with np.errstate(all='ignore'):
+            return f(x)
+    return g, calls
+
+@pytest.mark.parametrize('name', CURVES)
+@pytest.mark.parametrize('max_points', [50, 300, 2000])
+def test_evaluations_stay_within_the_point_budget(name, max_points):
+    f, x_min, x_max = CURVES[name]
+    g, calls = counted(f)
+    result = adaptive_sample(g, x_min, x_max, max_points, -8, 8)
+    assert sum(calls) == result.evaluations <= max_points
+    assert np.all(np.diff(result.x[np.isfinite(result.x)]) > 0)
+
+def test_smooth_curves_stop_early():
+    g, calls = counted(lambda x: 2 * x + 1)
+    result = adaptive_sample(g, -10, 10, 5000, -8, 8)
+    assert result.evaluations == sum(calls) == INITIAL_POINTS
+
+@pytest.mark.parametrize('name, poles', [('tan', [-math.pi / 2, math.pi / 2]), ('reciprocal', [0.0])])
+def test_poles_are_broken(name, poles):
+    f, x_min, x_max = CURVES[name]
+    result = adaptive_sample(counted(f)[0], x_min, x_max, 2000, -8, 8)
+    assert np.allclose(result.breaks, poles, atol=1e-6)
+    for x in result.breaks:
+        assert np.isnan(result.y[result.x == x]).all()
+
+def test_steep_continuous_curves_are_not_broken():
+    f, x_min, x_max = CURVES['steep']
+    result = adaptive_sample(counted(f)[0], x_min, x_max, 2000, -8, 8)
+    assert len(result.breaks) == 0 and np.isfinite(result.y).all()
+
+def test_several_curves_share_a_grid_and_break_separately():
+    result = adaptive_sample(counted(lambda x: np.array([np.tan(x), x]))[0], -3, 3, 2000, -8, 8)
+    assert result.y.shape == (2, len(result.x))
+    assert np.allclose(result.breaks, [-math.pi / 2, math.pi / 2], atol=1e-6)
+    assert np.isnan(result.y[0]).sum() == 2 and np.isfinite(result.y[1]).all()
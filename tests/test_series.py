@@ -0,0 +1,26 @@
+import math
+import pytest
+from functions import parse, evaluate
+from series import SeriesDivergence, SeriesWarning
+
+def test_slowly_convergent_series_are_summed():
+    # zeta(1.01) and zeta(1.05)
+    assert math.isclose(evaluate(parse('sum(n, 1, inf, 1/n^1.01)')), 100.5779433, rel_tol=1e-6)
+    assert math.isclose(evaluate(parse('sum(n, 1, inf, 1/n^1.05)')), 20.5808443, rel_tol=1e-6)
+
+@pytest.mark.parametrize('expr', ['sum(n, 1, inf, 1/n)', 'sum(n, 1, inf, 1/n^0.99)', 'sum(n, 1, inf, 1/(n + 1))'])
+def test_divergent_series_raise(expr):
+    with pytest.raises(SeriesDivergence):
+        evaluate(parse(expr))
+
+def test_series_out_of_terms_warn(monkeypatch):
+    import functions
+    monkeypatch.setattr(functions, 'SeriesMaxTerms', 32)
+    with pytest.warns(SeriesWarning) as record:
+        value = evaluate(parse('sum(n, 1, inf, 1/n^2) + product(n, 2, inf, 1 - 1/n^2)'))
+    assert math.isclose(value, math.pi ** 2 / 6 + 0.5, rel_tol=1e-2)
+    assert not any(warning.message.result.converged for warning in record)
+
+def test_converged_series_do_not_warn(recwarn):
+    assert math.isclose(evaluate(parse('sum(n, 0, inf, 0.5^n)')), 2.0)
+    assert not [warning for warning in recwarn if issubclass(warning.category, SeriesWarning)]
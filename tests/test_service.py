@@ -0,0 +1,19 @@
+import math
+import service
+
+def test_bindings_of_constants_are_honoured():
+    response = service.handle({'expr': 'e*2', 'variables': {'e': 3}})
+    assert response['ok'], response
+    assert response['result'] == 6
+    response = service.handle({'expr': 'e*2'})
+    assert math.isclose(response['result'], 2 * math.e)
+
+def test_batch_rows_binding_constants():
+    response = service.handle({'mode': 'batch', 'expr': 'pi + x', 'rows': [{'x': 1}, {'x': 1, 'pi': 3}]})
+    assert response['ok'], response
+    assert math.isclose(response['results'][0], math.pi + 1)
+    assert response['results'][1] == 4
+
+def test_bindings_of_unread_constants_keep_the_optimized_tree():
+    response = service.handle({'expr': 'x*2', 'variables': {'x': 2, 'e': 3}})
+    assert response['result'] == 4
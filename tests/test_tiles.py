@@ -0,0 +1,32 @@
+import numpy as np
+from functions import parse
+from compiler import compile
+from tiles import Viewport, TileCache, sample_viewport, y_window, y_windows
+
+def _sampler(expr):
+    f = compile(parse(expr))
+    return lambda xs: np.array([f({'x': float(x)}) for x in xs])
+
+def test_windows_hold_the_viewport():
+    for viewport in (Viewport(), Viewport(-3, 7, 0.1, 0.2), Viewport(0, 1, -1e3, 5)):
+        for window in y_windows(viewport):
+            y_min, y_max = y_window(*window)
+            assert y_min <= viewport.y_min and viewport.y_max <= y_max
+
+def test_vertical_pans_and_zooms_reuse_tiles():
+    cache = TileCache()
+    f = _sampler('sin(x) * x')
+    viewport = Viewport()
+    first = sample_viewport('curve', f, viewport, 800, cache=cache)
+    assert first.sampled == first.tiles
+    for moved in (viewport.pan(dy=0.25), viewport.pan(dy=-0.25), Viewport(-10, 10, -4, 4)):
+        assert sample_viewport('curve', f, moved, 800, cache=cache).sampled == 0
+    sideways = sample_viewport('curve', f, viewport.pan(dx=0.25), 800, cache=cache)
+    assert 0 < sideways.sampled < sideways.tiles
+
+def test_tiles_cover_the_viewport():
+    cache = TileCache()
+    viewport = Viewport(-2, 2, -1, 1)
+    samples = sample_viewport('sin', _sampler('sin(x)'), viewport, 400, cache=cache)
+    assert samples.x[0] <= viewport.x_min and samples.x[-1] >= viewport.x_max
+    assert np.allclose(samples.y, np.sin(samples.x))
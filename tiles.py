@@ -0,0 +1,218 @@
+import math
+import threading
+from collections import OrderedDict
+import numpy as np
+from sampling import adaptive_sample, INITIAL_POINTS
+
+# Tiled, cached sampling of plots.
+#
+# The x axis is cut into tiles of width 2^level, and each tile is sampled on
+# its own with sampling.adaptive_sample(). The level follows the viewport: at
+# least TILES_PER_VIEW tiles span its width, so zooming in switches to finer
+# tiles with their own point budget.
+#
+# Sampling adapts to the y window, so tiles are sampled for a window of
+# Y_BANDS bands of height 2^y_level, the largest power of two not above the
+# viewport's height, starting one band below the viewport's. Any cached tile
+# whose window holds the viewport, at its y level or the next coarser one, is
+# reused: panning, vertically as well as sideways, only samples the tiles
+# that came into view or moved out of their window, zooming in vertically
+# samples nothing, and returning to an earlier view samples nothing. Points
+# outside the viewport are clipped by the caller.
+#
+# The cache is process-wide, like the expression cache, and bounded by the
+# memory of the sampled arrays: MAX_CACHED_BYTES in total, at most MAX_TILES
+# tiles, least recently used evicted first.
+
+TILES_PER_VIEW = 8
+MAX_TILES = 4096
+MAX_CACHED_BYTES = 1 << 25
+# A tile starts from its share of the initial grid of a whole plot
+TILE_INITIAL_POINTS = INITIAL_POINTS // TILES_PER_VIEW + 1
+MIN_TILE_POINTS = TILE_INITIAL_POINTS
+# Bands of the y window a tile is sampled for
+Y_BANDS = 4
+# Zoom and pan steps of the UI
+ZOOM_FACTOR = 2.0
+PAN_FRACTION = 0.25
+
+class Viewport:
+    def __init__(self, x_min=-10.0, x_max=10.0, y_min=-8.0, y_max=8.0):
+        if not x_min < x_max or not y_min < y_max:
+            raise ValueError("Viewport bounds must satisfy x_min < x_max and y_min < y_max")
+        self.x_min = float(x_min)
+        self.x_max = float(x_max)
+        self.y_min = float(y_min)
+        self.y_max = float(y_max)
+
+    @property
+    def width(self) -> float:
+        return self.x_max - self.x_min
+
+    @property
+    def height(self) -> float:
+        return self.y_max - self.y_min
+
+    def zoom(self, factor):
+        """The viewport scaled by 1 / factor around its centre: factor > 1 zooms in"""
+        x_mid = (self.x_min + self.x_max) / 2
+        y_mid = (self.y_min + self.y_max) / 2
+        half_width = self.width / factor / 2
+        half_height = self.height / factor / 2
+        return Viewport(x_mid - half_width, x_mid + half_width, y_mid - half_height, y_mid + half_height)
+
+    def pan(self, dx=0.0, dy=0.0):
+        """The viewport moved by dx widths and dy heights"""
+        return Viewport(self.x_min + dx * self.width, self.x_max + dx * self.width,
+                        self.y_min + dy * self.height, self.y_max + dy * self.height)
+
+    def bounds(self) -> tuple:
+        return self.x_min, self.x_max, self.y_min, self.y_max
+
+    def __repr__(self):
+        return f'Viewport(x=[{self.x_min:g}, {self.x_max:g}], y=[{self.y_min:g}, {self.y_max:g}])'
+
+class Tile:
+    def __init__(self, level, index, samples):
+        self.level = level
+        self.index = index
+        self.x = samples.x
+        self.y = samples.y
+        self.evaluations = samples.evaluations
+
+    @property
+    def nbytes(self) -> int:
+        return self.x.nbytes + self.y.nbytes
+
+    def __repr__(self):
+        return f'Tile(level={self.level}, index={self.index}, points={len(self.x)})'
+
+class TileCache:
+    def __init__(self, maxsize=MAX_TILES, max_bytes=MAX_CACHED_BYTES):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """The cached tile for key, or None"""
+        return self.find([key])
+
+    def find(self, keys):
+        """The cached tile for the first of keys that has one, or None"""
+        with self._lock:
+            for key in keys:
+                tile = self._tiles.get(key)
+                if tile is not None:
+                    self._tiles.move_to_end(key)
+                    self.hits += 1
+                    return tile
+            self.misses += 1
+            return None
+
+    def put(self, key, tile):
+        if tile.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._tiles:
+                return
+            self._tiles[key] = tile
+            self.nbytes += tile.nbytes
+            while len(self._tiles) > self.maxsize or self.nbytes > self.max_bytes:
+                _, evicted = self._tiles.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._tiles.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'tiles': len(self._tiles),
+                'maxsize': self.maxsize,
+                'bytes': self.nbytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._tiles)
+
+tile_cache = TileCache()
+
+class TiledSamples:
+    def __init__(self, x, y, tiles, sampled, evaluations):
+        self.x = x
+        self.y = y
+        # Tiles covering the viewport, and how many of them had to be sampled
+        self.tiles = tiles
+        self.sampled = sampled
+        # Evaluations spent on the newly sampled tiles
+        self.evaluations = evaluations
+
+    def __repr__(self):
+        return (f'TiledSamples(tiles={self.tiles}, sampled={self.sampled}, '
+                f'evaluations={self.evaluations})')
+
+def tile_level(width) -> int:
+    """Level of the tiles for a viewport width: the largest 2^level fitting TILES_PER_VIEW times"""
+    return math.floor(math.log2(width / TILES_PER_VIEW))
+
+def tile_points(max_points, width, level) -> int:
+    """Point budget of one tile, so that the tiles overlapping a viewport share max_points"""
+    tile_width = 2.0 ** level
+    return max(MIN_TILE_POINTS, int(max_points * tile_width / (width + tile_width)))
+
+def y_window(y_level, band) -> tuple:
+    """(y_min, y_max) of the window a tile is sampled for"""
+    height = 2.0 ** y_level
+    return (band - 1) * height, (band + Y_BANDS - 1) * height
+
+def y_windows(viewport) -> list:
+    """(y level, band) of every window holding the viewport, the one to sample a new tile for first"""
+    level = math.floor(math.log2(viewport.height))
+    windows = [(level, math.floor(viewport.y_min / 2.0 ** level))]
+    for y_level in (level, level + 1):
+        height = 2.0 ** y_level
+        lowest = math.ceil(viewport.y_max / height) - Y_BANDS + 1
+        for band in range(lowest, math.floor(viewport.y_min / height) + 2):
+            if (y_level, band) not in windows:
+                windows.append((y_level, band))
+    return windows
+
+def sample_viewport(key, f, viewport, max_points, bound=None, cache=tile_cache) -> TiledSamples:
+    """Sample f over viewport from cached tiles, sampling only the missing ones.
+
+    key identifies the function, e.g. its normalized text and kernel backend;
+    f and bound are as for sampling.adaptive_sample(), including several
+    curves on one grid.
+    """
+    level = tile_level(viewport.width)
+    tile_width = 2.0 ** level
+    points = tile_points(max_points, viewport.width, level)
+    first = math.floor(viewport.x_min / tile_width)
+    last = math.ceil(viewport.x_max / tile_width) - 1
+    windows = y_windows(viewport)
+    y_min, y_max = y_window(*windows[0])
+    xs, ys = [], []
+    sampled = evaluations = 0
+    for index in range(first, last + 1):
+        tile = cache.find([(key, level, index) + window + (points,) for window in windows])
+        if tile is None:
+            samples = adaptive_sample(f, index * tile_width, (index + 1) * tile_width, points,
+                                      y_min, y_max, bound, TILE_INITIAL_POINTS)
+            tile = Tile(level, index, samples)
+            cache.put((key, level, index) + windows[0] + (points,), tile)
+            sampled += 1
+            evaluations += tile.evaluations
+        xs.append(tile.x)
+        ys.append(tile.y)
+    return TiledSamples(np.concatenate(xs), np.concatenate(ys, axis=-1), last - first + 1, sampled, evaluations)
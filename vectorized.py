@@ -0,0 +1,406 @@
+import math
+import weakref
+import numpy as np
+import quadrature
+import kernels
+import factorials
+from budget import current_budget, BudgetExceeded
+from functions import (
+    NumberNode, VariableNode, BinaryOpNode, NegateNode, FunctionCallNode,
+    SigmaSumNode, ProductNode, IntegralNode, LimitNode, CONSTANTS
+)
+from ast_tools import (
+    walk, children, is_expensive, free_variables, bound_variables, binding_variable, node_label, structural_key
+)
+
+# Vectorized evaluation engine.
+#
+# Evaluates an AST for whole NumPy arrays of variable values at once. The
+# formulas mirror the scalar kernels of the selected backend; points where the
+# scalar engine would raise a domain error come back as NaN instead.
+#
+# Inside sums and products, expensive subtrees that do not depend on the loop
+# are evaluated on the first iteration and reused afterwards. Integrals and
+# infinite series are left to the scalar engine, whose results adapt to each
+# point.
+#
+# evaluate_arrays() evaluates several ASTs for the same variables, computing
+# each expensive subtree that occurs more than once outside any loop body only
+# once, whichever AST it appears in.
+#
+# Each scalar kernel backend (see kernels.py) has a matching table of array
+# kernels in ARRAY_KERNELS.
+
+class NotVectorizable(ValueError):
+    """Raised for constructs that only the scalar evaluate() can handle"""
+    pass
+
+# n! for every n whose factorial fits in a float
+_FACTORIALS = np.array(factorials.FLOAT_FACTORIALS)
+
+def evaluate_array(node, variables=None, backend=None):
+    """Evaluate node where any variable may be bound to a NumPy array.
+
+    The result is a float array broadcast against all array-valued variables
+    (or a 0-d array when every variable is a scalar). backend selects the
+    kernels as in evaluate(); backends without array kernels raise
+    NotVectorizable.
+    """
+    return _evaluate_array(node, variables, backend, None)
+
+def _evaluate_array(node, variables, backend, shared):
+    if variables is None:
+        variables = {}
+    shape = np.broadcast_shapes(*(np.shape(v) for v in variables.values()))
+    name = kernels.get_backend(backend).name
+    if name not in ARRAY_KERNELS:
+        raise NotVectorizable(f"No array kernels for the {name!r} backend")
+    variables = dict(variables)
+    variables[_KERNELS] = ARRAY_KERNELS[name]
+    if shared is not None:
+        variables[_SHARED] = shared
+    with np.errstate(all='ignore'):
+        result = _eval(node, variables)
+        return np.broadcast_to(np.asarray(result, dtype=float), shape).copy()
+
+def evaluate_arrays(nodes, variables=None, backend=None) -> list:
+    """evaluate_array() of every node in nodes, sharing common subexpressions.
+
+    Returns one entry per node: its array, or the exception its evaluation
+    raised, so that one failing node does not stop the others. Only
+    BudgetExceeded propagates.
+    """
+    # (structural keys by subtree id, values by key)
+    shared = (_shared_subtrees(nodes), {})
+    results = []
+    for node in nodes:
+        try:
+            results.append(_evaluate_array(node, variables, backend, shared))
+        except BudgetExceeded:
+            raise
+        except Exception as e:
+            results.append(e)
+    return results
+
+def _outer_subtrees(node):
+    """Yield node and its descendants outside the bodies of sums, products, integrals and limits"""
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        yield current
+        body = current.expr if binding_variable(current) is not None else None
+        stack.extend(child for child in reversed(children(current)) if child is not body)
+
+def _shared_subtrees(nodes) -> dict:
+    """Structural keys by id of the expensive outer subtrees occurring more than once"""
+    table, keys, expensive = {}, {}, {}
+    occurrences = {}
+    for node in nodes:
+        for subtree in _outer_subtrees(node):
+            if is_expensive(subtree, expensive):
+                key = structural_key(subtree, table, keys)
+                occurrences.setdefault(key, []).append(id(subtree))
+    return {i: key for key, ids in occurrences.items() if len(ids) > 1 for i in ids}
+
+# Scope key holding the subtrees shared by the nodes of evaluate_arrays() and their values
+_SHARED = object()
+# Scope key holding the memo tables of every enclosing loop
+_MEMO = object()
+# Scope key holding the array kernels in use
+_KERNELS = object()
+
+_invariants = weakref.WeakKeyDictionary()
+
+def _invariant_ids(node) -> frozenset:
+    """ids of the expensive subtrees of a loop body that the loop cannot change"""
+    try:
+        return _invariants[node]
+    except KeyError:
+        pass
+    free, bound, expensive = {}, {}, {}
+    shadowed = bound_variables(node.expr, bound)
+    if binding_variable(node) is not None:
+        shadowed = shadowed | {binding_variable(node)}
+    ids = frozenset(
+        id(n) for n in walk(node.expr)
+        if is_expensive(n, expensive) and not free_variables(n, free) & shadowed)
+    _invariants[node] = ids
+    return ids
+
+def _loop_scope(node, variables):
+    """Copy of variables for evaluating node's body, with a fresh memo table"""
+    scope = dict(variables)
+    # Shared subtrees never occur inside loop bodies
+    scope.pop(_SHARED, None)
+    ids = _invariant_ids(node)
+    if ids:
+        scope[_MEMO] = variables.get(_MEMO, ()) + ((ids, {}),)
+    return scope
+
+def _eval(node, variables):
+    shared = variables.get(_SHARED)
+    if shared is not None:
+        key = shared[0].get(id(node))
+        if key is not None:
+            values = shared[1]
+            if key not in values:
+                values[key] = _eval_node(node, variables)
+            return values[key]
+    memos = variables.get(_MEMO)
+    if memos:
+        key = id(node)
+        for ids, values in memos:
+            if key in ids:
+                if key not in values:
+                    values[key] = _eval_node(node, variables)
+                return values[key]
+    return _eval_node(node, variables)
+
+def _eval_node(node, variables):
+    if isinstance(node, NumberNode):
+        return node.value
+    elif isinstance(node, VariableNode):
+        lname = node.name.lower()
+        if lname in variables:
+            return variables[lname]
+        elif lname in CONSTANTS:
+            return CONSTANTS[lname]
+        else:
+            raise ValueError(f"Variable '{node.name}' not defined")
+    elif isinstance(node, BinaryOpNode):
+        left = np.asarray(_eval(node.left, variables), dtype=float)
+        right = np.asarray(_eval(node.right, variables), dtype=float)
+        if node.op == '+':
+            return left + right
+        elif node.op == '-':
+            return left - right
+        elif node.op == '*':
+            return left * right
+        elif node.op == '/':
+            return np.where(right == 0, np.nan, left / right)
+        elif node.op == '^':
+            return variables[_KERNELS].power(left, right)
+        else:
+            raise ValueError(f"Unknown operator: {node.op}")
+    elif isinstance(node, NegateNode):
+        return -np.asarray(_eval(node.operand, variables), dtype=float)
+    elif isinstance(node, FunctionCallNode):
+        args = [np.asarray(_eval(arg, variables), dtype=float) for arg in node.args]
+        fname = node.func_name.lower()
+        array_kernels = variables[_KERNELS]
+        if fname in array_kernels.trig_funcs:
+            if len(args) != 1:
+                raise ValueError(f'{fname} expects 1 argument')
+            return array_kernels.trig_funcs[fname](args[0])
+        elif fname == 'logarithm':
+            if len(args) == 1:
+                return array_kernels.logarithm(math.e, args[0])
+            elif len(args) == 2:
+                return array_kernels.logarithm(args[0], args[1])
+            else:
+                raise ValueError('logarithm expects 1 or 2 arguments')
+        elif fname == 'absolute':
+            return np.abs(args[0])
+        elif fname == 'factorial':
+            return array_kernels.factorial(args[0])
+        elif fname == 'floor':
+            # functions.floor rounds toward zero
+            return np.trunc(args[0])
+        elif fname == 'ceiling':
+            return np.ceil(args[0])
+        else:
+            raise ValueError(f"Unknown function: {fname}")
+    elif isinstance(node, (SigmaSumNode, ProductNode)):
+        return _eval_aggregate(node, variables)
+    elif isinstance(node, IntegralNode):
+        # A fixed rule would differ from the adaptive scalar integral, with no error estimate
+        raise NotVectorizable("Integrals are integrated adaptively point by point")
+    elif isinstance(node, LimitNode):
+        return _eval_limit(node, variables)
+    else:
+        raise ValueError(f"Unknown AST node: {type(node)}")
+
+def _eval_aggregate(node, variables):
+    var = node.var
+    if not isinstance(var, str):
+        raise NotVectorizable("Aggregate variable must be a name")
+    lower, upper = np.broadcast_arrays(
+        np.trunc(np.asarray(_eval(node.lower, variables), dtype=float)),
+        np.trunc(np.asarray(_eval(node.upper, variables), dtype=float)))
+    if (np.abs(lower) >= quadrature.INFINITE_BOUND).any() or (np.abs(upper) >= quadrature.INFINITE_BOUND).any():
+        raise NotVectorizable("Infinite series are summed term by term")
+    valid = np.isfinite(lower) & np.isfinite(upper)
+    if not valid.any():
+        return np.full(lower.shape, np.nan)
+    start = int(lower[valid].min())
+    stop = int(upper[valid].max())
+    is_sum = isinstance(node, SigmaSumNode)
+    acc = np.zeros(lower.shape) if is_sum else np.ones(lower.shape)
+    # Bounds may differ per element, so each index only counts where it lies
+    # inside that element's own range.
+    uniform = lower[valid].min() == lower[valid].max() and upper[valid].min() == upper[valid].max()
+    scope = _loop_scope(node, variables)
+    budget = current_budget()
+    where = node_label(node)
+    for i in range(start, stop + 1):
+        if budget is not None:
+            budget.tick(where)
+        scope[var] = i
+        term = _eval(node.expr, scope)
+        if not uniform:
+            inside = (lower <= i) & (i <= upper)
+            term = np.where(inside, term, 0.0 if is_sum else 1.0)
+        if is_sum:
+            acc = acc + term
+        else:
+            acc = acc * term
+    return np.where(valid, acc, np.nan)
+
+def _eval_limit(node, variables):
+    var = node.var
+    if not isinstance(var, str):
+        raise ValueError("First argument to limit must be a variable name")
+    to = np.asarray(_eval(node.to, variables), dtype=float)
+    eps = 1e-6
+    scope = dict(variables)
+    scope[var] = to - eps
+    left = np.asarray(_eval(node.expr, scope), dtype=float)
+    scope[var] = to + eps
+    right = np.asarray(_eval(node.expr, scope), dtype=float)
+    exists = (np.abs(left - right) < 1e-4) & (np.abs(left) < 1e10) & (np.abs(right) < 1e10)
+    return np.where(exists, (left + right) / 2, np.nan)
+
+# Array kernels
+
+def power(b, p):
+    b, p = np.broadcast_arrays(np.asarray(b, dtype=float), np.asarray(p, dtype=float))
+    result = np.power(b, p)
+    result = np.where(b == math.e, np.exp(p), result)
+    # 0^(negative power) and negative base with non-integer exponent
+    result = np.where((b == 0) & (p < 0), np.nan, result)
+    result = np.where((b < 0) & (p != np.trunc(p)), np.nan, result)
+    return np.where((b == 1) | (p == 0), 1.0, result)
+
+def logarithm(b, x):
+    b = np.asarray(b, dtype=float)
+    x = np.asarray(x, dtype=float)
+    log_b = np.log(b)
+    result = np.log(x) / np.where(log_b == 0, np.nan, log_b)
+    return np.where((x <= 0) | (b <= 0), np.nan, result)
+
+def factorial(x):
+    n = np.trunc(x)
+    index = np.clip(np.nan_to_num(n, nan=0.0), 0, len(_FACTORIALS) - 1).astype(int)
+    result = np.where(n > len(_FACTORIALS) - 1, np.inf, _FACTORIALS[index])
+    return np.where((n < 0) | np.isnan(n), np.nan, result)
+
+def _reduce_angle(x):
+    x = np.mod(x, 2 * math.pi)
+    return np.where(x > math.pi, x - 2 * math.pi, x)
+
+def sin(x):
+    x = _reduce_angle(x)
+    x2 = x*x
+    return x * (1 - x2 * (1/6 - x2 * (1/120 - x2 * (1/5040 - x2 * (1/362880 - x2 * (1/39916800))))))
+
+def cos(x):
+    x = _reduce_angle(x)
+    x2 = x * x
+    return 1 - x2 * (1/2 - x2 * (1/24 - x2 * (1/720 - x2 * (1/40320 - x2 * (1/3628800)))))
+
+def tg(x):
+    s = sin(x)
+    c = cos(x)
+    return np.where(np.abs(c) < 1e-10, np.nan, s / c)
+
+def ctg(x):
+    s = sin(x)
+    c = cos(x)
+    return np.where(np.abs(s) < 1e-10, np.nan, c / s)
+
+def arcsin(x):
+    x2 = x * x
+    result = x * (1 + x2 * (1/6 + x2 * (3/40 + x2 * (5/112 + x2 * (35/1152 + x2 * 63/2816)))))
+    return np.where(np.abs(x) > 1, np.nan, result)
+
+def arccos(x):
+    return math.pi / 2 - arcsin(x)
+
+_ARCTG_P = [
+    -8.750608600031904122785e-01,
+    -1.615753718733365076637e+01,
+    -7.500855792314704667340e+01,
+    -1.228866684490136173410e+02,
+    -6.485021904942025371773e+01,
+]
+
+_ARCTG_Q = [
+    2.485846490142306297962e+01,
+    1.650270098316988542046e+02,
+    4.328810604912902668951e+02,
+    4.853903996359136964868e+02,
+    1.945506571482613964425e+02,
+]
+
+def _arctg_core(x):
+    # Minimax rational approximation, valid for abs(x) <= 0.66
+    P, Q = _ARCTG_P, _ARCTG_Q
+    z = x * x
+    num = (((P[0]*z + P[1])*z + P[2])*z + P[3])*z + P[4]
+    den = ((((z + Q[0])*z + Q[1])*z + Q[2])*z + Q[3])*z + Q[4]
+    return x + x * z * num / den
+
+def arctg(x):
+    sign = np.where(x < 0, -1.0, 1.0)
+    a = np.abs(x)
+    mid = _arctg_core((a - 1) / (a + 1))
+    far = math.pi/2 - _arctg_core(1 / np.where(a == 0, 1.0, a))
+    result = np.where(a <= 0.66, _arctg_core(a),
+                      np.where(a <= 2.414213562373095, math.pi/4 + mid, far))
+    return sign * result
+
+def arcctg(x):
+    return math.pi / 2 - arctg(x)
+
+TRIG_FUNCS = {
+    'sin': sin, 'cos': cos, 'tg': tg, 'ctg' : ctg,
+    'arcsin': arcsin, 'arccos': arccos, 'arctg': arctg, 'arcctg' : arcctg
+}
+
+def fast_tg(x):
+    c = np.cos(x)
+    return np.where(np.abs(c) < 1e-10, np.nan, np.sin(x) / c)
+
+def fast_ctg(x):
+    s = np.sin(x)
+    return np.where(np.abs(s) < 1e-10, np.nan, np.cos(x) / s)
+
+def fast_arcsin(x):
+    return np.where(np.abs(x) > 1, np.nan, np.arcsin(np.clip(x, -1, 1)))
+
+def fast_arccos(x):
+    return np.where(np.abs(x) > 1, np.nan, np.arccos(np.clip(x, -1, 1)))
+
+def fast_arcctg(x):
+    return math.pi / 2 - np.arctan(x)
+
+class ReferenceArrayKernels:
+    trig_funcs = TRIG_FUNCS
+    power = staticmethod(power)
+    logarithm = staticmethod(logarithm)
+    factorial = staticmethod(factorial)
+
+class FastArrayKernels:
+    trig_funcs = {
+        'sin': np.sin, 'cos': np.cos, 'tg': fast_tg, 'ctg': fast_ctg,
+        'arcsin': fast_arcsin, 'arccos': fast_arccos, 'arctg': np.arctan, 'arcctg': fast_arcctg
+    }
+    # power, logarithm and factorial already use NumPy's own kernels
+    power = staticmethod(power)
+    logarithm = staticmethod(logarithm)
+    factorial = staticmethod(factorial)
+
+ARRAY_KERNELS = {
+    'reference': ReferenceArrayKernels,
+    'fast': FastArrayKernels,
+}